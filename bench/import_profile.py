@@ -0,0 +1,200 @@
+# pymesec/bench/import_profile.py
+
+"""
+Perfil del tiempo de importación (arranque en frío) de los puntos de entrada.
+
+Importa cada módulo en procesos Python nuevos (sin caché de módulos, como un
+contenedor o un worker recién escalado), mide la mediana y el p95 del tiempo
+de import, lista los módulos que más pesan según `python -X importtime` y
+comprueba que los subsistemas pesados opcionales (SDK de Gemini, ReportLab,
+dnspython, pydnsbl, requests, aiohttp y los escáneres) NO se cargan al
+importar core.api: deben cargarse en su primer uso.
+
+Uso (desde la raíz del repo):
+    python -m bench.import_profile
+    python -m bench.import_profile --runs 10 --top 25
+    python -m bench.import_profile --modules core.api job.main
+    python -m bench.import_profile --save-baseline
+    python -m bench.import_profile --baseline bench/results/imports_baseline.json --threshold 0.25
+
+Sale con código 1 si un módulo pesado se carga al importar o si hay regresiones.
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, "imports_latest.json")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "imports_baseline.json")
+
+DEFAULT_MODULES = ["core.api"]
+
+# Módulos que importar core.api no debe arrastrar (se cargan al primer uso)
+LAZY_MODULES = {
+    "core.api": [
+        "google.generativeai",
+        "reportlab.pdfgen",
+        "dns.resolver",
+        "pydnsbl",
+        "requests",
+        "aiohttp",
+        "scanners.runner",
+        "scanners.net.ping",
+        "scanners.net.custom_ports",
+        "scanners.net.services",
+        "scanners.net.tls",
+        "scanners.web.headers",
+    ],
+}
+
+# Código del proceso hijo: mide el import y devuelve qué quedó cargado
+_CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"import_ms": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    # Sin .pyc nuevos de otra versión ni salida de warnings mezclada con el JSON
+    env.setdefault("PYTHONWARNINGS", "ignore")
+    return env
+
+
+def _run_child(module: str, importtime: bool = False) -> Tuple[Dict[str, Any], str]:
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", _CHILD.format(module=module)]
+    proc = subprocess.run(cmd, cwd=ROOT, env=_env(), capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} falló:\n{proc.stderr[-2000:]}")
+    # El import puede imprimir avisos propios: el JSON es la última línea
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def _parse_importtime(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Módulos con más tiempo acumulado (incluye lo que importan) según -X importtime."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time: <propio us> | <acumulado us> | <módulo indentado>"
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append({
+                "module": name.strip(),
+                "self_ms": round(int(self_us) / 1000, 1),
+                "cumulative_ms": round(int(cumulative_us) / 1000, 1),
+            })
+        except ValueError:
+            continue
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def profile_module(module: str, runs: int, top: int) -> Dict[str, Any]:
+    times = []
+    loaded: List[str] = []
+    for _ in range(runs):
+        data, _stderr = _run_child(module)
+        times.append(data["import_ms"])
+        loaded = data["modules"]
+    _data, stderr = _run_child(module, importtime=True)
+
+    unexpected = [m for m in LAZY_MODULES.get(module, []) if m in loaded]
+    return {
+        "runs": runs,
+        "p50_ms": round(_percentile(times, 0.50), 1),
+        "p95_ms": round(_percentile(times, 0.95), 1),
+        "min_ms": round(min(times), 1),
+        "modules_loaded": len(loaded),
+        "eager_heavy_modules": unexpected,
+        "top": _parse_importtime(stderr, top),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Problemas: módulos pesados cargados al importar o import más lento que la línea base."""
+    problems = []
+    for name, now in current["modules"].items():
+        for heavy in now["eager_heavy_modules"]:
+            problems.append(f"{name}: importa {heavy} al arrancar (debería cargarse al primer uso)")
+        before = baseline.get("modules", {}).get(name)
+        if before and before["p50_ms"] > 0 and now["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            problems.append(f"{name}: import p50 {before['p50_ms']} -> {now['p50_ms']} ms")
+    return problems
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Perfil de tiempo de importación de PYMESec")
+    parser.add_argument("--modules", nargs="*", default=DEFAULT_MODULES, help="módulos a importar")
+    parser.add_argument("--runs", type=int, default=5, help="procesos nuevos por módulo")
+    parser.add_argument("--top", type=int, default=15, help="módulos más costosos a listar")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerancia relativa (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="guardar el resultado como nueva línea base")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "modules": {m: profile_module(m, args.runs, args.top) for m in args.modules},
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = compare(results, baseline or {}, args.threshold)
+    results["regressions"] = problems
+
+    _write_json(args.output, results)
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+
+    for name, r in results["modules"].items():
+        print(f"\n{name}: p50 {r['p50_ms']} ms, p95 {r['p95_ms']} ms, {r['modules_loaded']} módulos cargados")
+        print(f"  {'módulo':<60}{'acum. ms':>10}{'propio ms':>11}")
+        for row in r["top"]:
+            print(f"  {row['module']:<60}{row['cumulative_ms']:>10}{row['self_ms']:>11}")
+    print(f"\nResultados en {args.output}")
+    for p in problems:
+        print(f"[REGRESIÓN] {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# pymesec/bench/loadtest.py
+
+"""
+Prueba de carga reproducible de la API con escáneres e IA simulados.
+
+Levanta `bench.stub_api:app` con uvicorn sobre una BD temporal (o la que se
+indique), siembra usuarios y escaneos, y lanza miles de usuarios virtuales
+con una mezcla realista de peticiones:
+
+    login, history, detail (/scan/{id}), report (/reports/{id}/download),
+    start (/evaluation/start) y ws (/ws/status/{user_id}).
+
+Informa p50/p95/p99, peticiones por segundo y tasa de error por endpoint,
+además del retraso máximo del event loop del servidor (código bloqueante).
+
+Uso (desde la raíz del repo):
+    python -m bench.loadtest --users 2000 --duration 60
+    python -m bench.loadtest --mix login=5,history=40,detail=25,report=10,start=5,ws=15
+    python -m bench.loadtest --workers 4 --database-url postgresql://...   # EVENT_BUS=postgres
+    python -m bench.loadtest --base-url http://127.0.0.1:8000               # API ya levantada
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+try:
+    import websockets
+except ImportError:  # viene con uvicorn[standard]
+    websockets = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "bench", "results", "loadtest.json")
+DEFAULT_MIX = "login=5,history=35,detail=25,report=10,start=5,ws=20"
+PASSWORD = "loadtest-pass"
+
+
+# ============================================================
+#                      ESTADÍSTICAS
+# ============================================================
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def record(self, endpoint: str, latency_ms: float, error: Optional[str] = None):
+        self.latencies[endpoint].append(latency_ms)
+        if error:
+            self.errors[endpoint][error] += 1
+
+    def count(self, name: str):
+        self.counters[name] += 1
+
+    @staticmethod
+    def _pct(ordered: List[float], q: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def summary(self) -> Dict[str, Dict]:
+        elapsed = time.perf_counter() - self.started
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            n_errors = sum(self.errors[endpoint].values())
+            result[endpoint] = {
+                "requests": len(ordered),
+                "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(self._pct(ordered, 0.50), 2),
+                "p95_ms": round(self._pct(ordered, 0.95), 2),
+                "p99_ms": round(self._pct(ordered, 0.99), 2),
+                "max_ms": round(ordered[-1], 2) if ordered else 0.0,
+                "error_rate": round(n_errors / len(ordered), 4) if ordered else 0.0,
+                "errors": dict(self.errors[endpoint]),
+            }
+        return result
+
+
+# ============================================================
+#                 SERVIDOR Y DATOS DE PRUEBA
+# ============================================================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(users: int, scans_per_user: int) -> None:
+    """Crea usuarios (mismo hash bcrypt) y escaneos completados con resultados realistas."""
+    from passlib.context import CryptContext
+    from sqlalchemy import insert
+    from core.db import init_db, SessionLocal, User, ScanResult
+
+    init_db()
+    hashed = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+    vulns = [
+        {
+            "severity": sev,
+            "name": f"Hallazgo {i}",
+            "description": "Descripción de prueba " * 8,
+            "mitigation": "Mitigación de prueba " * 4,
+        }
+        for i, sev in enumerate(["CRITICA", "ALTA", "MEDIA", "MEDIA", "BAJA", "INFO"] * 2)
+    ]
+    results = {
+        "vulnerabilities": vulns,
+        "scan_meta": {"host": "stub.local", "ports": [80, 443]},
+        "ai_summary": "Resumen ejecutivo de prueba. " * 40,
+    }
+    db = SessionLocal()
+    try:
+        ids = db.execute(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [
+                {"name": f"Usuario {i}", "email": f"user{i}@pymesec-load.com",
+                 "hashed_password": hashed, "company_name": "Carga S.A."}
+                for i in range(users)
+            ],
+        ).scalars().all()
+        rows = [
+            {"user_id": uid, "host": "stub.local", "status": "Completed", "results": results}
+            for uid in ids
+            for _ in range(scans_per_user)
+        ]
+        for i in range(0, len(rows), 1000):
+            db.execute(insert(ScanResult), rows[i:i + 1000])
+        db.commit()
+    finally:
+        db.close()
+
+
+def start_server(env: Dict[str, str], port: int, workers: int) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "uvicorn", "bench.stub_api:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=REPO_ROOT, env=env)
+
+
+async def wait_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient(trust_env=False) as client:
+        while time.time() < deadline:
+            try:
+                await client.get(f"{base_url}/docs", timeout=2)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.3)
+    raise RuntimeError(f"La API no respondió en {timeout}s")
+
+
+# ============================================================
+#                    USUARIOS VIRTUALES
+# ============================================================
+
+class VirtualUser:
+    def __init__(self, index: int, client: httpx.AsyncClient, stats: Stats, args):
+        self.index = index
+        self.client = client
+        self.stats = stats
+        self.args = args
+        self.token: Optional[str] = None
+        self.user_id: Optional[int] = None
+        self.scan_ids: List[int] = []
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+            if method == "GET":
+                await resp.aread()
+            error = None if resp.status_code < 400 else str(resp.status_code)
+        except httpx.HTTPError as e:
+            resp, error = None, type(e).__name__
+        self.stats.record(endpoint, (time.perf_counter() - start) * 1000, error)
+        return resp if error is None else None
+
+    # ---------- acciones ----------
+
+    async def login(self):
+        resp = await self._request(
+            "login", "POST", "/api/v1/auth/login",
+            json={"email": f"user{self.index}@pymesec-load.com", "password": PASSWORD},
+        )
+        if resp is not None:
+            data = resp.json()
+            self.token = data["token"]
+            self.user_id = data["user"]["id"]
+
+    async def history(self):
+        resp = await self._request("history", "GET", "/api/v1/evaluation/history", headers=self.headers)
+        if resp is not None:
+            self.scan_ids = [s["id"] for s in resp.json()] or self.scan_ids
+
+    async def detail(self):
+        if self.scan_ids:
+            await self._request(
+                "detail", "GET", f"/api/v1/scan/{random.choice(self.scan_ids)}", headers=self.headers
+            )
+
+    async def report(self):
+        if self.scan_ids:
+            await self._request(
+                "report", "GET", f"/api/v1/reports/{random.choice(self.scan_ids)}/download",
+                headers=self.headers,
+            )
+
+    async def start(self):
+        resp = await self._request(
+            "start", "POST", "/api/v1/evaluation/start",
+            json={"ip_range": "stub.local", "scan_type": "full"}, headers=self.headers,
+        )
+        if resp is not None:
+            self.scan_ids.append(resp.json()["scanId"])
+
+    async def ws(self):
+        """Abre el WebSocket de progreso (con replay), lo mantiene un rato y cierra."""
+        if websockets is None or self.user_id is None:
+            return
+        url = f"{self.args.ws_url}/ws/status/{self.user_id}?since=0"
+        start = time.perf_counter()
+        try:
+            async with websockets.connect(url, open_timeout=30) as conn:
+                self.stats.record("ws_connect", (time.perf_counter() - start) * 1000)
+                deadline = time.perf_counter() + random.uniform(0.5, 2) * self.args.ws_linger
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(conn.recv(), timeout=remaining)
+                        self.stats.count("ws_messages")
+                    except asyncio.TimeoutError:
+                        break
+        except Exception as e:
+            self.stats.record("ws_connect", (time.perf_counter() - start) * 1000, type(e).__name__)
+
+    async def run(self, delay: float, deadline: float, mix: Dict[str, float]):
+        await asyncio.sleep(delay)
+        await self.login()
+        if self.token is None:
+            return
+        await self.history()
+        actions, weights = zip(*mix.items())
+        while time.perf_counter() < deadline:
+            action = random.choices(actions, weights)[0]
+            await getattr(self, action)()
+            await asyncio.sleep(random.expovariate(1000.0 / self.args.think_ms))
+
+
+async def sample_loop_lag(base_url: str, stop: asyncio.Event, out: List[dict]):
+    async with httpx.AsyncClient(base_url=base_url, trust_env=False) as client:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                resp = await client.get("/__bench/loop-lag", timeout=10)
+                if resp.status_code == 200:
+                    out.append(resp.json())
+            except httpx.HTTPError:
+                pass
+
+
+async def run_load(args, base_url: str) -> Dict:
+    mix = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+    unknown = set(mix) - {"login", "history", "detail", "report", "start", "ws"}
+    if unknown:
+        raise SystemExit(f"Acciones desconocidas en --mix: {sorted(unknown)}")
+
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    lag_samples: List[dict] = []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60, trust_env=False) as client:
+        lag_task = asyncio.create_task(sample_loop_lag(base_url, stop, lag_samples))
+        deadline = time.perf_counter() + args.ramp_up + args.duration
+        users = [VirtualUser(i, client, stats, args) for i in range(args.users)]
+        await asyncio.gather(*(
+            u.run(args.ramp_up * i / max(args.users, 1), deadline, mix) for i, u in enumerate(users)
+        ))
+        stop.set()
+        await lag_task
+
+    lag = [s for s in lag_samples if s.get("samples")]
+    return {
+        "endpoints": stats.summary(),
+        "counters": dict(stats.counters),
+        "server_loop_lag": {
+            "max_ms": max((s["max_ms"] for s in lag), default=0.0),
+            "worst_p99_ms": max((s["p99_ms"] for s in lag), default=0.0),
+            "snapshots": len(lag),
+        },
+    }
+
+
+# ============================================================
+#                          CLI
+# ============================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de PYMESec")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="segundos de carga sostenida")
+    parser.add_argument("--ramp-up", type=float, default=10, help="segundos hasta tener a todos los usuarios")
+    parser.add_argument("--think-ms", type=float, default=1000, help="pausa media entre acciones")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos por acción")
+    parser.add_argument("--connections", type=int, default=200, help="conexiones HTTP simultáneas del cliente")
+    parser.add_argument("--ws-linger", type=float, default=5, help="segundos medios con el WebSocket abierto")
+    parser.add_argument("--scans-per-user", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn")
+    parser.add_argument("--database-url", help="BD a usar (por defecto una SQLite temporal)")
+    parser.add_argument("--base-url", help="usar una API ya levantada (ya sembrada) en lugar de arrancarla")
+    parser.add_argument("--seed", type=int, default=1234, help="semilla aleatoria (reproducibilidad)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="tasa de error tolerada por endpoint")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url.rstrip("/")
+    else:
+        env = dict(os.environ)
+        env["DATABASE_URL"] = args.database_url or (
+            f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='pymesec_load_'), 'load.db')}"
+        )
+        env.setdefault("EVENT_BUS", "postgres" if env["DATABASE_URL"].startswith("postgres") else "local")
+        env["GEMINI_API_KEY"] = ""
+        # Una sola clave para todos los workers (la API no arranca sin ella)
+        env.setdefault("AUTH_SECRET", os.urandom(24).hex())
+        env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        os.environ["DATABASE_URL"] = env["DATABASE_URL"]
+        print(f"[Load] Sembrando {args.users} usuarios y {args.users * args.scans_per_user} escaneos...")
+        seed(args.users, args.scans_per_user)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(env, port, args.workers)
+
+    args.ws_url = base_url.replace("http", "ws", 1)
+    try:
+        asyncio.run(wait_ready(base_url))
+        print(f"[Load] {args.users} usuarios contra {base_url} durante {args.duration}s...")
+        report = asyncio.run(run_load(args, base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report["meta"] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("ws_url",)},
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'endpoint':<12}{'reqs':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>8}")
+    failing = []
+    for name, s in report["endpoints"].items():
+        print(f"{name:<12}{s['requests']:>8}{s['rps']:>9}{s['p50_ms']:>9}{s['p95_ms']:>9}"
+              f"{s['p99_ms']:>9}{s['error_rate'] * 100:>7.2f}%")
+        if s["error_rate"] > args.max_error_rate:
+            failing.append(name)
+    for name, value in report["counters"].items():
+        print(f"{name}: {value}")
+    lag = report["server_loop_lag"]
+    print(f"\nRetraso del event loop del servidor: máx {lag['max_ms']} ms, p99 peor {lag['worst_p99_ms']} ms")
+    print(f"Resultados en {args.output}")
+    if failing:
+        print(f"[ERROR] Tasa de error por encima de {args.max_error_rate:.2%} en: {', '.join(failing)}")
+    return 1 if failing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
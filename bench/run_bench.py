@@ -0,0 +1,351 @@
+# pymesec/bench/run_bench.py
+
+"""
+Benchmarks offline de los escáneres contra un objetivo local (bench/stub_target.py).
+
+Mide latencia (p50/p95/media, llamadas en serie) y throughput (llamadas
+concurrentes por segundo) de crawl_site, fingerprint, check_sqli, check_xss (sobre la URL
+y sobre el inventario del crawler), check_directories, check_headers,
+scan_ports_native, detect_services, tls_info y un run_scan_real completo
+(herramientas externas e IA sustituidas por stubs), comprueba que cada
+escáner siga detectando lo que el objetivo expone y compara con una línea
+base para marcar regresiones. No sale a la red: todo va a 127.0.0.1.
+
+Uso (desde la raíz del repo):
+    python -m bench.run_bench
+    python -m bench.run_bench --latency-ms 50 --tls --iterations 50
+    python -m bench.run_bench --save-baseline
+    python -m bench.run_bench --baseline bench/results/baseline.json --threshold 0.25
+
+Sale con código 1 si hay regresiones o detecciones perdidas.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Antes de importar core/: BD temporal, bus local, IA desactivada y sin proxies
+_TMPDIR = tempfile.mkdtemp(prefix="pymesec_bench_db_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMPDIR, 'bench.db')}"
+os.environ["EVENT_BUS"] = "local"
+os.environ["GEMINI_API_KEY"] = ""
+os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+
+from bench.stub_target import StubTarget, HOST, EXPOSED_PATHS, FORBIDDEN_PATHS  # noqa: E402
+from scanners.web.crawler import crawl_site  # noqa: E402
+from scanners.web.fingerprint import fingerprint  # noqa: E402
+from scanners.web.sqli import check_sqli  # noqa: E402
+from scanners.web.xxs import check_xss  # noqa: E402
+from scanners.web.enum import check_directories  # noqa: E402
+from scanners.web.headers import check_headers  # noqa: E402
+from scanners.net import custom_ports  # noqa: E402
+from scanners.net.custom_ports import scan_ports_native  # noqa: E402
+from scanners.net.services import detect_services  # noqa: E402
+from scanners.net.tls import tls_info  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, "latest.json")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+
+
+# ============================================================
+#                        MEDICIÓN
+# ============================================================
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+async def measure(
+    call: Callable[[], Awaitable[Any]],
+    check: Callable[[Any], bool],
+    iterations: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Latencia en serie + throughput con `concurrency` llamadas simultáneas."""
+    result = await call()  # calentamiento (y comprobación de detección)
+    detected = bool(check(result))
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded():
+        async with semaphore:
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded() for _ in range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "p50_ms": round(_percentile(latencies, 0.50), 2),
+        "p95_ms": round(_percentile(latencies, 0.95), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "throughput_per_s": round(iterations / elapsed, 2) if elapsed > 0 else 0.0,
+        "detected": detected,
+    }
+
+
+def _closed_ports(n: int) -> List[int]:
+    """Puertos locales libres (cerrados) para medir también el camino de 'connection refused'."""
+    ports = []
+    for _ in range(n):
+        with socket.socket() as s:
+            s.bind((HOST, 0))
+            ports.append(s.getsockname()[1])
+    return ports
+
+
+# ============================================================
+#                   ESCANEO COMPLETO (STUBS)
+# ============================================================
+
+class FullScan:
+    """Prepara la BD temporal y sustituye herramientas externas e IA por stubs."""
+
+    def __init__(self, target: StubTarget, tool_ms: float):
+        self.target = target
+        self.tool_ms = tool_ms
+        self.user_id: Optional[int] = None
+
+    def setup(self):
+        from core import api
+        from core.db import init_db, SessionLocal, User
+
+        async def stub_tool(url, endpoints=None):
+            await asyncio.sleep(self.tool_ms / 1000.0)
+            return []
+
+        for name in ("scan_nuclei", "scan_dirsearch", "scan_sqlmap", "scan_xsstrike"):
+            setattr(api, name, stub_tool)
+        # El reconocimiento solo debe tocar los puertos del objetivo local
+        custom_ports.TARGET_PORTS = list(self.target.open_ports)
+
+        init_db()
+        db = SessionLocal()
+        try:
+            user = User(name="bench", email="bench@localhost", hashed_password="-")
+            db.add(user)
+            db.commit()
+            self.user_id = user.id
+        finally:
+            db.close()
+
+    async def run(self) -> Dict[str, Any]:
+        from core import api
+        from core.db import SessionLocal, ScanResult
+
+        db = SessionLocal()
+        row = ScanResult(user_id=self.user_id, host=HOST, status="Pending", results={})
+        db.add(row)
+        db.commit()
+        scan_id = row.id
+        db.close()
+
+        await api.run_scan_real(self.user_id, scan_id, self.target.base_url, SessionLocal())
+
+        db = SessionLocal()
+        try:
+            done = db.get(ScanResult, scan_id)
+            return {"status": done.status, "results": done.results or {}}
+        finally:
+            db.close()
+
+    async def close(self):
+        from core.writer import get_writer
+        await get_writer().close()
+
+
+# ============================================================
+#                     SUITE Y REGRESIONES
+# ============================================================
+
+async def run_suite(args) -> Dict[str, Any]:
+    benchmarks: Dict[str, Any] = {}
+    async with StubTarget(latency_ms=args.latency_ms, tls=args.tls) as target:
+        closed = _closed_ports(3)
+        expected_dirs = len(EXPOSED_PATHS) + len(FORBIDDEN_PATHS)
+
+        def crawled_params(r):
+            found = {(e["method"], e["url"].rsplit("/", 1)[-1], n) for e in r.get("endpoints", []) for n in e["params"]}
+            return {("GET", "item", "id"), ("GET", "search", "q"), ("POST", "login", "user")} <= found
+
+        inventory = (await crawl_site(target.base_url))["endpoints"]
+
+        def web_only(r):
+            # Solo los puertos HTTP(S) del objetivo son web; los listeners TCP no
+            expected = {target.base_url} | ({target.https_url} if target.https_port else set())
+            return set(r.get("web", [])) == expected
+
+        cases = {
+            "crawl_site": (
+                lambda: crawl_site(target.base_url),
+                crawled_params,
+            ),
+            "fingerprint": (
+                lambda: fingerprint(target.base_url, ports=target.open_ports),
+                lambda r: {"php", "wordpress"} <= set(r.get("technologies", {})) and "wordpress" in r.get("tags", []),
+            ),
+            "check_sqli_crawled": (
+                lambda: check_sqli(target.base_url, inventory),
+                lambda r: len(r.get("findings", [])) >= 2,
+            ),
+            "check_xss_crawled": (
+                lambda: check_xss(target.base_url, inventory),
+                lambda r: r.get("vulnerable"),
+            ),
+            "check_sqli": (
+                lambda: check_sqli(target.sqli_url),
+                lambda r: r.get("vulnerable"),
+            ),
+            "check_xss": (
+                lambda: check_xss(target.xss_url),
+                lambda r: r.get("vulnerable"),
+            ),
+            "check_directories": (
+                lambda: check_directories(target.base_url),
+                lambda r: r.get("found") == expected_dirs,
+            ),
+            "check_headers": (
+                lambda: check_headers(target.base_url),
+                lambda r: len(r.get("findings", [])) >= 6,
+            ),
+            "scan_ports_native": (
+                lambda: scan_ports_native(HOST, target.open_ports + closed),
+                lambda r: sorted(r) == sorted(target.open_ports),
+            ),
+            "detect_services": (
+                lambda: detect_services(HOST, target.open_ports),
+                web_only,
+            ),
+        }
+        if target.https_port:
+            cases["tls_info"] = (
+                lambda: tls_info(HOST, target.https_port),
+                lambda r: bool(r) and str(r.get("version", "")).startswith("TLS"),
+            )
+
+        for name, (call, check) in cases.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"[Bench] {name}...")
+            benchmarks[name] = await measure(call, check, args.iterations, args.concurrency)
+
+        if not args.only or "run_scan_real" in args.only:
+            print("[Bench] run_scan_real...")
+            full = FullScan(target, args.tool_ms)
+            full.setup()
+            try:
+                benchmarks["run_scan_real"] = await measure(
+                    full.run,
+                    lambda r: r["status"] == "Completed" and len(r["results"].get("vulnerabilities", [])) > 0,
+                    args.scan_iterations,
+                    args.concurrency,
+                )
+            finally:
+                await full.close()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "latency_ms": args.latency_ms,
+                "tls": args.tls,
+                "tool_ms": args.tool_ms,
+                "iterations": args.iterations,
+                "scan_iterations": args.scan_iterations,
+                "concurrency": args.concurrency,
+            },
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Regresiones: p50 más lento o throughput más bajo que la línea base más allá del umbral."""
+    problems = []
+    if baseline and current["meta"]["config"] != baseline.get("meta", {}).get("config"):
+        print("[Bench] Aviso: la configuración difiere de la línea base; la comparación es orientativa.")
+    for name, now in current["benchmarks"].items():
+        if not now["detected"]:
+            problems.append(f"{name}: ya no detecta lo que expone el objetivo")
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before:
+            continue
+        if before["p50_ms"] > 0 and now["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            problems.append(f"{name}: p50 {before['p50_ms']} -> {now['p50_ms']} ms")
+        if before["throughput_per_s"] > 0 and now["throughput_per_s"] < before["throughput_per_s"] * (1 - threshold):
+            problems.append(
+                f"{name}: throughput {before['throughput_per_s']} -> {now['throughput_per_s']} /s"
+            )
+    return problems
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline de los escáneres de PYMESec")
+    parser.add_argument("--iterations", type=int, default=20, help="llamadas por escáner")
+    parser.add_argument("--scan-iterations", type=int, default=5, help="escaneos completos")
+    parser.add_argument("--concurrency", type=int, default=10, help="llamadas simultáneas al medir throughput")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia artificial del objetivo")
+    parser.add_argument("--tls", action="store_true", help="levantar también el listener HTTPS")
+    parser.add_argument("--tool-ms", type=float, default=50.0, help="duración de cada herramienta externa simulada")
+    parser.add_argument("--only", nargs="*", help="ejecutar solo estos benchmarks")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerancia relativa (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="guardar el resultado como nueva línea base")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_suite(args))
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = compare(results, baseline or {}, args.threshold)
+    results["regressions"] = problems
+
+    _write_json(args.output, results)
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+
+    print(f"\n{'benchmark':<20}{'p50 ms':>10}{'p95 ms':>10}{'ops/s':>10}  detecta")
+    for name, r in results["benchmarks"].items():
+        print(f"{name:<20}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['throughput_per_s']:>10}  {'sí' if r['detected'] else 'NO'}")
+    print(f"\nResultados en {args.output}")
+    for p in problems:
+        print(f"[REGRESIÓN] {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# pymesec/bench/stub_api.py
+
+"""
+API real (core.api) con escáneres e IA sustituidos por stubs, para pruebas de
+carga. Se arranca con uvicorn ("bench.stub_api:app"); cada worker aplica los
+stubs al importar este módulo.
+
+Añade GET /__bench/loop-lag: retraso del event loop del worker que responde
+(máximo y p99 desde la última consulta), para detectar código bloqueante.
+"""
+
+import os
+import time
+import asyncio
+from typing import List
+
+from core import api
+
+# Duración simulada de cada herramienta externa y del análisis de IA (ms)
+STUB_TOOL_MS = float(os.getenv("STUB_TOOL_MS", "200"))
+STUB_AI_MS = float(os.getenv("STUB_AI_MS", "0"))
+# Periodo del monitor de retraso del event loop (ms)
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "20"))
+
+STUB_FINDINGS = [
+    {
+        "severity": "MEDIA",
+        "name": "Recurso Oculto Expuesto",
+        "description": "Ruta sensible accesible: /.env (Código 200)",
+        "mitigation": "Restringir acceso o eliminar si no es necesario.",
+    }
+]
+
+
+def install_stubs(tool_ms: float = STUB_TOOL_MS, ai_ms: float = STUB_AI_MS):
+    """Sustituye red, herramientas externas y Gemini por respuestas fijas con latencia simulada."""
+
+    async def tool(url, endpoints=None):
+        await asyncio.sleep(tool_ms / 1000.0)
+        return list(STUB_FINDINGS)
+
+    async def fp(url, headers=None, tls=None, ports=None):
+        await asyncio.sleep(0.01)
+        return {"technologies": {"nginx": ["cabecera server: nginx"]}, "tags": ["nginx"], "full_scan": False}
+
+    async def crawl(url):
+        await asyncio.sleep(0.01)
+        return {"start": url, "pages": 1, "endpoints": [
+            {"method": "GET", "url": url, "params": {"id": "1"}, "source": url},
+        ], "truncated": False}
+
+    async def services(host, ports):
+        await asyncio.sleep(0.01)
+        return {"services": [
+            {"port": 80, "service": "http", "tls": False, "banner": "HTTP/1.1 200 OK"},
+            {"port": 443, "service": "https", "tls": True, "banner": "HTTP/1.1 200 OK"},
+        ], "web": [f"https://{host}", f"http://{host}"], "tls_ports": [443]}
+
+    async def ping(host):
+        return True
+
+    async def ports(host, ports=None):
+        await asyncio.sleep(0.01)
+        return [80, 443]
+
+    async def headers(url):
+        await asyncio.sleep(0.01)
+        return {"findings": ["Cabecera faltante: Content-Security-Policy"], "headers": {"Server": "stub"}}
+
+    async def tls(host, port=443):
+        await asyncio.sleep(0.01)
+        return {"issuer": "Stub CA", "expires": "N/A", "version": "TLSv1.3"}
+
+    def summary(scan_data):
+        # Misma forma que la real: función síncrona llamada desde el event loop
+        if ai_ms:
+            time.sleep(ai_ms / 1000.0)
+        return "Resumen ejecutivo simulado para pruebas de carga."
+
+    for name in ("scan_nuclei", "scan_dirsearch", "scan_sqlmap", "scan_xsstrike"):
+        setattr(api, name, tool)
+    api.check_ping = ping
+    api.scan_ports_native = ports
+    api.detect_services = services
+    api.check_headers = headers
+    api.tls_info = tls
+    api.crawl_site = crawl
+    api.fingerprint = fp
+    api.generate_executive_summary = summary
+
+
+class LoopLagMonitor:
+    """Mide cuánto se retrasa un sleep corto: el exceso es tiempo con el loop bloqueado."""
+
+    def __init__(self, interval_ms: float = LOOP_LAG_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.samples: List[float] = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append((time.perf_counter() - start - self.interval) * 1000)
+
+    def snapshot(self) -> dict:
+        samples, self.samples = sorted(self.samples), []
+        if not samples:
+            return {"samples": 0, "max_ms": 0.0, "p99_ms": 0.0}
+        return {
+            "samples": len(samples),
+            "max_ms": round(samples[-1], 2),
+            "p99_ms": round(samples[int((len(samples) - 1) * 0.99)], 2),
+            "pid": os.getpid(),
+        }
+
+
+install_stubs()
+lag_monitor = LoopLagMonitor()
+app = api.app
+
+
+@app.on_event("startup")
+async def _start_lag_monitor():
+    lag_monitor.start()
+
+
+@app.get("/__bench/loop-lag", include_in_schema=False)
+def loop_lag():
+    return lag_monitor.snapshot()
@@ -0,0 +1,279 @@
+# pymesec/bench/stub_target.py
+
+"""
+Objetivo vulnerable de mentira para los benchmarks (todo en 127.0.0.1).
+
+- App web (aiohttp) con un parámetro inyectable por SQLi (/item?id=) que
+  devuelve errores de MySQL, otro reflejado sin escapar (/search?q=) para
+  XSS, un formulario POST inyectable (/login) enlazado desde /catalog para
+  el crawler, y algunas rutas de PATHS_TO_CHECK expuestas (200) o
+  protegidas (403).
+- Cabeceras de seguridad ausentes salvo que se pidan; X-Powered-By de PHP y
+  portada con generator de WordPress (para el fingerprinting).
+- Latencia artificial configurable por petición.
+- Opcionalmente una copia HTTPS con certificado autofirmado.
+- Listeners TCP extra que aceptan y cierran (para el escaneo de puertos).
+"""
+
+import os
+import ssl
+import asyncio
+import tempfile
+import subprocess
+from typing import List, Optional
+
+from aiohttp import web
+
+from scanners.web.enum import PATHS_TO_CHECK
+
+HOST = "127.0.0.1"
+
+# Rutas de PATHS_TO_CHECK que la app expone y las que protege
+EXPOSED_PATHS = PATHS_TO_CHECK[:3]
+FORBIDDEN_PATHS = PATHS_TO_CHECK[3:5]
+
+SQL_ERROR_PAGE = (
+    "<html><body><h1>Database error</h1>"
+    "<p>You have an error in your SQL syntax; check the manual that corresponds "
+    "to your MySQL server version for the right syntax to use near '{value}'</p>"
+    "</body></html>"
+)
+
+SECURE_HEADERS = {
+    "Strict-Transport-Security": "max-age=31536000",
+    "Content-Security-Policy": "default-src 'self'",
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "Referrer-Policy": "no-referrer",
+    "Permissions-Policy": "geolocation=()",
+}
+
+
+def _self_signed_cert(directory: str) -> Optional[tuple]:
+    """Certificado autofirmado para localhost (cryptography o, si no, el CLI de openssl)."""
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    try:
+        import datetime
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, "localhost"),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "PYMESec Bench"),
+        ])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .sign(key, hashes.SHA256())
+        )
+        with open(cert_path, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        with open(key_path, "wb") as f:
+            f.write(key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            ))
+        return cert_path, key_path
+    except ImportError:
+        pass
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+             "-nodes", "-days", "30", "-subj", "/CN=localhost/O=PYMESec Bench",
+             "-keyout", key_path, "-out", cert_path],
+            check=True, capture_output=True, timeout=30,
+        )
+        return cert_path, key_path
+    except Exception:
+        return None
+
+
+class StubTarget:
+    """
+    Arranca la app y los listeners en puertos efímeros:
+
+        async with StubTarget(latency_ms=20, tls=True) as target:
+            await check_sqli(target.sqli_url)
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        tls: bool = False,
+        secure_headers: bool = False,
+        tcp_listeners: int = 3,
+    ):
+        self.latency = latency_ms / 1000.0
+        self.tls = tls
+        self.secure_headers = secure_headers
+        self.tcp_listeners = tcp_listeners
+        self.requests = 0
+        self.http_port: Optional[int] = None
+        self.https_port: Optional[int] = None
+        self.tcp_ports: List[int] = []
+        self._runner: Optional[web.AppRunner] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._tmpdir: Optional[tempfile.TemporaryDirectory] = None
+
+    # ---------- URLs útiles ----------
+
+    @property
+    def host(self) -> str:
+        return HOST
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{HOST}:{self.http_port}"
+
+    @property
+    def https_url(self) -> Optional[str]:
+        return f"https://{HOST}:{self.https_port}" if self.https_port else None
+
+    @property
+    def sqli_url(self) -> str:
+        return f"{self.base_url}/item?id=1"
+
+    @property
+    def xss_url(self) -> str:
+        return f"{self.base_url}/search?q=hola"
+
+    @property
+    def open_ports(self) -> List[int]:
+        ports = [self.http_port] + self.tcp_ports
+        if self.https_port:
+            ports.append(self.https_port)
+        return ports
+
+    # ---------- app ----------
+
+    def _app(self) -> web.Application:
+        @web.middleware
+        async def latency(request, handler):
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            response = await handler(request)
+            response.headers["X-Powered-By"] = "PHP/8.2.12"
+            if self.secure_headers:
+                response.headers.update(SECURE_HEADERS)
+            return response
+
+        async def index(request):
+            return web.Response(
+                text='<html><head><meta name="generator" content="WordPress 6.4.2"></head>'
+                     '<body><a href="/item?id=1">item</a> <a href="/catalog">catálogo</a> '
+                     '<form action="/search"><input name="q"></form></body></html>',
+                content_type="text/html",
+            )
+
+        async def catalog(request):
+            # Enlaces repetidos con otros valores (mismo endpoint) y un formulario POST
+            return web.Response(
+                text='<html><body><a href="/item?id=2">2</a> <a href="/item?id=3#top">3</a> '
+                     '<a href="mailto:ventas@example.com">ventas</a> '
+                     '<form action="/login" method="post"><input name="user"> '
+                     '<input type="password" name="password"><input type="submit" value="Entrar"></form>'
+                     '</body></html>',
+                content_type="text/html",
+            )
+
+        async def login(request):
+            form = await request.post()
+            user = form.get("user", "")
+            if "'" in user or '"' in user:
+                return web.Response(
+                    status=500, text=SQL_ERROR_PAGE.format(value=user), content_type="text/html"
+                )
+            return web.Response(text="<html><body>Credenciales incorrectas</body></html>", content_type="text/html")
+
+        async def item(request):
+            value = request.query.get("id", "")
+            # Parámetro inyectable: cualquier comilla rompe la "consulta"
+            if "'" in value or '"' in value:
+                return web.Response(
+                    status=500, text=SQL_ERROR_PAGE.format(value=value), content_type="text/html"
+                )
+            return web.Response(text=f"<html><body>Item {value}</body></html>", content_type="text/html")
+
+        async def search(request):
+            # Reflejo sin escapar de todos los parámetros
+            echoed = " ".join(request.query.values())
+            return web.Response(
+                text=f"<html><body>Resultados para: {echoed}</body></html>", content_type="text/html"
+            )
+
+        async def path(request):
+            if request.path in EXPOSED_PATHS:
+                return web.Response(text="secreto\n")
+            if request.path in FORBIDDEN_PATHS:
+                return web.Response(status=403, text="Forbidden")
+            return web.Response(status=404, text="Not Found")
+
+        app = web.Application(middlewares=[latency])
+        app.router.add_get("/", index)
+        app.router.add_get("/item", item)
+        app.router.add_get("/catalog", catalog)
+        app.router.add_post("/login", login)
+        app.router.add_get("/search", search)
+        app.router.add_get("/{tail:.*}", path)
+        return app
+
+    # ---------- ciclo de vida ----------
+
+    async def start(self) -> "StubTarget":
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, HOST, 0)
+        await site.start()
+        self.http_port = site._server.sockets[0].getsockname()[1]
+
+        if self.tls:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="pymesec_bench_")
+            pair = _self_signed_cert(self._tmpdir.name)
+            if pair is None:
+                print("[Bench] Sin cryptography ni openssl: se omite el listener TLS.")
+            else:
+                ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                ssl_ctx.load_cert_chain(*pair)
+                tls_site = web.TCPSite(self._runner, HOST, 0, ssl_context=ssl_ctx)
+                await tls_site.start()
+                self.https_port = tls_site._server.sockets[0].getsockname()[1]
+
+        async def accept_and_close(reader, writer):
+            writer.close()
+
+        for _ in range(self.tcp_listeners):
+            server = await asyncio.start_server(accept_and_close, HOST, 0)
+            self._servers.append(server)
+            self.tcp_ports.append(server.sockets[0].getsockname()[1])
+        return self
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    async def __aenter__(self) -> "StubTarget":
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
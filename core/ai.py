@@ -2,9 +2,12 @@
 
 import os
 import json
-import google.generativeai as genai
+import threading
 from dotenv import load_dotenv
 
+from .metrics import ai_timer
+from .findings import Severity, normalize_findings
+
 # ============================================================
 #               CARGA DE VARIABLES DE ENTORNO
 # ============================================================
@@ -15,13 +18,28 @@ load_dotenv()
 # Clave de API de Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+if not GEMINI_API_KEY:
     # No lanzamos excepción para no botar el backend; solo avisamos.
     print("⚠️ ADVERTENCIA: GEMINI_API_KEY no encontrada en variables de entorno. "
           "El análisis de IA no estará disponible.")
 
+# El SDK de Gemini tarda ~1 s en importarse: se carga y configura con la
+# primera llamada a la IA, no al importar este módulo (ni core.api)
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """Módulo google.generativeai ya configurado con GEMINI_API_KEY."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                _genai = genai
+    return _genai
+
 
 # ============================================================
 #                     MOTOR DE RIESGO
@@ -49,15 +67,11 @@ class RiskEngine:
         # Pesos basados en severidades tipo CVSS simplificadas.
         # Cuanto mayor es el peso, mayor impacto negativo en el puntaje.
         self.weights = {
-            "CRITICA": 10.0,
-            "CRITICAL": 10.0,
-            "ALTA": 6.0,
-            "HIGH": 6.0,
-            "MEDIA": 3.0,
-            "MEDIUM": 3.0,
-            "BAJA": 1.0,
-            "LOW": 1.0,
-            "INFO": 0.1,
+            Severity.CRITICA: 10.0,
+            Severity.ALTA: 6.0,
+            Severity.MEDIA: 3.0,
+            Severity.BAJA: 1.0,
+            Severity.INFO: 0.1,
         }
         # Puntuación máxima teórica para normalizar (por ejemplo, 100 puntos de daño).
         self.RMAX = 100.0
@@ -67,7 +81,8 @@ class RiskEngine:
         Calcula el Índice de Seguridad Global (ISG).
 
         Recibe:
-            vulnerabilities: lista de dicts con al menos la clave "severity".
+            vulnerabilities: lista de Finding (core/findings.py) o de dicts
+                             con al menos la clave "severity".
 
         Retorna:
             (score, label) donde:
@@ -78,19 +93,8 @@ class RiskEngine:
         if not vulnerabilities:
             return 100.0, "RIESGO BAJO"
 
-        total_risk_score = 0.0
-
-        for vuln in vulnerabilities:
-            severity = vuln.get("severity", "INFO").upper()
-            weight = 0.1  # Valor mínimo por defecto
-
-            # Buscar el peso correspondiente a la severidad
-            for key, val in self.weights.items():
-                if key in severity:
-                    weight = val
-                    break
-
-            total_risk_score += weight
+        # La severidad ya viene normalizada: el peso es una búsqueda directa
+        total_risk_score = sum(self.weights[f.severity] for f in normalize_findings(vulnerabilities))
 
         # Limitamos el "daño" máximo a 100 para no desbordar el rango
         damage = min(total_risk_score, 100.0)
@@ -144,11 +148,12 @@ class ExplainEngine:
             )
 
         try:
-            vulnerabilities = scan_data.get("vulnerabilities", [])
-            # Resumen ligero de hallazgos para pasarle al modelo
+            vulnerabilities = normalize_findings(scan_data.get("vulnerabilities", []))
+            # Resumen ligero de hallazgos para pasarle al modelo: los más graves primero
+            ranked = sorted(vulnerabilities, key=lambda f: f.severity, reverse=True)
             vulns_summary = [
-                f"- {v.get('severity', 'INFO')}: {v.get('name', 'Unknown')}"
-                for v in vulnerabilities[:15]  # Top 15 para no saturar el prompt
+                f"- {f.severity.name}: {f.name or 'Unknown'}"
+                for f in ranked[:15]  # Top 15 para no saturar el prompt
             ]
 
             target = scan_data.get("scan_meta", {}).get("host", "Objetivo")
@@ -222,10 +227,11 @@ Requisitos de formato:
 """
 
             # Modelo de Gemini a utilizar (versión rápida 2.5)
-            model = genai.GenerativeModel("gemini-2.5-flash")
+            model = get_genai().GenerativeModel("gemini-2.5-flash")
 
             # Llamada al modelo
-            response = model.generate_content(prompt)
+            with ai_timer("executive_summary"):
+                response = model.generate_content(prompt)
 
             # Extraemos el texto puro
             text = getattr(response, "text", None)
@@ -9,70 +9,202 @@ from fastapi import (
     Header,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from datetime import datetime, date, timezone
 import asyncio
+import importlib
+import threading
+import os
 import io
+import re
 import json
+import ipaddress
+from urllib.parse import urlsplit
 
-import dns.resolver        # Para SPF/DMARC
-import requests            # Para futuras consultas externas si quieres
-import pydnsbl             # Para listas negras (RBL)
-
-from passlib.context import CryptContext
-
-# ReportLab para PDF
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.utils import simpleSplit
+# dnspython/pydnsbl (email-check) y ReportLab (PDF) se importan dentro de sus
+# rutas: un worker que nunca genera un informe no paga su carga al arrancar.
 
 # BD y modelos
-from .db import get_db, init_db, ScanResult as DBScanResult, User as DBUser
+from .db import (
+    get_db,
+    init_db,
+    ScanResult as DBScanResult,
+    User as DBUser,
+    CompanyConfig as DBCompanyConfig,
+)
 
-# IA (Gemini) – usamos el motor que definiste en core/ai.py
+# IA (Gemini) – usamos el motor que definiste en core/ai.py (el SDK se carga al primer uso)
 from .ai import generate_executive_summary
 
-# --- IMPORTS DE ESCÁNERES REALES ---
-try:
-    from scanners.net.ping import check_ping
-    from scanners.net.custom_ports import scan_ports_native
-    from scanners.net.tls import tls_info
-    from scanners.web.headers import check_headers
-    from scanners.runner import scan_nuclei, scan_dirsearch, scan_sqlmap, scan_xsstrike
-except ImportError as e:
-    print(f"⚠️ Error importando escáneres reales: {e}. Usando modo simulación para evitar caídas.")
+# Rollups diarios de riesgo (tendencias)
+from .rollups import get_trends, update_rollups
+
+# Fan-out de WebSockets
+from .hub import ConnectionHub
+
+# Bus de eventos entre procesos (LISTEN/NOTIFY o local)
+from .events import get_event_bus
+
+# Log de progreso con número de secuencia (replay al reconectar)
+from .progress import events_since
+
+# Tokens firmados y caché de usuarios
+from .auth import TokenError, check_secret, decode_token, issue_token, principals
+
+# Hashing de contraseñas en un pool de procesos con cola acotada
+from .passwords import get_hasher, HashPoolBusy
+
+# Persistencia write-behind (lotes de inserts/updates)
+from .writer import get_writer
+
+# Métricas Prometheus (/metrics)
+from .metrics import PROMETHEUS_AVAILABLE, SCANS_TOTAL, register_queue, render_latest
+
+# Línea de tiempo por escaneo (exportable a Chrome trace-event)
+from .trace import start_trace, finish_trace, span, to_chrome_trace
+
+# Inventario de objetivos del scheduler
+from .inventory import upsert_api_target, remove_api_target
+
+# Deduplicación de escaneos idénticos (en curso y recientes)
+from .flights import FlightRegistry, scan_key, scope_of, find_reusable, reused_results
+
+# Presupuesto de tiempo total por escaneo
+from .deadline import SCAN_DEADLINE_S, set_deadline
+
+# Checkpoints, latido y reanudación de escaneos interrumpidos
+from .recovery import (
+    SCAN_HEARTBEAT_S,
+    WORKER_ID,
+    heartbeat,
+    release,
+    claim_interrupted,
+    cancel_orphaned,
+)
+
+# Ejecución del escaneo como DAG de etapas
+from .pipeline import Stage, ScanContext, AbortScan, run_dag
+
+# Hallazgos normalizados (severidad canónica)
+from .findings import Severity, count_by_severity, dump_findings, load_findings, normalize_findings
+
+# Salida cruda de las herramientas (evidencias comprimidas en disco)
+from .blobs import collect_evidence, get_blob_store
+
+# Retención y compactación de scan_results
+from .retention import RETENTION_INTERVAL_S, run_retention
+
+# --- ESCÁNERES REALES (carga diferida) ---
+# Cada módulo de escáner se importa la primera vez que se usa (o en segundo
+# plano tras el arranque, ver PRELOAD_SCANNERS): importar core.api ya no carga
+# aiohttp ni el runner de herramientas. Si un módulo falta, ese escáner pasa a
+# modo simulación para evitar caídas.
+
+# "1": tras el arranque, un hilo importa los escáneres para que el primer
+# escaneo no bloquee el event loop importándolos. "0": solo al primer uso.
+PRELOAD_SCANNERS = os.getenv("PRELOAD_SCANNERS", "1") == "1"
+
 
-    async def check_ping(h: str) -> bool:
-        # Simulamos host siempre vivo
-        return True
+async def _sim_ping(h: str, *args) -> bool:
+    # Simulamos host siempre vivo
+    return True
 
-    async def scan_ports_native(h: str):
-        # Simulamos puertos 80 y 443 abiertos
-        return [80, 443]
 
-    async def tls_info(h: str):
-        return {}
+async def _sim_ports(h: str, *args):
+    # Simulamos puertos 80 y 443 abiertos
+    return [80, 443]
 
-    async def check_headers(u: str):
-        return {"findings": []}
 
-    async def scan_nuclei(u: str):
-        return []
+async def _sim_tls(h: str, *args):
+    return {}
 
-    async def scan_dirsearch(u: str):
-        return []
 
-    async def scan_sqlmap(u: str):
-        return []
+async def _sim_services(h: str, *args):
+    # Sin mapa de servicios: se decide por puertos 80/443 y por la URL
+    return None
 
-    async def scan_xsstrike(u: str):
-        return []
+
+async def _sim_headers(u: str, *args):
+    return {"findings": []}
+
+
+async def _sim_tool(u: str, *args):
+    return []
+
+
+async def _sim_crawl(u: str, *args):
+    # Sin inventario: sqlmap y XSStrike vuelven a rastrear por su cuenta
+    return None
+
+
+async def _sim_fingerprint(u: str, *args, **kwargs):
+    # Sin fingerprinting: nuclei lanza todas sus plantillas
+    return None
+
+
+SCANNER_MODULES = {
+    "check_ping": ("scanners.net.ping", _sim_ping),
+    "scan_ports_native": ("scanners.net.custom_ports", _sim_ports),
+    "detect_services": ("scanners.net.services", _sim_services),
+    "tls_info": ("scanners.net.tls", _sim_tls),
+    "check_headers": ("scanners.web.headers", _sim_headers),
+    "crawl_site": ("scanners.web.crawler", _sim_crawl),
+    "fingerprint": ("scanners.web.fingerprint", _sim_fingerprint),
+    "scan_nuclei": ("scanners.runner", _sim_tool),
+    "scan_dirsearch": ("scanners.runner", _sim_tool),
+    "scan_sqlmap": ("scanners.runner", _sim_tool),
+    "scan_xsstrike": ("scanners.runner", _sim_tool),
+}
+
+_scanner_impls: Dict[str, Any] = {}
+_scanner_lock = threading.Lock()
+
+
+def _load_scanner(name: str):
+    impl = _scanner_impls.get(name)
+    if impl is not None:
+        return impl
+    module, fallback = SCANNER_MODULES[name]
+    with _scanner_lock:
+        if name not in _scanner_impls:
+            try:
+                _scanner_impls[name] = getattr(importlib.import_module(module), name)
+            except ImportError as e:
+                print(f"⚠️ Error importando {module}: {e}. Usando modo simulación para evitar caídas.")
+                _scanner_impls[name] = fallback
+        return _scanner_impls[name]
+
+
+def _lazy_scanner(name: str):
+    async def call(*args, **kwargs):
+        return await _load_scanner(name)(*args, **kwargs)
+
+    call.__name__ = call.__qualname__ = name
+    return call
+
+
+def preload_scanners():
+    """Importa ya todos los escáneres (lo llama un hilo tras el arranque)."""
+    for name in SCANNER_MODULES:
+        _load_scanner(name)
+
+
+check_ping = _lazy_scanner("check_ping")
+scan_ports_native = _lazy_scanner("scan_ports_native")
+detect_services = _lazy_scanner("detect_services")
+tls_info = _lazy_scanner("tls_info")
+check_headers = _lazy_scanner("check_headers")
+crawl_site = _lazy_scanner("crawl_site")
+fingerprint = _lazy_scanner("fingerprint")
+scan_nuclei = _lazy_scanner("scan_nuclei")
+scan_dirsearch = _lazy_scanner("scan_dirsearch")
+scan_sqlmap = _lazy_scanner("scan_sqlmap")
+scan_xsstrike = _lazy_scanner("scan_xsstrike")
 
 
 # =====================================================
@@ -80,7 +212,6 @@ except ImportError as e:
 # =====================================================
 
 app = FastAPI(title="PYMESec Security Evaluator API")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # --- CORS (en producción puedes restringir a tu dominio/IP) ---
 origins = ["*"]
@@ -138,222 +269,657 @@ class ScanResultResponse(BaseModel):
         from_attributes = True
 
 
+class RiskTrendPoint(BaseModel):
+    day: date
+    host: str
+    scans: int
+    isg: float
+    critical: int
+    high: int
+    medium: int
+    low: int
+    info: int
+    new_findings: int
+    resolved_findings: int
+
+
 # =====================================================
 #                     UTILIDADES
 # =====================================================
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str):
+    """(válida, hash_nuevo) – bcrypt corre en el pool de core/passwords.py."""
+    try:
+        return await get_hasher().verify(plain, hashed)
+    except HashPoolBusy:
+        raise HTTPException(
+            status_code=503, detail="Servidor ocupado, reintenta", headers={"Retry-After": "1"}
+        )
 
 
-def get_password_hash(pwd: str) -> str:
-    return pwd_context.hash(pwd)
+async def get_password_hash(pwd: str) -> str:
+    try:
+        return await get_hasher().hash(pwd)
+    except HashPoolBusy:
+        raise HTTPException(
+            status_code=503, detail="Servidor ocupado, reintenta", headers={"Retry-After": "1"}
+        )
 
 
 def get_uid_from_token(authorization: str) -> int:
     """
-    Extrae el user_id de un token del tipo:
-      Authorization: Bearer fake_jwt_token_{id}
+    Extrae el user_id de un token firmado (core/auth.py):
+      Authorization: Bearer <jwt>
+    Solo verifica firma y caducidad; no consulta la BD.
     """
     if not authorization:
         raise HTTPException(status_code=401, detail="Token ausente")
     try:
         token = authorization.split(" ")[1]
-        uid = int(token.split("_")[-1])
-        return uid
-    except Exception:
+        return int(decode_token(token)["sub"])
+    except (TokenError, IndexError, KeyError, ValueError, TypeError):
         raise HTTPException(status_code=401, detail="Token inválido")
 
 
-# Diccionario de conexiones WebSocket activas por user_id
-active_connections: Dict[int, WebSocket] = {}
+def get_principal(db: Session, uid: int) -> Dict[str, Any]:
+    """Perfil del usuario desde la caché del proceso (BD solo si no está o caducó)."""
+    principal = principals.get(db, uid)
+    if principal is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return principal
 
 
-async def push_status(user_id: int, msg: str, status: str, scan_id: int):
+# Conexiones WebSocket activas de ESTE worker (varias por usuario, con cola propia)
+hub = ConnectionHub()
+# Tiempo para enviar el token como primer mensaje si no va en la URL
+WS_AUTH_TIMEOUT_S = float(os.getenv("WS_AUTH_TIMEOUT_S", "10"))
+
+# El progreso viaja por el bus: el worker que ejecuta el escaneo no tiene por qué
+# ser el que sostiene el WebSocket del usuario.
+bus = get_event_bus()
+
+
+def _on_status_event(payload: Dict[str, Any]):
+    hub.publish(payload["user_id"], payload["data"])
+
+
+def _on_user_changed(payload: Dict[str, Any]):
+    principals.invalidate(payload.get("user_id"))
+
+
+def _on_cancel_event(payload: Dict[str, Any]):
+    """Cancela el escaneo si corre en este worker (o saca al solicitante de la ejecución compartida)."""
+    scan_id = payload["scan_id"]
+    flight = flights.containing(scan_id)
+    if flight is not None and len(flight.members) > 1:
+        # Otros siguen esperando el resultado: solo se retira quien cancela
+        member = flights.leave(flight, scan_id)
+        if member is not None:
+            asyncio.create_task(_mark_cancelled([member]))
+        return
+    task = running_scans.get(flight.run_id if flight is not None else scan_id)
+    if task is not None and not task.done():
+        cancel_requested.add(scan_id if flight is None else flight.run_id)
+        task.cancel()
+
+
+def _launch_scan(user_id: int, scan_id: int, target: str, resume: Optional[Dict[str, Any]] = None):
+    """Lanza run_scan_real en segundo plano y lo registra en running_scans."""
+    task = asyncio.create_task(
+        run_scan_real(user_id, scan_id, target, get_db().__next__(), resume=resume)
+    )
+    running_scans[scan_id] = task
+    task.add_done_callback(lambda _t: running_scans.pop(scan_id, None))
+    return task
+
+
+def _live_scan_ids() -> set:
+    return set(running_scans) | set(flights.scan_ids())
+
+
+async def _liveness_loop():
     """
-    Envía un mensaje JSON por WebSocket al usuario si está conectado.
+    Latido de los escaneos de este worker y barrido de los interrumpidos
+    (reinicios, despliegues, workers caídos): se reanudan desde su último
+    checkpoint en lugar de quedarse en Pending para siempre.
     """
-    if user_id in active_connections:
+    while True:
         try:
-            await active_connections[user_id].send_json(
-                {"status": status, "message": msg, "scanId": scan_id}
-            )
+            await asyncio.to_thread(heartbeat, _live_scan_ids())
+            for row in await asyncio.to_thread(claim_interrupted):
+                _resume_scan(row)
         except Exception as e:
-            print(f"Error enviando por WS a user {user_id}: {e}")
+            print(f"[Recovery] Error en el barrido de escaneos: {e}")
+        await asyncio.sleep(SCAN_HEARTBEAT_S)
 
 
-# =====================================================
-#    CEREBRO CENTRAL DEL ESCÁNER (REAL + IA)
-# =====================================================
+async def _retention_loop():
+    """
+    Compactación periódica de scan_results (core/retention.py). Todos los
+    workers la lanzan, pero solo uno la ejecuta a la vez (advisory lock).
+    """
+    while True:
+        try:
+            await asyncio.to_thread(run_retention)
+        except Exception as e:
+            print(f"[Retention] Error en la compactación: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_S)
+
+
+def _resume_scan(row: Dict[str, Any]):
+    uid, sid = row["user_id"], row["id"]
+    print(f"[Recovery] Reanudando escaneo {sid} ({row['target']})")
+    if row["scan_key"]:
+        _flight, leader = flights.join(row["scan_key"], uid, sid)
+        if not leader:
+            asyncio.create_task(push_status(
+                uid, f"Reanudando: unido al escaneo en curso de {row['target']}...", "Running", sid
+            ))
+            return
+    _launch_scan(uid, sid, row["target"], resume=row["checkpoint"])
+
+
+async def _mark_cancelled(members: List[tuple], trace: Optional[Dict[str, Any]] = None):
+    await asyncio.gather(*(
+        get_writer().update_scan(
+            sid,
+            "Cancelled",
+            {"error": "Cancelled", "summary": "Escaneo cancelado por el usuario."},
+            trace=trace,
+        )
+        for _uid, sid in members
+    ))
+    await broadcast_status(members, "Escaneo cancelado.", "Cancelled")
+
 
-async def run_scan_real(user_id: int, scan_id: int, target: str, db: Session):
+async def push_status(user_id: int, msg: str, status: str, scan_id: int):
     """
-    Orquesta el escaneo real:
-    - Reconocimiento (ping, puertos)
-    - Análisis Web (headers, TLS)
-    - Vulnerabilidades profundas (Nuclei, Dirsearch, XSStrike, SQLMap)
-    - Generación de resumen ejecutivo con IA (Gemini)
-    - Guardado final en la base de datos
+    Registra el progreso en el log de eventos (seq monotónico) y lo publica en
+    el bus; cada worker lo encola para las conexiones WebSocket del usuario que
+    tenga. No espera a la red del cliente.
     """
     try:
-        # Normalizamos host y URL
-        host = target.replace("https://", "").replace("http://", "").split("/")[0]
-        url = target if target.startswith("http") else f"http://{target}"
+        seq = await get_writer().append_event(user_id, scan_id, status, msg)
+    except Exception as e:
+        print(f"No se pudo registrar el progreso del escaneo {scan_id}: {e}")
+        seq = None
+    bus.publish(
+        "status",
+        {
+            "user_id": user_id,
+            "data": {"status": status, "message": msg, "scanId": scan_id, "seq": seq},
+        },
+    )
 
-        findings: List[Dict[str, Any]] = []
-        open_ports: List[int] = []
 
-        # ---------------------------------------------------------
-        # 1. RECONOCIMIENTO: Ping + Plan B TCP
-        # ---------------------------------------------------------
-        await push_status(
-            user_id,
-            f"Verificando disponibilidad de {host}...",
-            "Running",
-            scan_id,
-        )
-        is_alive = await check_ping(host)
+# Escaneos idénticos en curso en ESTE worker: se ejecutan una sola vez
+flights = FlightRegistry()
 
-        if not is_alive:
-            await push_status(
-                user_id,
-                "Ping bloqueado. Intentando TCP directo (Plan B)...",
-                "Running",
-                scan_id,
-            )
-            fallback_check = await scan_ports_native(host)
-            if len(fallback_check) > 0:
-                is_alive = True
-                open_ports = fallback_check
-                await push_status(
-                    user_id,
-                    "Objetivo detectado por TCP. El firewall podría estar filtrando ICMP.",
-                    "Running",
-                    scan_id,
-                )
-            else:
-                # Marcamos como Error en DB
-                scan_row = (
-                    db.query(DBScanResult)
-                    .filter(DBScanResult.id == scan_id)
-                    .first()
-                )
-                if scan_row:
-                    scan_row.status = "Error"
-                    scan_row.results = {
-                        "error": "Host Unreachable",
-                        "summary": "Objetivo inaccesible (Ni Ping ni TCP responden).",
-                    }
-                    db.commit()
-                await push_status(
-                    user_id,
-                    f"El objetivo {host} parece inactivo (sin respuesta ICMP ni TCP).",
-                    "Error",
-                    scan_id,
-                )
-                return
+# Tareas de escaneo de ESTE worker (por scan_id del ejecutor) y las que un
+# usuario pidió cancelar; el resto de cancelaciones son apagados del worker
+running_scans: Dict[int, asyncio.Task] = {}
+cancel_requested: set = set()
 
+
+async def broadcast_status(members: List[tuple], msg: str, status: str):
+    """push_status a cada (user_id, scan_id) que comparte una ejecución."""
+    await asyncio.gather(*(push_status(uid, msg, status, sid) for uid, sid in members))
+
+
+async def notify_scan(user_id: int, scan_id: int, msg: str, status: str = "Running"):
+    """Progreso de un escaneo: si otros solicitantes esperan la misma ejecución, les llega a todos."""
+    flight = flights.for_scan(scan_id)
+    if flight is None:
+        await push_status(user_id, msg, status, scan_id)
+        return
+    flight.last = (msg, status)
+    await broadcast_status(list(flight.members), msg, status)
+
+
+# =====================================================
+#    CEREBRO CENTRAL DEL ESCÁNER (REAL + IA)
+# =====================================================
+
+# Timeouts por etapa (segundos): un poco por encima del timeout de cada herramienta
+STAGE_TIMEOUTS = {
+    "recon": 60,
+    "services": 20,
+    "headers": 20,
+    "tls": 20,
+    "crawl": 60,
+    "fingerprint": 20,
+    "nuclei": 210,
+    "dirsearch": 80,
+    # XSStrike y sqlmap reparten este tiempo entre sus ejecuciones
+    # (scanners/runner.py): hasta 10 URLs de 3 en 3 y lotes de sqlmap -m
+    "xsstrike": 370,
+    "sqlmap": 610,
+}
+
+
+async def _stage_recon(ctx: ScanContext):
+    """Reconocimiento: Ping + Plan B TCP + puertos abiertos."""
+    open_ports: List[int] = []
+    is_alive = await check_ping(ctx.host)
+
+    if not is_alive:
+        await notify_scan(
+            ctx.user_id,
+            ctx.scan_id,
+            "Ping bloqueado. Intentando TCP directo (Plan B)...",
+        )
+        open_ports = await scan_ports_native(ctx.host)
         if not open_ports:
-            await push_status(
-                user_id,
-                "Escaneando puertos abiertos con sockets nativos...",
-                "Running",
-                scan_id,
+            raise AbortScan(
+                "Host Unreachable",
+                "Objetivo inaccesible (Ni Ping ni TCP responden).",
             )
-            open_ports = await scan_ports_native(host)
+        await notify_scan(
+            ctx.user_id,
+            ctx.scan_id,
+            "Objetivo detectado por TCP. El firewall podría estar filtrando ICMP.",
+        )
+
+    if not open_ports:
+        await notify_scan(
+            ctx.user_id,
+            ctx.scan_id,
+            "Escaneando puertos abiertos con sockets nativos...",
+        )
+        open_ports = await scan_ports_native(ctx.host)
 
-        if open_ports:
-            findings.append(
+    if open_ports:
+        ctx.add_findings(
+            "recon",
+            [
                 {
                     "severity": "INFO",
                     "name": "Puertos Abiertos",
                     "description": f"Detectados: {open_ports}",
                     "mitigation": "Cerrar puertos innecesarios y aplicar reglas de firewall.",
                 }
-            )
+            ],
+        )
+    return {"open_ports": open_ports}
 
-        # ---------------------------------------------------------
-        # 2. ANÁLISIS WEB (si aplica)
-        # ---------------------------------------------------------
-        is_web = any(
-            p in open_ports
-            for p in [80, 443, 8000, 8080, 3000, 5000, 50000, 50001]
-        ) or target.startswith("http")
-
-        if is_web:
-            # 2.1 Headers HTTP
-            await push_status(
-                user_id,
-                "Analizando cabeceras HTTP...",
-                "Running",
-                scan_id,
-            )
-            headers_res = await check_headers(url)
-            for h in headers_res.get("findings", []):
-                findings.append(
-                    {
-                        "severity": "MEDIA",
-                        "name": "Cabecera de Seguridad Faltante",
-                        "description": h,
-                        "mitigation": "Configurar cabeceras HTTP de seguridad en el servidor web.",
-                    }
-                )
 
-            # 2.2 TLS/SSL si hay 443 o es https
-            if 443 in open_ports or url.startswith("https"):
-                tls_res = await tls_info(host)
-                if tls_res:
-                    findings.append(
-                        {
-                            "severity": "INFO",
-                            "name": "Información TLS/SSL",
-                            "description": f"Emisor: {tls_res.get('issuer')}",
-                            "mitigation": "Verificar vigencia y configuración del certificado TLS.",
-                        }
-                    )
+def _open_ports(ctx: ScanContext) -> List[int]:
+    return (ctx.outputs.get("recon") or {}).get("open_ports", [])
+
+
+def _target_url(target: str) -> str:
+    """URL del objetivo tal como lo escribió el usuario (IPv6 entre corchetes)."""
+    if target.startswith("http"):
+        return target
+    try:
+        return f"http://[{ipaddress.IPv6Address(target.strip('[]'))}]"
+    except ValueError:
+        return f"http://{target}"
+
+
+def _port_of(url: str) -> int:
+    parts = urlsplit(url)
+    return parts.port or (443 if parts.scheme == "https" else 80)
+
+
+async def _stage_services(ctx: ScanContext):
+    """
+    Identifica el servicio de cada puerto abierto (banners y saludos de cada
+    protocolo, todos a la vez). Las etapas web y TLS se deciden con este mapa:
+    un puerto que no habla HTTP nunca llega a los escáneres web.
+    """
+    ports = list(_open_ports(ctx))
+    if ctx.target.startswith("http"):
+        # El puerto de la URL indicada por el usuario se sondea siempre
+        ports.append(_port_of(ctx.url))
+    if not ports:
+        return None
+
+    result = await detect_services(ctx.host, ports)
+    if not result:
+        return None
+
+    # URL de trabajo: la del usuario si su puerto habla HTTP; si no, el mejor servicio web
+    web = result.get("web") or []
+    user_port = _port_of(ctx.url)
+    user_web = any(
+        s["port"] == user_port and s["service"] in ("http", "https")
+        for s in result.get("services", [])
+    )
+    if ctx.target.startswith("http") and user_web:
+        result["url"] = ctx.url
+    else:
+        result["url"] = web[0] if web else None
+
+    described = [
+        f"{s['port']}/{s['service']}" + (f" ({s['banner']})" if s.get("banner") else "")
+        for s in result.get("services", [])
+    ]
+    if described:
+        ctx.add_findings(
+            "services",
+            [
+                {
+                    "severity": "INFO",
+                    "name": "Servicios Detectados",
+                    "description": f"Detectados: {', '.join(described)}",
+                    "mitigation": "Ocultar versiones en los banners y no exponer servicios internos (BD, caché) a Internet.",
+                }
+            ],
+        )
+    return result
+
+
+def _service_map(ctx: ScanContext) -> Optional[Dict[str, Any]]:
+    # None si la detección falló o no se ejecutó (modo simulación)
+    return ctx.outputs.get("services") or None
+
+
+def _is_web(ctx: ScanContext) -> bool:
+    services = _service_map(ctx)
+    if services is not None:
+        return bool(services.get("url"))
+    open_ports = _open_ports(ctx)
+    return ctx.target.startswith("http") or 80 in open_ports or 443 in open_ports
+
+
+def _web_url(ctx: ScanContext) -> str:
+    """URL sobre la que trabajan las etapas web (servicio HTTP detectado)."""
+    services = _service_map(ctx)
+    return (services or {}).get("url") or ctx.url
+
+
+def _tls_ports(ctx: ScanContext) -> List[int]:
+    services = _service_map(ctx)
+    if services is not None:
+        return services.get("tls_ports") or []
+    if 443 in _open_ports(ctx) or ctx.url.startswith("https"):
+        return [_port_of(ctx.url) if ctx.url.startswith("https") else 443]
+    return []
+
+
+def _needs_tls(ctx: ScanContext) -> bool:
+    return bool(_tls_ports(ctx))
+
+
+async def _stage_headers(ctx: ScanContext):
+    headers_res = await check_headers(_web_url(ctx))
+    ctx.add_findings(
+        "headers",
+        [
+            {
+                "severity": "MEDIA",
+                "name": "Cabecera de Seguridad Faltante",
+                "description": h,
+                "mitigation": "Configurar cabeceras HTTP de seguridad en el servidor web.",
+            }
+            for h in headers_res.get("findings", [])
+        ],
+    )
+    return headers_res
+
+
+async def _stage_tls(ctx: ScanContext):
+    """Certificado de cada puerto que habla TLS; el del servicio web va primero."""
+    ports = _tls_ports(ctx)
+    web_url = _web_url(ctx)
+    if web_url.startswith("https") and _port_of(web_url) in ports:
+        ports = [_port_of(web_url)] + [p for p in ports if p != _port_of(web_url)]
+
+    results = await asyncio.gather(*(tls_info(ctx.host, p) for p in ports))
+    findings = [
+        {
+            "severity": "INFO",
+            "name": "Información TLS/SSL",
+            "description": f"Puerto {port}. Emisor: {res.get('issuer')}",
+            "mitigation": "Verificar vigencia y configuración del certificado TLS.",
+        }
+        for port, res in zip(ports, results)
+        if res
+    ]
+    if findings:
+        ctx.add_findings("tls", findings)
+    # Etapas siguientes (fingerprint) leen el certificado del servicio web
+    tls_res = next((res for res in results if res), None)
+    if tls_res:
+        tls_res = dict(tls_res, ports={str(p): res for p, res in zip(ports, results) if res})
+    return tls_res
+
+
+async def _stage_crawl(ctx: ScanContext):
+    """Rastreo único del sitio: inventario de endpoints para los escáneres de inyección."""
+    return await crawl_site(_web_url(ctx))
+
+
+async def _stage_fingerprint(ctx: ScanContext):
+    """Stack del objetivo (servidor, lenguaje, CMS) con lo ya obtenido + unas pocas sondas."""
+    result = await fingerprint(
+        _web_url(ctx),
+        headers=(ctx.outputs.get("headers") or {}).get("headers"),
+        tls=ctx.outputs.get("tls"),
+        ports=_open_ports(ctx),
+    )
+    if result and result.get("technologies"):
+        ctx.add_findings(
+            "fingerprint",
+            [
+                {
+                    "severity": "INFO",
+                    "name": "Tecnologías Detectadas",
+                    "description": f"Detectadas: {', '.join(sorted(result['technologies']))}",
+                    "mitigation": "Ocultar versiones en cabeceras y mantener actualizado el stack detectado.",
+                }
+            ],
+        )
+    return result
+
+
+def _nuclei_tags(ctx: ScanContext) -> Optional[List[str]]:
+    # None (todas las plantillas) si el fingerprinting falló o no reconoció el stack
+    result = ctx.outputs.get("fingerprint")
+    if not result or result.get("full_scan"):
+        return None
+    return result.get("tags") or None
+
+
+def _crawled_endpoints(ctx: ScanContext) -> Optional[List[Dict[str, Any]]]:
+    # None si el crawler falló o no está: la herramienta rastrea por su cuenta
+    inventory = ctx.outputs.get("crawl")
+    if not inventory or inventory.get("error"):
+        return None
+    return inventory.get("endpoints")
+
+
+def _tool_stage(name: str, scanner, inputs=None):
+    """
+    Etapa que ejecuta una herramienta externa sobre la URL y guarda sus
+    hallazgos. `inputs(ctx)` aporta un segundo argumento sacado de etapas
+    previas (inventario del crawler, tags del fingerprinting).
+
+    La salida cruda de la herramienta queda en el almacén de evidencias
+    (core/blobs.py): la etapa devuelve sus referencias y cada hallazgo
+    lleva los hashes de la salida que lo sustenta.
+    """
+
+    async def run(ctx: ScanContext):
+        with collect_evidence() as refs:
+            if inputs is not None:
+                findings = await scanner(_web_url(ctx), inputs(ctx))
+            else:
+                findings = await scanner(_web_url(ctx))
+        findings = normalize_findings(findings)
+        if refs:
+            hashes = list(dict.fromkeys(r["sha256"] for r in refs))
+            for f in findings:
+                f.extra = dict(f.extra or {}, evidence=hashes)
+        ctx.add_findings(name, findings)
+        return {"findings": len(findings), "evidence": refs}
+
+    return run
+
+
+def _scan_evidence(ctx: ScanContext) -> Dict[str, List[Dict[str, Any]]]:
+    """Referencias de evidencias por etapa (solo las que guardaron salida)."""
+    return {
+        name: output["evidence"]
+        for name, output in ctx.outputs.items()
+        if isinstance(output, dict) and output.get("evidence")
+    }
+
+
+def build_scan_stages() -> List[Stage]:
+    """
+    DAG declarativo del escaneo. Cada etapa declara qué necesita y arranca en
+    cuanto lo tiene: headers y TLS corren a la vez, y sqlmap no espera a nuclei.
+    Las etapas web y TLS esperan al mapa de servicios y solo se ejecutan
+    contra puertos que hablan HTTP o TLS.
+    sqlmap y XSStrike esperan al crawler y prueban su inventario de endpoints
+    en vez de rastrear cada uno el sitio; nuclei espera al fingerprinting y
+    lanza solo las plantillas del stack detectado.
+    """
+    return [
+        Stage("recon", _stage_recon, timeout=STAGE_TIMEOUTS["recon"],
+              label="Verificando disponibilidad y puertos"),
+        Stage("services", _stage_services, deps=["recon"],
+              timeout=STAGE_TIMEOUTS["services"], label="Identificando servicios en los puertos abiertos"),
+        Stage("headers", _stage_headers, deps=["recon", "services"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["headers"], label="Analizando cabeceras HTTP"),
+        Stage("tls", _stage_tls, deps=["recon", "services"], when=_needs_tls,
+              timeout=STAGE_TIMEOUTS["tls"], label="Analizando certificado TLS/SSL"),
+        Stage("crawl", _stage_crawl, deps=["recon", "services"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["crawl"], label="Mapeando endpoints y formularios"),
+        Stage("fingerprint", _stage_fingerprint, deps=["recon", "services", "headers", "tls"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["fingerprint"], label="Identificando tecnologías"),
+        Stage("nuclei", _tool_stage("nuclei", scan_nuclei, _nuclei_tags), deps=["recon", "services", "fingerprint"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["nuclei"], label="Análisis de CVEs y patrones"),
+        Stage("dirsearch", _tool_stage("dirsearch", scan_dirsearch), deps=["recon", "services"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["dirsearch"], label="Descubrimiento de rutas"),
+        Stage("xsstrike", _tool_stage("xsstrike", scan_xsstrike, _crawled_endpoints), deps=["recon", "services", "crawl"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["xsstrike"], label="Pruebas de XSS"),
+        Stage("sqlmap", _tool_stage("sqlmap", scan_sqlmap, _crawled_endpoints), deps=["recon", "services", "crawl"], when=_is_web,
+              timeout=STAGE_TIMEOUTS["sqlmap"], label="Auditando inyecciones SQL"),
+    ]
+
+
+async def run_scan_real(
+    user_id: int,
+    scan_id: int,
+    target: str,
+    db: Session,
+    resume: Optional[Dict[str, Any]] = None,
+):
+    """
+    Orquesta el escaneo real como un DAG de etapas (core/pipeline.py):
+    - Reconocimiento (ping, puertos) e identificación de servicios
+    - Análisis Web (headers, TLS) en paralelo
+    - Vulnerabilidades profundas (Nuclei, Dirsearch, XSStrike, SQLMap) en paralelo
+    - Generación de resumen ejecutivo con IA (Gemini)
+    - Guardado final en la base de datos
 
-            # ---------------------------------------------------------
-            # 3. VULNERABILIDADES PROFUNDAS (Nuclei, Dirsearch, XSStrike, SQLMap)
-            # ---------------------------------------------------------
-            await push_status(
+    Si scan_id lidera una ejecución compartida (core/flights.py), el progreso y
+    el resultado se replican en la fila de cada solicitante que se unió.
+
+    Cada etapa terminada se guarda como checkpoint; con `resume` (checkpoint
+    de un worker que se reinició) solo se ejecutan las etapas pendientes.
+    """
+    trace = start_trace(scan_id)
+    # Etapas, sondas y subprocesos heredan el límite (core/deadline.py)
+    set_deadline(SCAN_DEADLINE_S)
+    flight = flights.for_scan(scan_id)
+
+    def land() -> List[tuple]:
+        # A partir de aquí nadie más se une: los miembros quedan fijos
+        if flight is None:
+            return [(user_id, scan_id)]
+        return flights.land(flight)
+
+    try:
+        # Normalizamos host y URL (el host va sin puerto: ping/sockets/TLS lo necesitan así)
+        url = _target_url(target)
+        host = urlsplit(url).hostname or target
+
+        await notify_scan(
+            user_id,
+            scan_id,
+            f"Verificando disponibilidad de {host}...",
+        )
+
+        ctx = ScanContext(user_id, scan_id, target, host, url)
+        stages = build_scan_stages()
+        attempts = (resume or {}).get("attempts", 0)
+
+        restored = ctx.restore(resume)
+        if restored:
+            await notify_scan(
                 user_id,
-                "Ejecutando análisis de vulnerabilidades profundas (Nuclei, Path Discovery, XSS)...",
-                "Running",
                 scan_id,
+                f"Reanudando escaneo interrumpido ({len(restored)} etapas ya completadas).",
             )
-            results_parallel = await asyncio.gather(
-                scan_nuclei(url),
-                scan_dirsearch(url),
-                scan_xsstrike(url),
+
+        # Checkpoint en segundo plano al terminar cada etapa (no frena el DAG)
+        checkpoints = set()
+
+        def checkpoint(stage: Stage):
+            snapshot = ctx.snapshot()
+            snapshot["attempts"] = attempts
+            task = asyncio.create_task(
+                get_writer().save_checkpoint(scan_id, snapshot, datetime.now(timezone.utc))
             )
-            for res in results_parallel:
-                findings.extend(res)
+            checkpoints.add(task)
+            task.add_done_callback(checkpoints.discard)
 
-            await push_status(
-                user_id,
-                "Auditando inyecciones SQL con sqlmap...",
-                "Running",
-                scan_id,
+        # El aviso de progreso no frena el arranque de la etapa
+        notices = set()
+
+        def announce(stage: Stage):
+            if stage.name != "recon":
+                task = asyncio.create_task(
+                    notify_scan(user_id, scan_id, f"{stage.label}...")
+                )
+                notices.add(task)
+                task.add_done_callback(notices.discard)
+
+        try:
+            await run_dag(
+                stages, ctx, on_start=announce, budget=SCAN_DEADLINE_S, on_done=checkpoint
+            )
+        except AbortScan as abort:
+            members = land()
+            trace_data = finish_trace(trace)
+            await asyncio.gather(*(
+                get_writer().update_scan(
+                    sid,
+                    "Error",
+                    {"error": abort.error, "summary": abort.summary},
+                    trace=trace_data,
+                )
+                for _uid, sid in members
+            ))
+            SCANS_TOTAL.labels("api", "unreachable").inc()
+            await broadcast_status(
+                members,
+                f"El objetivo {host} parece inactivo (sin respuesta ICMP ni TCP).",
+                "Error",
             )
-            sql_vulns = await scan_sqlmap(url)
-            findings.extend(sql_vulns)
+            return
 
-        else:
-            await push_status(
+        if not _is_web(ctx):
+            await notify_scan(
                 user_id,
-                "El objetivo no parece un servicio web. Saltando pruebas HTTP/TLS.",
-                "Running",
                 scan_id,
+                "El objetivo no parece un servicio web. Saltando pruebas HTTP/TLS.",
             )
 
+        findings = ctx.findings([s.name for s in stages])
+        open_ports = _open_ports(ctx)
+
         # ---------------------------------------------------------
-        # 4. ANÁLISIS EJECUTIVO CON IA (Gemini)
+        # ANÁLISIS EJECUTIVO CON IA (Gemini)
         # ---------------------------------------------------------
-        await push_status(
+        await notify_scan(
             user_id,
-            "Generando análisis ejecutivo con IA...",
-            "Running",
             scan_id,
+            "Generando análisis ejecutivo con IA...",
         )
 
         raw_results_for_ai = {
@@ -362,44 +928,82 @@ async def run_scan_real(user_id: int, scan_id: int, target: str, db: Session):
         }
 
         # IA: esta función internamente usa RiskEngine + Gemini
-        ai_summary_text = generate_executive_summary(raw_results_for_ai)
+        with span("ai_summary", "ai"):
+            ai_summary_text = generate_executive_summary(raw_results_for_ai)
 
         # ---------------------------------------------------------
-        # 5. GUARDADO FINAL EN LA BD
+        # GUARDADO FINAL EN LA BD
         # ---------------------------------------------------------
         final_results = {
-            "vulnerabilities": findings,
-            "scan_meta": {"host": host, "ports": open_ports},
+            "vulnerabilities": dump_findings(findings),
+            "scan_meta": {
+                "host": host,
+                "ports": open_ports,
+                "services": (_service_map(ctx) or {}).get("services", []),
+                "evidence": _scan_evidence(ctx),
+                "stages": ctx.status,
+                "stage_errors": ctx.errors,
+            },
             "ai_summary": ai_summary_text,
         }
 
-        scan_row = db.query(DBScanResult).filter(DBScanResult.id == scan_id).first()
-        if scan_row:
-            scan_row.results = final_results
-            scan_row.status = "Completed"
-            db.commit()
+        # Write-behind: se agrupa con otros escaneos que terminen a la vez y
+        # solo continuamos cuando el COMMIT (con sus rollups) es durable.
+        # Cada solicitante recibe su copia en su propia fila y su rollup.
+        members = land()
+        trace_data = finish_trace(trace)
+        completed_at = datetime.now(timezone.utc)
+        await asyncio.gather(*(
+            get_writer().update_scan(
+                sid,
+                "Completed",
+                final_results,
+                rollup=(uid, host),
+                trace=trace_data,
+                completed_at=completed_at,
+                checkpoint={},
+            )
+            for uid, sid in members
+        ))
+        SCANS_TOTAL.labels("api", "completed").inc()
 
-        await push_status(
-            user_id,
+        await broadcast_status(
+            members,
             f"Escaneo completado. {len(findings)} hallazgos registrados.",
             "Completed",
-            scan_id,
         )
 
+    except asyncio.CancelledError:
+        if scan_id not in cancel_requested:
+            # Apagado del worker: la fila queda como estaba
+            raise
+        cancel_requested.discard(scan_id)
+        SCANS_TOTAL.labels("api", "cancelled").inc()
+        try:
+            await _mark_cancelled(land(), trace=finish_trace(trace))
+        except Exception as db_e:
+            print(f"No se pudo guardar la cancelación del escaneo {scan_id}: {db_e}")
+
     except Exception as e:
         print(f"FATAL ERROR SCAN: {e}")
-        scan_row = db.query(DBScanResult).filter(DBScanResult.id == scan_id).first()
-        if scan_row:
-            scan_row.status = "Error"
-            scan_row.results = {"error": str(e)}
-            db.commit()
-        await push_status(
-            user_id,
+        SCANS_TOTAL.labels("api", "error").inc()
+        members = land()
+        trace_data = finish_trace(trace)
+        try:
+            await asyncio.gather(*(
+                get_writer().update_scan(sid, "Error", {"error": str(e)}, trace=trace_data)
+                for _uid, sid in members
+            ))
+        except Exception as db_e:
+            print(f"No se pudo guardar el error del escaneo {scan_id}: {db_e}")
+        await broadcast_status(
+            members,
             f"Error interno durante el escaneo: {str(e)}",
             "Error",
-            scan_id,
         )
     finally:
+        if flight is not None:
+            flights.land(flight)
         db.close()
 
 
@@ -409,36 +1013,121 @@ async def run_scan_real(user_id: int, scan_id: int, target: str, db: Session):
 
 @app.on_event("startup")
 def startup():
+    check_secret()
     init_db()
+    bus.subscribe("status", _on_status_event)
+    bus.subscribe("cancel", _on_cancel_event)
+    bus.subscribe("user_changed", _on_user_changed)
+    bus.start()
+    register_queue("write_behind", lambda: get_writer().pending())
+    register_queue("ws_outbound", hub.queued)
+    register_queue("password_hash", lambda: get_hasher().pending())
+    get_hasher().warm_up()
+    if PRELOAD_SCANNERS:
+        # Fuera del camino de arranque: el worker ya acepta peticiones
+        threading.Thread(target=preload_scanners, name="preload-scanners", daemon=True).start()
+
+
+_liveness_task: Optional[asyncio.Task] = None
+_retention_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_recovery():
+    global _liveness_task, _retention_task
+    _liveness_task = asyncio.create_task(_liveness_loop())
+    if RETENTION_INTERVAL_S > 0:
+        _retention_task = asyncio.create_task(_retention_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _liveness_task is not None:
+        _liveness_task.cancel()
+    if _retention_task is not None:
+        _retention_task.cancel()
+    # Paramos nuestros escaneos (y sus subprocesos): sus filas quedan con el
+    # último checkpoint y sin latido, y el próximo worker los reanuda
+    live = _live_scan_ids()
+    for task in list(running_scans.values()):
+        task.cancel()
+    if running_scans:
+        await asyncio.gather(*running_scans.values(), return_exceptions=True)
+    await get_writer().close()
+    try:
+        await asyncio.to_thread(release, live)
+    except Exception as e:
+        print(f"[Recovery] No se pudo liberar los escaneos en curso: {e}")
+    get_hasher().shutdown()
+    bus.stop()
+
+
+# ---------- MÉTRICAS ----------
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Exposición en formato texto de Prometheus."""
+    body, content_type = render_latest()
+    return Response(
+        content=body,
+        media_type=content_type,
+        status_code=200 if PROMETHEUS_AVAILABLE else 503,
+    )
 
 
 # ---------- AUTH ----------
 
+def _user_by_email(db: Session, email: str) -> Optional[DBUser]:
+    return db.query(DBUser).filter(DBUser.email == email).first()
+
+
+def _save_user(db: Session, user: DBUser) -> DBUser:
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    # Ningún worker debe seguir sirviendo el perfil anterior desde su caché
+    principals.invalidate(user.id)
+    bus.publish("user_changed", {"user_id": user.id})
+    return user
+
+
+# Rutas async: el bcrypt va al pool de procesos y las consultas a un hilo,
+# así ni el event loop ni el threadpool compartido esperan al hash.
+
 @app.post("/api/v1/auth/register")
-def reg(r: RegisterRequest, db: Session = Depends(get_db)):
-    if db.query(DBUser).filter(DBUser.email == r.email).first():
+async def reg(r: RegisterRequest, db: Session = Depends(get_db)):
+    if await asyncio.to_thread(_user_by_email, db, r.email):
         raise HTTPException(status_code=400, detail="Email existe")
 
     u = DBUser(
         name=r.name,
         email=r.email,
-        hashed_password=get_password_hash(r.password),
+        hashed_password=await get_password_hash(r.password),
         company_name=r.companyName,
     )
-    db.add(u)
-    db.commit()
-    db.refresh(u)
+    await asyncio.to_thread(_save_user, db, u)
     return {"msg": "OK"}
 
 
 @app.post("/api/v1/auth/login")
-def login(r: LoginRequest, db: Session = Depends(get_db)):
-    u = db.query(DBUser).filter(DBUser.email == r.email).first()
-    if not u or not verify_password(r.password, u.hashed_password):
+async def login(r: LoginRequest, db: Session = Depends(get_db)):
+    u = await asyncio.to_thread(_user_by_email, db, r.email)
+    if not u:
         raise HTTPException(status_code=401, detail="Bad creds")
+    valid, new_hash = await verify_password(r.password, u.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Bad creds")
+
+    if new_hash:
+        # Hash con parámetros antiguos (p. ej. menos rondas): lo actualizamos ahora
+        # que tenemos la contraseña en claro
+        u.hashed_password = new_hash
+        await asyncio.to_thread(_save_user, db, u)
 
+    # El primer /user/me tras el login ya no va a la BD
+    principals.put(u)
     return {
-        "token": f"fake_jwt_token_{u.id}",
+        "token": issue_token(u),
         "user": UserSchema.model_validate(u).model_dump(),
     }
 
@@ -446,10 +1135,7 @@ def login(r: LoginRequest, db: Session = Depends(get_db)):
 @app.get("/api/v1/user/me", response_model=UserSchema)
 def me(authorization: str = Header(None), db: Session = Depends(get_db)):
     uid = get_uid_from_token(authorization)
-    user = db.query(DBUser).filter(DBUser.id == uid).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
+    return get_principal(db, uid)
 
 
 # ---------- MONITOR DE CORREO (SPF/DMARC + RBL + Fugas simuladas) ----------
@@ -460,11 +1146,9 @@ def email_security_check(
     db: Session = Depends(get_db),
 ):
     uid = get_uid_from_token(authorization)
-    user = db.query(DBUser).filter(DBUser.id == uid).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    user = get_principal(db, uid)
 
-    email = user.email
+    email = user["email"]
     domain = email.split("@")[-1]
 
     report: Dict[str, Any] = {
@@ -496,6 +1180,10 @@ def email_security_check(
             "Cambia tu contraseña de inmediato y habilita MFA donde sea posible."
         )
 
+    # Carga diferida: solo esta ruta usa dnspython y pydnsbl
+    import dns.resolver        # Para SPF/DMARC
+    import pydnsbl             # Para listas negras (RBL)
+
     # B. Análisis DNS (SPF y DMARC)
     try:
         spf_answers = dns.resolver.resolve(domain, "TXT")
@@ -559,6 +1247,23 @@ def hist(authorization: str = Header(None), db: Session = Depends(get_db)):
     )
 
 
+# ---------- TENDENCIAS DE RIESGO (ROLLUPS DIARIOS) ----------
+
+@app.get("/api/v1/evaluation/trends", response_model=List[RiskTrendPoint])
+def trends(
+    host: Optional[str] = None,
+    days: int = 90,
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Serie diaria (ISG, severidades, nuevos/resueltos) servida desde risk_rollups.
+    Sin `host` devuelve el agregado del tenant.
+    """
+    uid = get_uid_from_token(authorization)
+    return get_trends(db, uid, host=host, days=min(max(days, 1), 730))
+
+
 # ---------- INICIO DE ESCANEO ----------
 
 @app.post("/api/v1/evaluation/start")
@@ -568,25 +1273,103 @@ async def start(
     db: Session = Depends(get_db),
 ):
     uid = get_uid_from_token(authorization)
+    principal = get_principal(db, uid)
+    key = scan_key(scope_of(uid, principal["company_name"]), p.ip_range, p.scan_type)
+
+    # 1. ¿Mismo escaneo completado hace poco? Copia en una fila propia, sin ejecutar nada
+    source = find_reusable(db, key)
+    if source is not None:
+        results = reused_results(source)
+        reused = DBScanResult(
+            status="Completed",
+            results=results,
+            user_id=uid,
+            host=p.ip_range,
+            scan_key=key,
+            # Conserva el fin original: la reutilización no alarga el TTL
+            completed_at=source.completed_at,
+        )
+        db.add(reused)
+        update_rollups(db, uid, results["scan_meta"].get("host") or p.ip_range, results)
+        db.commit()
+        db.refresh(reused)
+
+        findings = len(results.get("vulnerabilities") or [])
+        asyncio.create_task(push_status(
+            uid,
+            f"Resultado reciente reutilizado (escaneo #{source.id}). {findings} hallazgos registrados.",
+            "Completed",
+            reused.id,
+        ))
+        return {"message": "Reutilizado", "scanId": reused.id, "reusedFrom": source.id}
 
     new_scan = DBScanResult(
         status="Pending",
         results={},
         user_id=uid,
         host=p.ip_range,
+        scan_key=key,
+        # Latido inicial: el barrido de recuperación no lo toma por huérfano
+        worker_id=WORKER_ID,
+        heartbeat_at=datetime.now(timezone.utc),
     )
     db.add(new_scan)
     db.commit()
     db.refresh(new_scan)
 
-    # Lanzamos el escaneo real en segundo plano
-    asyncio.create_task(
-        run_scan_real(uid, new_scan.id, p.ip_range, get_db().__next__())
-    )
+    # 2. ¿Mismo escaneo en curso en este worker? Nos unimos a esa ejecución
+    flight, leader = flights.join(key, uid, new_scan.id)
+    if not leader:
+        async def catch_up():
+            await push_status(uid, f"Uniéndose al escaneo en curso de {p.ip_range}...", "Running", new_scan.id)
+            if flight.last:
+                msg, status = flight.last
+                await push_status(uid, msg, status, new_scan.id)
+
+        asyncio.create_task(catch_up())
+        return {"message": "Iniciado", "scanId": new_scan.id, "shared": True}
+
+    # 3. Lanzamos el escaneo real en segundo plano
+    _launch_scan(uid, new_scan.id, p.ip_range)
 
     return {"message": "Iniciado", "scanId": new_scan.id}
 
 
+# ---------- CANCELACIÓN DE ESCANEO ----------
+
+@app.post("/api/v1/scan/{scan_id}/cancel", status_code=202)
+async def cancel_scan(
+    scan_id: int,
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Pide cancelar un escaneo en curso. Se difunde por el bus: el worker que lo
+    ejecuta cancela sus etapas (sondas HTTP y árboles de subprocesos incluidos)
+    y marca la fila como "Cancelled". Si el escaneo es compartido, solo se
+    retira este solicitante. Si ningún worker lo está ejecutando (huérfano a la
+    espera del barrido de recuperación), se cancela directamente en la base de
+    datos para que no se reanude.
+    """
+    uid = get_uid_from_token(authorization)
+    status = (
+        db.query(DBScanResult.status)
+        .filter(DBScanResult.id == scan_id, DBScanResult.user_id == uid)
+        .scalar()
+    )
+    if status is None:
+        raise HTTPException(status_code=404, detail="Escaneo no encontrado")
+    if status not in ("Pending", "Running"):
+        raise HTTPException(status_code=409, detail=f"El escaneo ya terminó ({status})")
+
+    if scan_id not in _live_scan_ids() and await asyncio.to_thread(cancel_orphaned, scan_id):
+        asyncio.create_task(push_status(uid, "Escaneo cancelado.", "Cancelled", scan_id))
+        return {"message": "Cancelado", "scanId": scan_id}
+
+    bus.publish("cancel", {"scan_id": scan_id})
+    return {"message": "Cancelando", "scanId": scan_id}
+
+
 # ---------- DETALLE DE ESCANEO ----------
 
 @app.get("/api/v1/scan/{scan_id}", response_model=ScanResultResponse)
@@ -606,24 +1389,194 @@ def detail(
     return res
 
 
+@app.get("/api/v1/scan/{scan_id}/trace")
+def scan_trace(
+    scan_id: int,
+    format: str = "chrome",
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Línea de tiempo del escaneo. format=chrome (por defecto) devuelve el
+    formato trace-event que abren chrome://tracing y Perfetto; format=raw,
+    la traza compacta tal como se guarda.
+    """
+    uid = get_uid_from_token(authorization)
+    row = (
+        db.query(DBScanResult.trace)
+        .filter(DBScanResult.id == scan_id, DBScanResult.user_id == uid)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Escaneo no encontrado")
+    if not row.trace:
+        raise HTTPException(status_code=404, detail="El escaneo no tiene traza")
+    if format == "raw":
+        return row.trace
+    return JSONResponse(
+        to_chrome_trace(row.trace, scan_id),
+        headers={"Content-Disposition": f'attachment; filename="scan_{scan_id}_trace.json"'},
+    )
+
+
+def _evidence_refs(db: Session, scan_id: int, uid: int) -> Dict[str, List[Dict[str, Any]]]:
+    row = (
+        db.query(DBScanResult.results)
+        .filter(DBScanResult.id == scan_id, DBScanResult.user_id == uid)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Escaneo no encontrado")
+    return ((row.results or {}).get("scan_meta") or {}).get("evidence") or {}
+
+
+@app.get("/api/v1/scan/{scan_id}/evidence")
+def scan_evidence(
+    scan_id: int,
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Salidas crudas guardadas de cada herramienta (referencias, sin contenido)."""
+    uid = get_uid_from_token(authorization)
+    return _evidence_refs(db, scan_id, uid)
+
+
+@app.get("/api/v1/scan/{scan_id}/evidence/{sha256}")
+def download_evidence(
+    scan_id: int,
+    sha256: str,
+    authorization: str = Header(None),
+    accept_encoding: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Descarga en streaming una salida cruda del escaneo. Si el cliente acepta
+    gzip y el blob está en gzip, se envía tal cual (sin descomprimir).
+    """
+    uid = get_uid_from_token(authorization)
+    refs = [r for stage in _evidence_refs(db, scan_id, uid).values() for r in stage]
+    ref = next((r for r in refs if r.get("sha256") == sha256), None)
+    if ref is None:
+        raise HTTPException(status_code=404, detail="Evidencia no encontrada en este escaneo")
+
+    store = get_blob_store()
+    found = store.locate(sha256)
+    if found is None:
+        raise HTTPException(status_code=410, detail="La evidencia ya no está en el almacén")
+
+    filename = f"scan_{scan_id}_{ref.get('tool', 'tool')}_{ref.get('stream', 'out')}.txt"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if found[1] == "gzip" and "gzip" in (accept_encoding or ""):
+        headers["Content-Encoding"] = "gzip"
+        body = store.iter_raw(sha256)
+    else:
+        body = store.iter_content(sha256)
+    return StreamingResponse(body, media_type="text/plain; charset=utf-8", headers=headers)
+
+
 # ---------- CONFIGURACIÓN BÁSICA DE LA PYME ----------
 
+# Nombre de host RFC 1123: etiquetas de 1-63 caracteres, sin guion al principio ni al final
+_HOSTNAME_RE = re.compile(r"^(?!-)[a-z0-9-]{1,63}(?<!-)(\.(?!-)[a-z0-9-]{1,63}(?<!-))*$", re.I)
+
+# Servidores que el scheduler escanea cuando una PYME los configura: redes
+# (CIDR) o dominios separados por comas, p. ej. "203.0.113.0/24,midominio.com".
+# El registro es abierto, así que vacío = ninguno: la configuración se guarda,
+# pero el alta en el scheduler queda para un administrador (company.yaml)
+COMPANY_TARGET_ALLOWLIST = [
+    item.strip().lower()
+    for item in os.getenv("COMPANY_TARGET_ALLOWLIST", "").split(",")
+    if item.strip()
+]
+
+
+def _schedulable(host: str) -> bool:
+    """¿Está el servidor dentro de COMPANY_TARGET_ALLOWLIST?"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        ip = None
+    for item in COMPANY_TARGET_ALLOWLIST:
+        if ip is not None:
+            try:
+                if ip in ipaddress.ip_network(item, strict=False):
+                    return True
+            except ValueError:
+                continue  # es un dominio
+        elif host == item or host.endswith("." + item):
+            return True
+    return False
+
+
+def _valid_server_host(value: Optional[str]) -> Optional[str]:
+    """IP o nombre de host del servidor principal; None si viene vacío. 422 si no es ninguna."""
+    value = (value or "").strip().rstrip(".")
+    if not value:
+        return None
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        pass
+    if len(value) <= 253 and _HOSTNAME_RE.match(value):
+        return value.lower()
+    raise HTTPException(status_code=422, detail="main_server_ip debe ser una IP o un nombre de host")
+
+
 @app.get("/api/v1/config/company")
-def get_company_config():
-    # Aquí podrías persistir en DB o archivo YAML;
-    # por ahora devolvemos valores estáticos
+def get_company_config(
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    uid = get_uid_from_token(authorization)
+    cfg = db.query(DBCompanyConfig).filter(DBCompanyConfig.user_id == uid).first()
+    if not cfg:
+        # Valores por defecto mientras la PYME no guarde su configuración
+        return {
+            "sector": "tecnologia",
+            "network_size": 10,
+            "main_server_ip": "127.0.0.1",
+        }
     return {
-        "sector": "tecnologia",
-        "network_size": 10,
-        "main_server_ip": "127.0.0.1",
+        "sector": cfg.sector,
+        "network_size": cfg.network_size,
+        "main_server_ip": cfg.main_server_ip,
     }
 
 
 @app.post("/api/v1/config/company")
-def update_company_config(config: ConfigUpdate):
-    # Aquí podrías guardar en DB o archivo.
-    # Lo dejamos simple (pero la firma ya está lista).
-    return {"message": "Configuración guardada"}
+def update_company_config(
+    config: ConfigUpdate,
+    authorization: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    uid = get_uid_from_token(authorization)
+    server = _valid_server_host(config.main_server_ip)
+    cfg = db.query(DBCompanyConfig).filter(DBCompanyConfig.user_id == uid).first()
+    if not cfg:
+        cfg = DBCompanyConfig(user_id=uid)
+        db.add(cfg)
+    previous = cfg.main_server_ip
+    cfg.sector = config.sector
+    cfg.network_size = config.network_size
+    cfg.main_server_ip = server
+    db.commit()
+
+    # El servidor principal entra al inventario del scheduler (job/main.py lo
+    # detecta solo) si está permitido, y sustituye al anterior salvo que otra
+    # PYME también lo use. Las filas del YAML nunca se modifican ni se borran
+    if previous and previous != server:
+        shared = (
+            db.query(DBCompanyConfig.id)
+            .filter(DBCompanyConfig.main_server_ip == previous, DBCompanyConfig.user_id != uid)
+            .first()
+        )
+        if not shared:
+            remove_api_target(previous)
+    scheduled = False
+    if server and _schedulable(server):
+        upsert_api_target({"host": server, "tags": ["company-config", f"user:{uid}"]})
+        scheduled = True
+    return {"message": "Configuración guardada", "scheduled": scheduled}
 
 
 # ---------- DESCARGA DE PDF DE REPORTE ----------
@@ -647,35 +1600,22 @@ def download_report_pdf(
 
     # 2. Extraer resultados y AI
     results = scan.results or {}
-    vulns = results.get("vulnerabilities", []) or []
+    vulns = load_findings(results.get("vulnerabilities"))
     ai_text = results.get("ai_summary", "Sin análisis IA.")
 
     # 3. Contar vulnerabilidades por severidad para el gráfico
-    sev_buckets = {
-        "CRÍTICO": ["CRITICA", "CRITICAL"],
-        "ALTO": ["ALTA", "HIGH"],
-        "MEDIO": ["MEDIA", "MEDIUM"],
-        "BAJO": ["BAJA", "LOW"],
-        "INFO": ["INFO"],
-    }
-    counts = {k: 0 for k in sev_buckets.keys()}
-
-    for v in vulns:
-        sev = (v.get("severity") or "INFO").upper()
-        matched = False
-        for label, keys in sev_buckets.items():
-            if any(k in sev for k in keys):
-                counts[label] += 1
-                matched = True
-                break
-        if not matched:
-            counts["INFO"] += 1
+    counts = {sev.label: n for sev, n in count_by_severity(vulns).items()}
 
     max_count = max(counts.values()) if counts else 0
     if max_count == 0:
         max_count = 1  # para evitar división por cero
 
-    # 4. Crear PDF en memoria
+    # 4. Crear PDF en memoria (ReportLab se importa solo al generar informes)
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.utils import simpleSplit
+
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
@@ -799,6 +1739,14 @@ def download_report_pdf(
 
     # Listado de vulnerabilidades
     c.setFont("Helvetica", 10)
+    # Color por severidad
+    sev_colors = {
+        Severity.CRITICA: colors.red,
+        Severity.ALTA: colors.orange,
+        Severity.MEDIA: colors.brown,
+        Severity.BAJA: colors.green,
+        Severity.INFO: colors.blue,
+    }
     for v in vulns:
         if y < 100:
             c.showPage()
@@ -806,28 +1754,11 @@ def download_report_pdf(
             y = height - 50
             c.setFont("Helvetica", 10)
 
-        severity = (v.get("severity") or "INFO").upper()
-        name = v.get("name") or "Evento"
-
-        # Color por severidad
-        if "CRITIC" in severity:
-            color = colors.red
-        elif "ALTA" in severity or "HIGH" in severity:
-            color = colors.orange
-        elif "MED" in severity:
-            color = colors.brown
-        elif "BAJA" in severity or "LOW" in severity:
-            color = colors.green
-        elif "INFO" in severity:
-            color = colors.blue
-        else:
-            color = colors.black
-
-        c.setFillColor(color)
-        c.drawString(50, y, f"[{severity}] {name}")
+        c.setFillColor(sev_colors[v.severity])
+        c.drawString(50, y, f"[{v.severity.name}] {v.name or 'Evento'}")
 
         c.setFillColor(colors.gray)
-        desc = (v.get("description") or "").replace("\n", " ")
+        desc = v.description.replace("\n", " ")
         if len(desc) > 95:
             desc = desc[:95] + "..."
         c.drawString(50, y - 15, desc)
@@ -870,14 +1801,71 @@ async def validation_exception_handler(request, exc: RequestValidationError):
 
 # ---------- WEBSOCKET PARA ESTADO DE ESCANEOS ----------
 
+def _ws_token_uid(raw: Optional[str]) -> Optional[int]:
+    """user_id de un token (suelto o como {"token": ...}); None si no es válido."""
+    if not raw:
+        return None
+    try:
+        if raw.lstrip().startswith("{"):
+            raw = json.loads(raw).get("token") or ""
+        return int(decode_token(raw.removeprefix("Bearer ").strip())["sub"])
+    except (TokenError, KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+
 @app.websocket("/ws/status/{user_id}")
-async def ws_endpoint(websocket: WebSocket, user_id: int):
+async def ws_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    since: Optional[int] = None,
+    token: Optional[str] = None,
+):
+    """
+    Progreso de escaneos en vivo. Requiere el token del usuario: ?token=<jwt>
+    o como primer mensaje ({"token": "<jwt>"}); si no corresponde a user_id
+    se cierra con 1008.
+
+    Con ?since=<seq> (último seq recibido) se reenvían primero los eventos
+    perdidos durante la desconexión. Si eran más de WS_REPLAY_LIMIT, antes
+    llega {"status": "Reset", "truncated": true}: recargar los escaneos.
+    """
     await websocket.accept()
-    active_connections[user_id] = websocket
+    if token is None:
+        try:
+            token = await asyncio.wait_for(websocket.receive_text(), timeout=WS_AUTH_TIMEOUT_S)
+        except (asyncio.TimeoutError, WebSocketDisconnect, RuntimeError):
+            token = None
+    if _ws_token_uid(token) != user_id:
+        try:
+            await websocket.close(code=1008)
+        except RuntimeError:
+            pass
+        return
+
+    # Registramos antes del replay para no perder lo que llegue mientras tanto
+    conn = hub.connect(user_id, websocket, paused=since is not None)
     try:
+        if since is not None:
+            last_seq = since
+            events, truncated = await asyncio.to_thread(events_since, user_id, since)
+            if truncated:
+                await websocket.send_json({
+                    "status": "Reset",
+                    "truncated": True,
+                    "message": "Se perdieron demasiados eventos: recarga los escaneos.",
+                    "scanId": None,
+                    "seq": since,
+                })
+            for message in events:
+                await websocket.send_json(message)
+                last_seq = message["seq"]
+            hub.resume(conn, last_seq)
+
         while True:
             # No esperamos un mensaje específico, solo mantenemos la conexión viva
             await websocket.receive_text()
-    except WebSocketDisconnect:
-        if user_id in active_connections:
-            del active_connections[user_id]
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: el hub ya cerró el socket por consumidor lento
+        pass
+    finally:
+        hub.disconnect(conn)
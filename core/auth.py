@@ -0,0 +1,192 @@
+# pymesec/core/auth.py
+
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from .db import User
+
+# Clave HMAC de los tokens. Obligatoria y la misma en todos los workers/nodos:
+# sin ella la API no arranca (una clave generada por proceso o por máquina
+# invalidaría los tokens emitidos por los demás)
+AUTH_SECRET = os.getenv("AUTH_SECRET", "")
+# Vida de un token (segundos)
+AUTH_TOKEN_TTL_S = int(os.getenv("AUTH_TOKEN_TTL_S", str(12 * 3600)))
+# Caché de usuarios (principal) por proceso
+AUTH_PRINCIPAL_TTL_S = float(os.getenv("AUTH_PRINCIPAL_TTL_S", "300"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+
+_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+class TokenError(Exception):
+    """Token mal formado, con firma inválida o caducado."""
+
+
+# ============================================================
+#                      CLAVE DE FIRMA
+# ============================================================
+
+def _load_secret() -> bytes:
+    if not AUTH_SECRET:
+        raise RuntimeError(
+            "AUTH_SECRET no definida: fije una clave aleatoria común a todos los nodos "
+            '(p. ej. python -c "import secrets; print(secrets.token_urlsafe(48))").'
+        )
+    return AUTH_SECRET.encode("utf-8")
+
+
+_secret: Optional[bytes] = None
+
+
+def _key() -> bytes:
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    return _secret
+
+
+def check_secret() -> None:
+    """Falla al arrancar (y no en el primer login) si falta AUTH_SECRET."""
+    _key()
+
+
+# ============================================================
+#                 TOKENS FIRMADOS (JWT HS256)
+# ============================================================
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(signing_input: bytes) -> str:
+    return _b64encode(hmac.new(_key(), signing_input, hashlib.sha256).digest())
+
+
+def issue_token(user: User, ttl_s: int = AUTH_TOKEN_TTL_S) -> str:
+    """JWT HS256 con lo que las rutas necesitan sin ir a la BD: id, email y empresa."""
+    now = int(time.time())
+    claims = {
+        "sub": str(user.id),
+        "email": user.email,
+        "company": user.company_name,
+        "iat": now,
+        "exp": now + ttl_s,
+    }
+    signing_input = (
+        _b64encode(json.dumps(_HEADER, separators=(",", ":")).encode())
+        + "."
+        + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    )
+    return f"{signing_input}.{_sign(signing_input.encode('ascii'))}"
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Verifica firma y caducidad. Devuelve los claims."""
+    try:
+        header_b64, claims_b64, signature = token.split(".")
+    except ValueError:
+        raise TokenError("formato")
+    expected = _sign(f"{header_b64}.{claims_b64}".encode("ascii"))
+    if not hmac.compare_digest(expected, signature):
+        raise TokenError("firma")
+    try:
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+    except ValueError:
+        raise TokenError("formato")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenError("formato")
+    if header.get("alg") != "HS256":
+        raise TokenError("algoritmo")
+    try:
+        expires = int(claims.get("exp", 0))
+    except (TypeError, ValueError):
+        raise TokenError("formato")
+    if expires < time.time():
+        raise TokenError("caducado")
+    return claims
+
+
+# ============================================================
+#             CACHÉ DE PRINCIPALES (LRU + TTL)
+# ============================================================
+
+def _principal(user: User) -> Dict[str, Any]:
+    # Dict plano (no el objeto ORM): sobrevive a la sesión que lo cargó
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "company_name": user.company_name,
+    }
+
+
+class PrincipalCache:
+    """
+    Usuarios recientes en memoria del proceso: las rutas que necesitan el
+    perfil (/user/me, email-check, ámbito de deduplicación) no consultan la
+    tabla users en cada petición. Las entradas caducan a los `ttl` segundos
+    y se invalidan al cambiar el usuario (invalidate, difundido por el bus).
+    """
+
+    def __init__(self, max_size: int = AUTH_PRINCIPAL_CACHE_SIZE, ttl: float = AUTH_PRINCIPAL_TTL_S):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # Las rutas síncronas corren en el threadpool
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, user_id: int) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        principal = _principal(user)
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return principal
+
+    def put(self, user: User):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, _principal(user))
+            self._entries.move_to_end(user.id)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Olvida un usuario (o todos con None)."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+principals = PrincipalCache()
@@ -0,0 +1,210 @@
+# pymesec/core/blobs.py
+
+import os
+import time
+import gzip
+import asyncio
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# zstd (opcional) comprime mejor y más rápido que gzip; sin él, gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Directorio del almacén de evidencias (salida cruda de las herramientas)
+BLOB_DIR = os.getenv("BLOB_DIR", "./evidence")
+# Salida máxima guardada por ejecución (bytes sin comprimir); el resto se recorta
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(64 * 1024 * 1024)))
+# "zstd" | "gzip" (zstd solo si zstandard está instalado)
+BLOB_CODEC = os.getenv("BLOB_CODEC", "zstd" if zstandard is not None else "gzip").lower()
+BLOB_LEVEL = int(os.getenv("BLOB_LEVEL", "6"))
+
+CHUNK_SIZE = 64 * 1024
+
+_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+
+# ============================================================
+#                ALMACÉN DIRECCIONADO POR CONTENIDO
+# ============================================================
+
+class BlobStore:
+    """
+    Blobs comprimidos en disco, direccionados por el SHA-256 del contenido
+    sin comprimir: <root>/ab/abcdef....zst. La misma salida (p. ej. el mismo
+    "no vulnerable" de sqlmap en cada escaneo) se guarda una sola vez.
+
+    Se escribe en un temporal y se renombra: un blob existe completo o no existe.
+    """
+
+    def __init__(self, root: str = BLOB_DIR, codec: str = BLOB_CODEC, level: int = BLOB_LEVEL):
+        if codec == "zstd" and zstandard is None:
+            codec = "gzip"
+        self.root = root
+        self.codec = codec
+        self.level = level
+
+    def _path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + _SUFFIXES[codec])
+
+    def locate(self, digest: str) -> Optional[tuple]:
+        """(ruta, códec) del blob, se haya guardado con el códec que sea; None si no está."""
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        for codec in _SUFFIXES:
+            path = self._path(digest, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def put(self, data: bytes) -> Dict[str, Any]:
+        """Guarda `data` (si no estaba) y devuelve su referencia."""
+        digest = hashlib.sha256(data).hexdigest()
+        found = self.locate(digest)
+        if found is not None:
+            # mtime = última vez referenciado: prune() no borra lo que se reutiliza
+            try:
+                os.utime(found[0])
+            except OSError:
+                pass
+            return {"sha256": digest, "size": len(data), "stored": os.path.getsize(found[0]), "codec": found[1]}
+
+        path = self._path(digest, self.codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = self._compress(data)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(packed)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return {"sha256": digest, "size": len(data), "stored": len(packed), "codec": self.codec}
+
+    def iter_raw(self, digest: str) -> Iterator[bytes]:
+        """Bytes comprimidos tal cual están en disco (para servirlos sin descomprimir)."""
+        found = self.locate(digest)
+        if found is None:
+            raise KeyError(digest)
+        with open(found[0], "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_content(self, digest: str) -> Iterator[bytes]:
+        """Contenido original, descomprimido por trozos (sin cargarlo entero en memoria)."""
+        found = self.locate(digest)
+        if found is None:
+            raise KeyError(digest)
+        path, codec = found
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Blob zstd sin el paquete zstandard instalado")
+            with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                yield from iter(lambda: reader.read(CHUNK_SIZE), b"")
+        else:
+            with gzip.open(path, "rb") as f:
+                yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+
+    def read(self, digest: str) -> bytes:
+        return b"".join(self.iter_content(digest))
+
+    def prune(self, older_than_s: float) -> int:
+        """
+        Borra los blobs no referenciados por ningún escaneo guardado en los
+        últimos `older_than_s` segundos (su mtime se renueva en cada put).
+        Devuelve cuántos borró.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - older_than_s
+        removed = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                try:
+                    if blob.stat().st_mtime < cutoff:
+                        os.remove(blob.path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        _store = BlobStore()
+    return _store
+
+
+# ============================================================
+#            EVIDENCIAS DE LAS HERRAMIENTAS DEL ESCANEO
+# ============================================================
+
+# Referencias recogidas por la etapa en curso (None = no se guarda nada)
+_evidence: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("scan_evidence", default=None)
+
+
+@contextmanager
+def collect_evidence():
+    """
+    Recoge las salidas que las herramientas guarden dentro del bloque:
+
+        with collect_evidence() as refs:
+            findings = await scan_sqlmap(url)
+        # refs: [{"sha256", "size", "stored", "codec", "tool", "stream", ...}]
+
+    Fuera de un bloque, record_output no escribe nada (sin escaneo que la
+    referencie, la salida sería basura en disco).
+    """
+    refs: List[Dict[str, Any]] = []
+    token = _evidence.set(refs)
+    try:
+        yield refs
+    finally:
+        _evidence.reset(token)
+
+
+async def record_output(tool: str, stream: str, data, **meta) -> Optional[Dict[str, Any]]:
+    """
+    Guarda la salida cruda de una herramienta (stdout, stderr, informe) en el
+    almacén y la añade a las evidencias de la etapa. Comprimir y escribir va
+    en un hilo: no bloquea el event loop.
+    """
+    refs = _evidence.get()
+    if refs is None or not data:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8", errors="replace")
+    truncated = len(data) > BLOB_MAX_BYTES
+    if truncated:
+        data = data[:BLOB_MAX_BYTES]
+    try:
+        ref = await asyncio.to_thread(get_blob_store().put, data)
+    except OSError as e:
+        print(f"No se pudo guardar la salida de {tool} ({stream}): {e}")
+        return None
+    ref.update(tool=tool, stream=stream, **meta)
+    if truncated:
+        ref["truncated"] = True
+    refs.append(ref)
+    return ref
@@ -1,18 +1,33 @@
 # pymesec/core/db.py
 
 import os
+import json
 from sqlalchemy import (
     create_engine,
+    inspect,
+    text,
     Column,
     Integer,
     String,
+    Float,
+    Date,
     JSON,
     DateTime,
     ForeignKey,
+    Index,
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, deferred
 from sqlalchemy.sql import func
 
+from .metrics import instrument_engine
+
+# orjson (opcional) serializa las columnas JSON (resultados con miles de
+# hallazgos) bastante más rápido que json; sin él se usa la librería estándar
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ---------------------------------
 # 1) Configuración de la base de datos
 # ---------------------------------
@@ -21,12 +36,32 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pymesec_data.db")
 # Para que también funcione con SQLite en local
 connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 
+
+
+def _json_dumps(value) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # tipos que orjson no conoce: que decida json (y su error)
+    return json.dumps(value)
+
+
+def _json_loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
 engine = create_engine(
     DATABASE_URL,
     future=True,
     connect_args=connect_args,
+    json_serializer=_json_dumps,
+    json_deserializer=_json_loads,
 )
 
+# Latencia de las sentencias SQL en /metrics
+instrument_engine(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -50,6 +85,12 @@ class User(Base):
 
 class ScanResult(Base):
     __tablename__ = "scan_results"
+    __table_args__ = (
+        # Barrido de recuperación: escaneos sin terminar y con latido caducado
+        Index("ix_scan_results_liveness", "status", "heartbeat_at"),
+        # Historial del usuario (más recientes primero) sin recorrer los del scheduler
+        Index("ix_scan_results_user_time", "user_id", "scan_time"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -57,16 +98,249 @@ class ScanResult(Base):
     status = Column(String(50), default="Pending", nullable=False)
     results = Column(JSON, default=dict)  # JSON con todo el reporte
     scan_time = Column(DateTime(timezone=True), server_default=func.now())
+    # Línea de tiempo compacta del escaneo (core/trace.py); diferida: solo se
+    # carga al pedir la traza, no en el historial
+    trace = deferred(Column(JSON, nullable=True))
+    # Clave de deduplicación (ámbito|objetivo normalizado|perfil, core/flights.py)
+    # y fin del escaneo: permiten reutilizar resultados recientes
+    scan_key = Column(String(300), nullable=True, index=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    # Etapas ya terminadas (core/pipeline.py ScanContext.snapshot) para
+    # reanudar tras un reinicio, y latido del worker que ejecuta el escaneo
+    checkpoint = deferred(Column(JSON, nullable=True))
+    worker_id = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
 
     user = relationship("User", back_populates="scans")
 
 
+class RiskRollup(Base):
+    """
+    Agregado diario de riesgo. Una fila por (día, usuario, host); la fila
+    con host = "*" resume a todo el tenant (usuario) en ese día.
+    """
+    __tablename__ = "risk_rollups"
+    __table_args__ = (
+        Index("ix_risk_rollups_scope", "user_id", "host", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    host = Column(String(255), nullable=False)
+    scans = Column(Integer, default=0, nullable=False)
+    isg = Column(Float, default=100.0, nullable=False)
+    critical = Column(Integer, default=0, nullable=False)
+    high = Column(Integer, default=0, nullable=False)
+    medium = Column(Integer, default=0, nullable=False)
+    low = Column(Integer, default=0, nullable=False)
+    info = Column(Integer, default=0, nullable=False)
+    new_findings = Column(Integer, default=0, nullable=False)
+    resolved_findings = Column(Integer, default=0, nullable=False)
+    # Huellas de los hallazgos abiertos tras el último escaneo del día (solo filas de host)
+    open_fingerprints = Column(JSON, default=list)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# Una sola fila por (día, usuario, host), aunque escriban varios workers a la
+# vez (core/rollups.py _claim_row). Las filas del scheduler tienen user_id
+# NULL, y NULL nunca choca en un UNIQUE: se indexa como 0
+Index(
+    "uq_risk_rollups_day_scope",
+    RiskRollup.day, func.coalesce(RiskRollup.user_id, 0), RiskRollup.host,
+    unique=True,
+)
+
+
+class ScanEvent(Base):
+    """
+    Log append-only del progreso de escaneos. `seq` es monotónico y permite
+    que un WebSocket reconectado pida solo los eventos que se perdió.
+    """
+    __tablename__ = "scan_events"
+    __table_args__ = (
+        Index("ix_scan_events_user_seq", "user_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    scan_id = Column(Integer, nullable=False, index=True)
+    status = Column(String(20), nullable=False)
+    message = Column(String(500), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class Target(Base):
+    """
+    Inventario persistente de objetivos del scheduler. Se importa desde
+    company.yaml (source="yaml") o se da de alta desde la API (source="api").
+    """
+    __tablename__ = "targets"
+
+    id = Column(Integer, primary_key=True)
+    target_key = Column(String(512), unique=True, nullable=False)
+    host = Column(String(255), nullable=False, index=True)
+    network = Column(String(255), nullable=True, index=True)
+    tags = Column(JSON, default=list)
+    config = Column(JSON, default=dict)  # entrada completa tal cual la usa el scheduler
+    content_hash = Column(String(40), nullable=False)
+    source = Column(String(20), default="yaml", nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)  # epoch
+
+
+class InventorySource(Base):
+    """Huella del último fichero importado al inventario (evita reparsear un YAML sin cambios)."""
+    __tablename__ = "inventory_sources"
+
+    source = Column(String(50), primary_key=True)
+    digest = Column(String(40), nullable=False)
+    imported_at = Column(Float, nullable=False)
+
+
+class CompanyConfig(Base):
+    __tablename__ = "company_config"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, nullable=True)
+    sector = Column(String(100), nullable=False)
+    network_size = Column(Integer, nullable=False)
+    main_server_ip = Column(String(255), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class TargetLease(Base):
+    """
+    Reparto de objetivos del scheduler entre varios workers (job/main.py).
+    Un worker reclama los objetivos vencidos con un lease que renueva por
+    heartbeat; si muere, el lease caduca y otro worker los toma.
+    Los instantes se guardan como epoch (segundos) para comparar igual en
+    SQLite y Postgres.
+    """
+    __tablename__ = "target_leases"
+
+    target_key = Column(String(512), primary_key=True)
+    target = Column(JSON, default=dict)
+    next_run_at = Column(Float, nullable=False, index=True)
+    slot_at = Column(Float, nullable=False)
+    catch_up_pending = Column(Integer, default=0, nullable=False)
+    owner = Column(String(100), nullable=True)
+    lease_until = Column(Float, nullable=True)
+    last_run_at = Column(Float, nullable=True)
+
+
 # ---------------------------------
 # 3) helpers de sesión
 # ---------------------------------
 def init_db():
     """Crea todas las tablas definidas por Base."""
+    if engine.dialect.name == "postgresql":
+        # En Postgres, scan_results nace particionada por mes (core/retention.py)
+        from .retention import ensure_partitioned_table
+        ensure_partitioned_table()
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _add_missing_indexes()
+
+
+def _add_missing_columns():
+    """
+    create_all no altera tablas existentes: añadimos las columnas nuevas
+    (siempre NULLables) que falten en bases de datos ya desplegadas.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                    ))
+                print(f"[DB] Columna añadida: {table.name}.{column.name}")
+            except Exception as e:
+                # Otro worker pudo añadirla a la vez
+                print(f"[DB] No se pudo añadir {table.name}.{column.name}: {e}")
+                continue
+            # Y los índices de la columna nueva (index=True en el modelo)
+            for idx in table.indexes:
+                if column.name in idx.columns:
+                    try:
+                        idx.create(bind=engine, checkfirst=True)
+                    except Exception as e:
+                        print(f"[DB] No se pudo crear el índice {idx.name}: {e}")
+
+
+def _index_names(table_name: str) -> set:
+    """
+    Nombres de los índices de una tabla. Del catálogo y no del inspector:
+    SQLite no refleja los índices de expresiones (uq_risk_rollups_day_scope).
+    """
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"),
+                {"t": table_name},
+            )
+        elif engine.dialect.name == "postgresql":
+            rows = conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": table_name})
+        else:
+            return {i["name"] for i in inspect(conn).get_indexes(table_name)}
+        return set(rows.scalars())
+
+
+def _add_missing_indexes():
+    """Igual que las columnas: índices nuevos del modelo sobre tablas ya desplegadas."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = _index_names(table.name)
+        for idx in table.indexes:
+            if idx.name in existing:
+                continue
+            if idx.name == "uq_risk_rollups_day_scope":
+                _merge_duplicate_rollups()
+            try:
+                idx.create(bind=engine)
+                print(f"[DB] Índice añadido: {idx.name}")
+            except Exception as e:
+                print(f"[DB] No se pudo crear el índice {idx.name}: {e}")
+
+
+def _merge_duplicate_rollups():
+    """
+    Antes de crear el índice único: escritores concurrentes pudieron dejar
+    varias filas del mismo (día, usuario, host). Se funden en la más
+    reciente sumando los contadores acumulados del día.
+    """
+    scope = (RiskRollup.day, func.coalesce(RiskRollup.user_id, 0), RiskRollup.host)
+    db = SessionLocal()
+    try:
+        groups = db.query(*scope).group_by(*scope).having(func.count(RiskRollup.id) > 1).all()
+        for day, uid, host in groups:
+            rows = (
+                db.query(RiskRollup)
+                .filter(RiskRollup.day == day, func.coalesce(RiskRollup.user_id, 0) == uid, RiskRollup.host == host)
+                .order_by(RiskRollup.id)
+                .all()
+            )
+            keep = rows[-1]
+            for dup in rows[:-1]:
+                keep.scans += dup.scans or 0
+                keep.new_findings += dup.new_findings or 0
+                keep.resolved_findings += dup.resolved_findings or 0
+                db.delete(dup)
+        db.commit()
+        if groups:
+            print(f"[DB] risk_rollups: {len(groups)} días duplicados fusionados")
+    finally:
+        db.close()
 
 
 def get_db():
@@ -0,0 +1,46 @@
+# pymesec/core/deadline.py
+
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Tiempo total máximo de un escaneo (segundos); se reparte entre sus etapas
+SCAN_DEADLINE_S = float(os.getenv("SCAN_DEADLINE_S", "900"))
+
+# Instante límite (time.monotonic) del escaneo de la tarea actual; las tareas
+# hijas (etapas, sondas, subprocesos) heredan una copia
+_deadline: ContextVar[Optional[float]] = ContextVar("scan_deadline", default=None)
+
+
+def set_deadline(seconds: Optional[float]) -> Optional[float]:
+    """Fija el límite de la tarea actual a `seconds` desde ahora (None = sin límite)."""
+    at = time.monotonic() + seconds if seconds else None
+    _deadline.set(at)
+    return at
+
+
+def remaining() -> Optional[float]:
+    """Segundos que quedan hasta el límite (None si no hay)."""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return max(0.0, at - time.monotonic())
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def clamp(timeout: Optional[float], minimum: float = 0.0) -> Optional[float]:
+    """
+    Recorta un timeout propio (de una etapa, sonda o herramienta) a lo que
+    queda del presupuesto del escaneo. `minimum` evita timeouts de 0 en
+    clientes HTTP que lo interpretan como "sin espera".
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    value = left if timeout is None else min(timeout, left)
+    return max(value, minimum)
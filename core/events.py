@@ -0,0 +1,196 @@
+# pymesec/core/events.py
+
+import os
+import json
+import queue
+import atexit
+import select
+import asyncio
+import threading
+from typing import Callable, Dict, List, Any, Optional
+
+from .db import DATABASE_URL
+
+# "local" (un solo proceso) o "postgres" (LISTEN/NOTIFY entre workers y nodos)
+EVENT_BUS = os.getenv(
+    "EVENT_BUS", "postgres" if DATABASE_URL.startswith("postgres") else "local"
+)
+PG_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "pymesec_events")
+
+# NOTIFY admite payloads de hasta 8000 bytes
+PG_MAX_PAYLOAD = 7900
+
+Handler = Callable[[Dict[str, Any]], None]
+
+
+class LocalBroker:
+    """
+    Bus en memoria: entrega los eventos a los suscriptores del mismo proceso.
+    Válido cuando la API corre con un único worker.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    def subscribe(self, topic: str, handler: Handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, payload: Dict[str, Any]):
+        self._dispatch(topic, payload)
+
+    def _dispatch(self, topic: str, payload: Dict[str, Any]):
+        for handler in self._handlers.get(topic, []):
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"[EventBus] Error en suscriptor de '{topic}': {e}")
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Bus sobre Postgres LISTEN/NOTIFY. Cualquier proceso (worker de la API o
+    scheduler) publica; cada worker de la API escucha y reparte los eventos
+    a los WebSockets que tenga conectados.
+
+    La publicación se encola y la ejecuta un hilo propio con una única
+    conexión de larga duración (también en el scheduler, que no escucha):
+    el event loop nunca espera a la base de datos y no se abre una conexión
+    por evento.
+    """
+
+    def __init__(self, dsn: str, channel: str = PG_CHANNEL):
+        super().__init__()
+        # psycopg2 no entiende el prefijo de dialecto de SQLAlchemy
+        self.dsn = dsn.replace("postgresql+psycopg2://", "postgresql://")
+        self.channel = channel
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._publisher_thread: Optional[threading.Thread] = None
+        self._publisher_lock = threading.Lock()
+
+    def _connect(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.set_session(autocommit=True)
+        return conn
+
+    def publish(self, topic: str, payload: Dict[str, Any]):
+        message = json.dumps({"topic": topic, "payload": payload}, default=str)
+        if len(message.encode("utf-8")) > PG_MAX_PAYLOAD:
+            print(f"[EventBus] Evento '{topic}' demasiado grande para NOTIFY; entrega solo local.")
+            self._dispatch(topic, payload)
+            return
+        self._ensure_publisher()
+        self._outbox.put(message)
+
+    def _ensure_publisher(self):
+        """Arranca el hilo publicador la primera vez que hace falta (en cualquier proceso)."""
+        if self._publisher_thread is not None:
+            return
+        with self._publisher_lock:
+            if self._publisher_thread is None:
+                t = threading.Thread(target=self._publisher, name="event-bus-publisher", daemon=True)
+                t.start()
+                self._publisher_thread = t
+                # Procesos sin stop() explícito (scheduler): enviar lo pendiente al salir
+                atexit.register(self.stop)
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._ensure_publisher()
+        t = threading.Thread(target=self._listener, name="event-bus-listener", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 2.0):
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._outbox.put(None)
+        # El publicador vacía la cola antes de salir (el None va el último)
+        if self._publisher_thread is not None:
+            self._publisher_thread.join(timeout)
+
+    def _publisher(self):
+        conn = None
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                break
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_notify(%s, %s)", (self.channel, message))
+            except Exception as e:
+                print(f"[EventBus] Error publicando evento: {e}")
+                _close_quietly(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def _listener(self):
+        backoff = 1.0
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                backoff = 1.0
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self._deliver(note.payload)
+            except Exception as e:
+                print(f"[EventBus] Conexión LISTEN perdida: {e}. Reintentando en {backoff:.0f}s")
+            finally:
+                # Cada reintento abre una conexión nueva: la anterior no debe quedar viva
+                _close_quietly(conn)
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _deliver(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(
+                self._dispatch, message.get("topic"), message.get("payload") or {}
+            )
+
+
+def _close_quietly(conn):
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_bus: Optional[LocalBroker] = None
+
+
+def get_event_bus() -> LocalBroker:
+    """Devuelve el bus configurado (singleton por proceso)."""
+    global _bus
+    if _bus is None:
+        if EVENT_BUS == "postgres":
+            _bus = PostgresBroker(DATABASE_URL)
+        else:
+            _bus = LocalBroker()
+    return _bus
@@ -0,0 +1,192 @@
+# pymesec/core/findings.py
+
+import sys
+import hashlib
+from enum import IntEnum
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# ============================================================
+#                    SEVERIDAD CANÓNICA
+# ============================================================
+
+class Severity(IntEnum):
+    """
+    Severidad de un hallazgo. El valor entero ordena (CRITICA > ALTA > ...);
+    el nombre es lo que se guarda en el JSON y muestra la UI.
+    """
+
+    INFO = 0
+    BAJA = 1
+    MEDIA = 2
+    ALTA = 3
+    CRITICA = 4
+
+    @classmethod
+    def parse(cls, raw: Any) -> "Severity":
+        """Traduce severidades libres ("CRITICAL", "high", "Media"...) a la canónica."""
+        if isinstance(raw, Severity):
+            return raw
+        return _parse_severity(str(raw or "INFO"))
+
+    @property
+    def bucket(self) -> str:
+        """Columna del rollup (risk_rollups): critical, high, medium, low, info."""
+        return _BUCKETS[self]
+
+    @property
+    def label(self) -> str:
+        """Etiqueta para informes: CRÍTICO, ALTO, MEDIO, BAJO, INFO."""
+        return _LABELS[self]
+
+
+@lru_cache(maxsize=256)
+def _parse_severity(raw: str) -> Severity:
+    # Las herramientas usan pocas variantes: cada una se resuelve una sola vez
+    # "CRÍTICO"/"Crítica" (etiquetas de informes) también son críticas
+    sev = raw.upper().replace("Í", "I")
+    if "CRITIC" in sev:
+        return Severity.CRITICA
+    if "ALTA" in sev or "HIGH" in sev:
+        return Severity.ALTA
+    if "MED" in sev:
+        return Severity.MEDIA
+    if "BAJA" in sev or "LOW" in sev:
+        return Severity.BAJA
+    return Severity.INFO
+
+
+_BUCKETS = {
+    Severity.CRITICA: "critical",
+    Severity.ALTA: "high",
+    Severity.MEDIA: "medium",
+    Severity.BAJA: "low",
+    Severity.INFO: "info",
+}
+
+_LABELS = {
+    Severity.CRITICA: "CRÍTICO",
+    Severity.ALTA: "ALTO",
+    Severity.MEDIA: "MEDIO",
+    Severity.BAJA: "BAJO",
+    Severity.INFO: "INFO",
+}
+
+
+# ============================================================
+#                         HALLAZGO
+# ============================================================
+
+_FIELDS = frozenset(("severity", "name", "description", "mitigation"))
+
+
+class Finding:
+    """
+    Hallazgo normalizado. Con __slots__ y los textos repetidos (nombre,
+    mitigación) internados, miles de hallazgos del mismo tipo comparten
+    las mismas cadenas en vez de una copia por dict.
+
+    Las claves que no son del modelo (p. ej. las propias de una herramienta)
+    se conservan en `extra` y vuelven al JSON tal cual.
+    """
+
+    __slots__ = ("severity", "name", "description", "mitigation", "extra", "_fingerprint")
+
+    def __init__(
+        self,
+        severity: Any,
+        name: str,
+        description: str = "",
+        mitigation: str = "",
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.severity = Severity.parse(severity)
+        self.name = sys.intern(str(name or ""))
+        self.description = str(description or "")
+        self.mitigation = sys.intern(str(mitigation or ""))
+        self.extra = extra or None
+        self._fingerprint: Optional[str] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """Huella estable (nombre + descripción) para detectar nuevos/resueltos."""
+        if self._fingerprint is None:
+            raw = f"{self.name}|{self.description}"
+            self._fingerprint = hashlib.sha1(raw.encode("utf-8", errors="ignore")).hexdigest()[:16]
+        return self._fingerprint
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Finding":
+        # Lo habitual son solo los 4 campos del modelo: sin dict extra
+        extra = None if data.keys() <= _FIELDS else {k: v for k, v in data.items() if k not in _FIELDS}
+        return cls(
+            data.get("severity"),
+            data.get("name"),
+            data.get("description"),
+            data.get("mitigation"),
+            extra,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "severity": self.severity.name,
+            "name": self.name,
+            "description": self.description,
+            "mitigation": self.mitigation,
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __eq__(self, other):
+        if not isinstance(other, Finding):
+            return NotImplemented
+        return self.severity == other.severity and self.fingerprint == other.fingerprint
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __repr__(self):
+        return f"Finding({self.severity.name}, {self.name!r})"
+
+
+# ============================================================
+#              NORMALIZACIÓN Y (DE)SERIALIZACIÓN
+# ============================================================
+
+def as_finding(item: Any) -> Finding:
+    """Finding a partir de lo que devuelva un escáner (dict, Finding o texto)."""
+    if isinstance(item, Finding):
+        return item
+    if isinstance(item, dict):
+        return Finding.from_dict(item)
+    # Algunos escáneres devuelven solo la descripción
+    return Finding(Severity.INFO, "Evento", str(item))
+
+
+def normalize_findings(items: Optional[Iterable[Any]]) -> List[Finding]:
+    """Normaliza una vez, en la frontera del escáner, la lista de hallazgos."""
+    if not items:
+        return []
+    if isinstance(items, dict):
+        # Escáner que devuelve un solo hallazgo o un dict de error
+        items = [items] if "severity" in items else []
+    return [as_finding(item) for item in items]
+
+
+def dump_findings(findings: Iterable[Finding]) -> List[Dict[str, Any]]:
+    """Lista lista para la columna JSON (severidad con su nombre canónico)."""
+    return [f.to_dict() for f in findings]
+
+
+def load_findings(data: Optional[Iterable[Dict[str, Any]]]) -> List[Finding]:
+    """Inversa de dump_findings; acepta también filas antiguas con severidades libres."""
+    return normalize_findings(data)
+
+
+def count_by_severity(findings: Iterable[Finding]) -> Dict[Severity, int]:
+    counts = {sev: 0 for sev in Severity}
+    for f in findings:
+        counts[f.severity] += 1
+    return counts
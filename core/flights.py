@@ -0,0 +1,174 @@
+# pymesec/core/flights.py
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from sqlalchemy.orm import Session
+
+from .db import ScanResult
+
+# Reutilizar un escaneo completado hace menos de N segundos (0 = nunca)
+SCAN_REUSE_TTL_S = float(os.getenv("SCAN_REUSE_TTL_S", "300"))
+# Quién comparte ejecuciones y resultados: "global" | "company" | "user".
+# No hay un id de empresa asignado por el servidor: "company" agrupa por el
+# company_name que cada usuario escribe al registrarse, y con el registro
+# abierto cualquiera podría unirse a los escaneos (y evidencias) de otra PYME.
+# Por eso el valor por defecto es "user", que solo deduplica los escaneos
+# repetidos de un mismo usuario; compartir entre los usuarios de una empresa
+# exige activar "company" en un despliegue con altas controladas.
+# Las ejecuciones en curso (FlightRegistry) son por proceso: con varios
+# workers solo se unen las peticiones que caen en el mismo; la reutilización
+# de resultados completados (find_reusable) sí va por la BD.
+SCAN_DEDUP_SCOPE = os.getenv("SCAN_DEDUP_SCOPE", "user").lower()
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+# ============================================================
+#                   CLAVE DE DEDUPLICACIÓN
+# ============================================================
+
+def normalize_target(target: str) -> str:
+    """
+    Forma canónica del objetivo: esquema y host en minúsculas, sin puerto por
+    defecto, sin query ni barra final. "Example.com", "http://example.com/" y
+    "http://EXAMPLE.com:80" son el mismo objetivo.
+    """
+    raw = (target or "").strip()
+    url = raw if raw.startswith("http") else f"http://{raw}"
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        port = parts.port
+    except ValueError:
+        return raw.lower()
+    if not host:
+        return raw.lower()
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    path = parts.path.rstrip("/")
+    return f"{scheme}://{netloc}{path}"
+
+
+def scope_of(user_id: int, company: Optional[str], scope: str = SCAN_DEDUP_SCOPE) -> str:
+    """Parte de la clave que delimita con quién se comparte el resultado."""
+    if scope == "global":
+        return "*"
+    if scope == "company" and company:
+        return "c:" + company.strip().lower()
+    # Sin empresa (o scope="user"): solo consigo mismo
+    return f"u:{user_id}"
+
+
+def scan_key(scope: str, target: str, profile: str) -> str:
+    """Clave del escaneo: ámbito + objetivo normalizado + perfil (scan_type)."""
+    return f"{scope}|{normalize_target(target)}|{(profile or '').strip().lower()}"[:300]
+
+
+# ============================================================
+#                 EJECUCIONES EN CURSO (SINGLEFLIGHT)
+# ============================================================
+
+class Flight:
+    """
+    Una ejecución real compartida por todos los que pidieron el mismo escaneo
+    mientras estaba en curso. Cada solicitante tiene su propia fila ScanResult
+    (members); el progreso y el resultado final se replican a todas.
+    """
+
+    __slots__ = ("key", "run_id", "members", "last", "started")
+
+    def __init__(self, key: str, user_id: int, scan_id: int):
+        self.key = key
+        self.run_id = scan_id                          # scan_id de quien la ejecuta
+        self.members: List[Tuple[int, int]] = [(user_id, scan_id)]
+        self.last: Optional[Tuple[str, str]] = None   # último (mensaje, estado)
+        self.started = time.monotonic()
+
+
+class FlightRegistry:
+    """Ejecuciones en curso de este proceso, por clave y por scan_id del líder."""
+
+    def __init__(self):
+        self._by_key: Dict[str, Flight] = {}
+        self._by_scan: Dict[int, Flight] = {}
+
+    def join(self, key: str, user_id: int, scan_id: int) -> Tuple[Flight, bool]:
+        """Se une a la ejecución en curso o abre una nueva. Devuelve (flight, es_líder)."""
+        flight = self._by_key.get(key)
+        if flight is not None:
+            flight.members.append((user_id, scan_id))
+            return flight, False
+        flight = Flight(key, user_id, scan_id)
+        self._by_key[key] = flight
+        self._by_scan[scan_id] = flight
+        return flight, True
+
+    def for_scan(self, scan_id: int) -> Optional[Flight]:
+        """Ejecución que lanzó scan_id (solo el ejecutor, no los que se unieron)."""
+        return self._by_scan.get(scan_id)
+
+    def containing(self, scan_id: int) -> Optional[Flight]:
+        """Ejecución en curso de la que scan_id es miembro."""
+        for flight in self._by_key.values():
+            if any(sid == scan_id for _uid, sid in flight.members):
+                return flight
+        return None
+
+    def leave(self, flight: Flight, scan_id: int) -> Optional[Tuple[int, int]]:
+        """Saca a un solicitante; la ejecución sigue para el resto. Devuelve su (user_id, scan_id)."""
+        for member in flight.members:
+            if member[1] == scan_id:
+                flight.members.remove(member)
+                return member
+        return None
+
+    def land(self, flight: Flight) -> List[Tuple[int, int]]:
+        """
+        Cierra la ejecución a nuevos miembros y devuelve los definitivos. Quien
+        pida el mismo escaneo a partir de aquí reutilizará el resultado guardado.
+        """
+        if self._by_key.get(flight.key) is flight:
+            del self._by_key[flight.key]
+        self._by_scan.pop(flight.run_id, None)
+        return list(flight.members)
+
+    def scan_ids(self) -> List[int]:
+        """scan_id de todos los solicitantes con una ejecución en curso."""
+        return [sid for flight in self._by_key.values() for _uid, sid in flight.members]
+
+    def __len__(self):
+        return len(self._by_key)
+
+
+# ============================================================
+#                 REUTILIZACIÓN DE RESULTADOS (TTL)
+# ============================================================
+
+def find_reusable(db: Session, key: str, ttl_s: float = SCAN_REUSE_TTL_S) -> Optional[ScanResult]:
+    """Último escaneo completado con la misma clave dentro del TTL (o None)."""
+    if ttl_s <= 0:
+        return None
+    since = datetime.now(timezone.utc) - timedelta(seconds=ttl_s)
+    return (
+        db.query(ScanResult)
+        .filter(
+            ScanResult.scan_key == key,
+            ScanResult.status == "Completed",
+            ScanResult.completed_at >= since,
+        )
+        .order_by(ScanResult.completed_at.desc())
+        .first()
+    )
+
+
+def reused_results(source: ScanResult) -> Dict[str, Any]:
+    """Copia de los resultados de `source` marcada con su origen."""
+    results = dict(source.results or {})
+    meta = dict(results.get("scan_meta") or {})
+    meta["reused_from"] = source.id
+    results["scan_meta"] = meta
+    return results
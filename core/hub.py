@@ -0,0 +1,163 @@
+# pymesec/core/hub.py
+
+import os
+import asyncio
+from collections import deque
+from typing import Dict, Set, Any, Optional
+
+from fastapi import WebSocket
+
+from .metrics import ACTIVE_WEBSOCKETS
+
+# Tamaño máximo de la cola de salida por conexión y tiempo máximo por envío
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# Estados de progreso que pueden ser reemplazados por uno más reciente del mismo escaneo
+COALESCIBLE_STATUSES = {"Pending", "Running"}
+
+
+def _is_coalescible(message: Dict[str, Any]) -> bool:
+    return message.get("status") in COALESCIBLE_STATUSES
+
+
+class _Connection:
+    """
+    Un WebSocket concreto con su cola de salida acotada y su tarea emisora.
+    El escaneo solo encola; la red del cliente la paga la tarea emisora.
+    """
+
+    def __init__(self, user_id: int, websocket: WebSocket, max_queue: int):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.sender: Optional[asyncio.Task] = None
+        # Mientras se reenvía el histórico (replay) la emisión en vivo espera
+        self.ready = asyncio.Event()
+        self.ready.set()
+        # Eventos con seq <= min_seq ya se entregaron en el replay
+        self.min_seq = 0
+
+    def offer(self, message: Dict[str, Any]) -> bool:
+        """
+        Encola un mensaje sin bloquear. Devuelve False si el consumidor está
+        saturado (cola llena de mensajes no descartables) y debe ser expulsado.
+        """
+        if self.closed:
+            return False
+
+        if _is_coalescible(message):
+            # Un progreso nuevo deja obsoleto al pendiente del mismo escaneo
+            for pending in self.queue:
+                if _is_coalescible(pending) and pending.get("scanId") == message.get("scanId"):
+                    self.queue.remove(pending)
+                    break
+
+        if len(self.queue) >= self.max_queue:
+            # Intentamos liberar hueco descartando el progreso más antiguo
+            for pending in self.queue:
+                if _is_coalescible(pending):
+                    self.queue.remove(pending)
+                    break
+            else:
+                return False
+
+        self.queue.append(message)
+        self.wakeup.set()
+        return True
+
+    async def run_sender(self, hub: "ConnectionHub"):
+        try:
+            await self.ready.wait()
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue and not self.closed:
+                    message = self.queue.popleft()
+                    if (message.get("seq") or 0) and message["seq"] <= self.min_seq:
+                        continue
+                    await asyncio.wait_for(
+                        self.websocket.send_json(message), timeout=WS_SEND_TIMEOUT
+                    )
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"WS lento o caído (user {self.user_id}): {e!r}. Expulsando conexión.")
+            hub.evict(self)
+
+
+class ConnectionHub:
+    """
+    Registro de WebSockets activos: varias conexiones por usuario (pestañas),
+    cola de salida acotada por conexión, fusión de progresos obsoletos y
+    expulsión de consumidores lentos.
+    """
+
+    def __init__(self, max_queue: int = WS_MAX_QUEUE):
+        self.max_queue = max_queue
+        self._connections: Dict[int, Set[_Connection]] = {}
+
+    def connect(self, user_id: int, websocket: WebSocket, paused: bool = False) -> _Connection:
+        """
+        Registra un WebSocket ya aceptado y arranca su tarea emisora.
+        Con paused=True los mensajes en vivo se acumulan hasta llamar a resume().
+        """
+        conn = _Connection(user_id, websocket, self.max_queue)
+        if paused:
+            conn.ready.clear()
+        conn.sender = asyncio.create_task(conn.run_sender(self))
+        self._connections.setdefault(user_id, set()).add(conn)
+        ACTIVE_WEBSOCKETS.inc()
+        return conn
+
+    def resume(self, conn: _Connection, min_seq: int = 0):
+        """Reanuda la emisión en vivo descartando lo ya entregado en el replay."""
+        conn.min_seq = min_seq
+        conn.ready.set()
+
+    def disconnect(self, conn: _Connection):
+        conn.closed = True
+        conn.ready.set()
+        conn.wakeup.set()
+        if conn.sender and not conn.sender.done() and conn.sender is not asyncio.current_task():
+            conn.sender.cancel()
+        conns = self._connections.get(conn.user_id)
+        if conns is not None and conn in conns:
+            conns.discard(conn)
+            ACTIVE_WEBSOCKETS.dec()
+            if not conns:
+                del self._connections[conn.user_id]
+
+    def evict(self, conn: _Connection):
+        """Desconecta a un consumidor lento y cierra su socket en segundo plano."""
+        if conn.closed:
+            return
+        self.disconnect(conn)
+        asyncio.create_task(self._close_quietly(conn.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            # 1013 = "Try Again Later": el cliente puede reconectar
+            await asyncio.wait_for(websocket.close(code=1013), timeout=WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    def publish(self, user_id: int, message: Dict[str, Any]):
+        """Reparte un mensaje a todas las conexiones del usuario sin esperar a la red."""
+        for conn in list(self._connections.get(user_id, ())):
+            if not conn.offer(message):
+                print(f"WS saturado (user {user_id}). Expulsando conexión.")
+                self.evict(conn)
+
+    def count(self, user_id: Optional[int] = None) -> int:
+        if user_id is not None:
+            return len(self._connections.get(user_id, ()))
+        return sum(len(c) for c in self._connections.values())
+
+    def queued(self) -> int:
+        """Mensajes pendientes de envío en todas las conexiones (profundidad de cola)."""
+        return sum(len(conn.queue) for conns in self._connections.values() for conn in conns)
@@ -0,0 +1,391 @@
+# pymesec/core/inventory.py
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import ipaddress
+from typing import Callable, Dict, List, Optional, Set, Iterable
+
+import yaml
+from sqlalchemy import insert, update, delete, func
+
+from .db import SessionLocal, Target, InventorySource
+
+# Cada cuánto se revisa si cambió el YAML o la tabla de objetivos (segundos)
+INVENTORY_WATCH_S = float(os.getenv("INVENTORY_WATCH_S", "2"))
+
+# Parser en C si PyYAML se compiló con libyaml (varias veces más rápido)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+# ============================================================
+#                  IDENTIDAD DE UN OBJETIVO
+# ============================================================
+
+def target_key(target: dict) -> str:
+    """Identificador estable de un objetivo del inventario."""
+    host = target.get("host") or ""
+    return f"{host}|{target.get('web_url') or ''}"
+
+
+def target_network(target: dict) -> str:
+    """
+    Red a la que pertenece el objetivo (límites por red e índice del inventario).
+    Se puede fijar con `network` en el YAML; si no, /24 para IPs y dominio
+    registrado (dos últimas etiquetas) para nombres.
+    """
+    if target.get("network"):
+        return str(target["network"])
+    host = target.get("host") or ""
+    try:
+        ip = ipaddress.ip_address(host)
+        prefix = 24 if ip.version == 4 else 64
+        return str(ipaddress.ip_network(f"{host}/{prefix}", strict=False))
+    except ValueError:
+        return ".".join(host.lower().split(".")[-2:])
+
+
+def content_hash(target: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(target, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class InventoryChanges:
+    """Evento de cambio del inventario: qué objetivos se agregaron, cambiaron o quitaron."""
+
+    __slots__ = ("added", "modified", "removed")
+
+    def __init__(self, added=None, modified=None, removed=None):
+        self.added: List[dict] = added or []
+        self.modified: List[dict] = modified or []
+        self.removed: List[str] = removed or []
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed)
+
+    def __repr__(self):
+        return (f"InventoryChanges(+{len(self.added)} ~{len(self.modified)} "
+                f"-{len(self.removed)})")
+
+
+# ============================================================
+#                     INVENTARIO
+# ============================================================
+
+class TargetInventory:
+    """
+    Inventario de objetivos respaldado por la tabla `targets`, con importación
+    desde company.yaml, recarga en caliente (vigilancia del fichero y de la
+    tabla) e índices en memoria por host, tag y red.
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, dict] = {}
+        self._hashes: Dict[str, str] = {}
+        self._sources: Dict[str, str] = {}
+        self._ids: Dict[str, int] = {}
+        self.by_host: Dict[str, Set[str]] = {}
+        self.by_tag: Dict[str, Set[str]] = {}
+        self.by_network: Dict[str, Set[str]] = {}
+        self._listeners: List[Callable[[InventoryChanges], None]] = []
+        self._file_sig = None
+        self._db_sig = None
+        self._yaml_digest: Optional[str] = None
+
+    # ---------- consulta ----------
+
+    def targets(self) -> List[dict]:
+        return list(self._targets.values())
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._targets.get(key)
+
+    def find(self, host: str = None, tag: str = None, network: str = None) -> List[dict]:
+        """Objetivos que cumplen todos los filtros indicados (intersección de índices)."""
+        sets = []
+        if host is not None:
+            sets.append(self.by_host.get(host, set()))
+        if tag is not None:
+            sets.append(self.by_tag.get(tag, set()))
+        if network is not None:
+            sets.append(self.by_network.get(network, set()))
+        if not sets:
+            return self.targets()
+        keys = set.intersection(*sets)
+        return [self._targets[k] for k in keys]
+
+    def __len__(self):
+        return len(self._targets)
+
+    # ---------- eventos ----------
+
+    def subscribe(self, listener: Callable[[InventoryChanges], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, changes: InventoryChanges):
+        if not changes:
+            return
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                print(f"[Inventory] Error en suscriptor: {e}")
+
+    # ---------- índices ----------
+
+    def _index(self, key: str, target: dict):
+        self._targets[key] = target
+        self.by_host.setdefault(target.get("host"), set()).add(key)
+        self.by_network.setdefault(target_network(target), set()).add(key)
+        for tag in target.get("tags") or []:
+            self.by_tag.setdefault(str(tag), set()).add(key)
+
+    def _unindex(self, key: str):
+        target = self._targets.pop(key, None)
+        if target is None:
+            return
+        for index, values in (
+            (self.by_host, [target.get("host")]),
+            (self.by_network, [target_network(target)]),
+            (self.by_tag, [str(t) for t in target.get("tags") or []]),
+        ):
+            for value in values:
+                bucket = index.get(value)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del index[value]
+
+    # ---------- carga desde la BD ----------
+
+    def load_from_db(self, notify: bool = True) -> InventoryChanges:
+        """Sincroniza la memoria con la tabla `targets` (solo lee config de lo que cambió)."""
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Target.id, Target.target_key, Target.content_hash, Target.source
+            ).all()
+            current = {key: (rid, h, src) for rid, key, h, src in rows}
+            changed = [k for k, (_, h, _) in current.items() if self._hashes.get(k) != h]
+            configs = {}
+            for i in range(0, len(changed), 500):
+                chunk = changed[i:i + 500]
+                configs.update(
+                    db.query(Target.target_key, Target.config)
+                    .filter(Target.target_key.in_(chunk))
+                    .all()
+                )
+            self._db_sig = self._read_db_sig(db)
+            source = db.get(InventorySource, "yaml")
+            if source is not None:
+                self._yaml_digest = source.digest
+        finally:
+            db.close()
+
+        changes = InventoryChanges()
+        for key in changed:
+            target = configs.get(key) or {}
+            (changes.modified if key in self._targets else changes.added).append(target)
+            self._unindex(key)
+            self._index(key, target)
+        for key in set(self._targets) - set(current):
+            self._unindex(key)
+            self._hashes.pop(key, None)
+            changes.removed.append(key)
+        for key, (rid, h, src) in current.items():
+            self._ids[key] = rid
+            self._hashes[key] = h
+            self._sources[key] = src
+        for key in changes.removed:
+            self._ids.pop(key, None)
+            self._sources.pop(key, None)
+
+        if notify:
+            self._notify(changes)
+        return changes
+
+    @staticmethod
+    def _read_db_sig(db):
+        return db.query(func.count(Target.id), func.max(Target.updated_at)).one()
+
+    # ---------- importación del YAML ----------
+
+    def import_yaml(self, path: str, notify: bool = True) -> InventoryChanges:
+        """
+        Importa company.yaml: inserta/actualiza solo los objetivos cuyo contenido
+        cambió y borra los que desaparecieron del fichero (los dados de alta por
+        la API no se tocan). Si el contenido del fichero es idéntico al último
+        importado (huella guardada en la BD) ni siquiera se parsea.
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        self._file_sig = self._read_file_sig(path)
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest == self._yaml_digest:
+            return InventoryChanges()
+        data = yaml.load(raw, Loader=_YamlLoader) or {}
+
+        incoming: Dict[str, dict] = {}
+        for t in data.get("targets") or []:
+            if isinstance(t, dict) and t.get("host"):
+                incoming[target_key(t)] = t
+
+        changes = InventoryChanges()
+        now = time.time()
+        inserts, updates = [], []
+        for key, target in incoming.items():
+            h = content_hash(target)
+            if self._hashes.get(key) == h:
+                continue
+            row = {
+                "target_key": key,
+                "host": target["host"],
+                "network": target_network(target),
+                "tags": list(target.get("tags") or []),
+                "config": target,
+                "content_hash": h,
+                "source": "yaml",
+                "updated_at": now,
+            }
+            if key in self._ids:
+                updates.append({"id": self._ids[key], **row})
+                changes.modified.append(target)
+            else:
+                inserts.append(row)
+                changes.added.append(target)
+
+        removed = [
+            k for k, src in self._sources.items()
+            if src == "yaml" and k not in incoming
+        ]
+
+        self._write(inserts, updates, removed, digest)
+        self._yaml_digest = digest
+
+        for target in changes.added + changes.modified:
+            key = target_key(target)
+            self._unindex(key)
+            self._index(key, target)
+            self._hashes[key] = content_hash(target)
+            self._sources[key] = "yaml"
+        for key in removed:
+            self._unindex(key)
+            for d in (self._hashes, self._sources, self._ids):
+                d.pop(key, None)
+        changes.removed = removed
+
+        if notify:
+            self._notify(changes)
+        return changes
+
+    def _write(self, inserts: List[dict], updates: List[dict], removed: Iterable[str], digest: str):
+        db = SessionLocal()
+        try:
+            db.merge(InventorySource(source="yaml", digest=digest, imported_at=time.time()))
+            if inserts:
+                ids = db.execute(
+                    insert(Target).returning(Target.id, Target.target_key),
+                    inserts,
+                ).all()
+                for rid, key in ids:
+                    self._ids[key] = rid
+            if updates:
+                db.execute(update(Target), updates)
+            removed = list(removed)
+            for i in range(0, len(removed), 500):
+                db.execute(delete(Target).where(Target.target_key.in_(removed[i:i + 500])))
+            # No tocamos _db_sig: el vigilante verá el cambio y load_from_db solo
+            # releerá lo que no escribimos nosotros (p. ej. altas desde la API)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_file_sig(path: str):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    # ---------- recarga en caliente ----------
+
+    async def watch(self, path: Optional[str], interval: float = INVENTORY_WATCH_S):
+        """
+        Vigila el YAML (mtime/tamaño) y la tabla `targets` (altas desde la API u
+        otros nodos). Ante cambios recarga solo lo necesario y emite el evento.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if path and self._read_file_sig(path) != self._file_sig:
+                    changes = await asyncio.to_thread(self.import_yaml, path, False)
+                    print(f"[Inventory] company.yaml recargado: {changes}")
+                    self._notify(changes)
+                    continue
+                db_sig = await asyncio.to_thread(self._current_db_sig)
+                if db_sig != self._db_sig:
+                    changes = await asyncio.to_thread(self.load_from_db, False)
+                    self._notify(changes)
+            except Exception as e:
+                print(f"[Inventory] Error recargando inventario: {e}")
+
+    def _current_db_sig(self):
+        db = SessionLocal()
+        try:
+            return self._read_db_sig(db)
+        finally:
+            db.close()
+
+
+def upsert_api_target(target: dict) -> bool:
+    """
+    Alta/actualización puntual de un objetivo desde la API (source="api").
+    Si el host ya está en el inventario desde el YAML, esa fila manda y no se
+    toca: devuelve False.
+    """
+    key = target_key(target)
+    row = {
+        "host": target["host"],
+        "network": target_network(target),
+        "tags": list(target.get("tags") or []),
+        "config": target,
+        "content_hash": content_hash(target),
+        "source": "api",
+        "updated_at": time.time(),
+    }
+    db = SessionLocal()
+    try:
+        existing = db.query(Target).filter(Target.target_key == key).first()
+        if existing is None:
+            db.add(Target(target_key=key, **row))
+        elif existing.source != "api":
+            return False
+        elif existing.content_hash != row["content_hash"]:
+            for k, v in row.items():
+                setattr(existing, k, v)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def remove_api_target(host: str) -> bool:
+    """Baja de un objetivo dado de alta desde la API (los del YAML no se tocan)."""
+    db = SessionLocal()
+    try:
+        deleted = (
+            db.query(Target)
+            .filter(Target.target_key == target_key({"host": host}), Target.source == "api")
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+        return bool(deleted)
+    finally:
+        db.close()
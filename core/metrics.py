@@ -0,0 +1,279 @@
+# pymesec/core/metrics.py
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+from .trace import span, record_io
+
+# prometheus_client es opcional: sin él las métricas son no-ops y /metrics responde 503
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        REGISTRY,
+        generate_latest,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Con varios workers de uvicorn, prometheus_client agrega los procesos vía este directorio
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Buckets (segundos) pensados para cada tipo de operación
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+PROBE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SLOW_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+
+
+class _NoopMetric:
+    """Sustituto cuando prometheus_client no está instalado."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _histogram(name, doc, labels, buckets):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return Histogram(name, doc, labels, buckets=buckets)
+
+
+def _counter(name, doc, labels):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return Counter(name, doc, labels)
+
+
+def _gauge(name, doc, labels=()):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    # livesum: en modo multiproceso se suman los procesos vivos
+    return Gauge(name, doc, labels, multiprocess_mode="livesum")
+
+
+# ============================================================
+#                        MÉTRICAS
+# ============================================================
+
+SCANNER_DURATION = _histogram(
+    "pymesec_scanner_duration_seconds",
+    "Duración de cada escáner/etapa de un escaneo",
+    ["scanner", "outcome"],
+    SLOW_BUCKETS,
+)
+SCANS_TOTAL = _counter(
+    "pymesec_scans_total",
+    "Escaneos terminados por origen y resultado",
+    ["source", "outcome"],
+)
+SUBPROCESS_WAIT = _histogram(
+    "pymesec_subprocess_wait_seconds",
+    "Tiempo hasta que la herramienta externa arranca (fork/exec)",
+    ["tool"],
+    FAST_BUCKETS,
+)
+SUBPROCESS_RUN = _histogram(
+    "pymesec_subprocess_run_seconds",
+    "Tiempo de ejecución de la herramienta externa",
+    ["tool", "outcome"],
+    SLOW_BUCKETS,
+)
+HTTP_PROBE_LATENCY = _histogram(
+    "pymesec_http_probe_seconds",
+    "Latencia de las sondas HTTP de los escáneres nativos",
+    ["scanner", "outcome"],
+    PROBE_BUCKETS,
+)
+DB_QUERY_LATENCY = _histogram(
+    "pymesec_db_query_seconds",
+    "Latencia de las sentencias SQL",
+    ["operation", "outcome"],
+    FAST_BUCKETS,
+)
+AI_CALL_LATENCY = _histogram(
+    "pymesec_ai_call_seconds",
+    "Latencia de las llamadas al modelo de IA",
+    ["operation", "outcome"],
+    SLOW_BUCKETS,
+)
+PASSWORD_HASH_LATENCY = _histogram(
+    "pymesec_password_hash_seconds",
+    "Duración del hashing/verificación de contraseñas (incluida la espera en cola)",
+    ["operation", "outcome"],
+    PROBE_BUCKETS,
+)
+QUEUE_DEPTH = _gauge(
+    "pymesec_queue_depth",
+    "Elementos pendientes en las colas internas",
+    ["queue"],
+)
+ACTIVE_WEBSOCKETS = _gauge(
+    "pymesec_active_websockets",
+    "Conexiones WebSocket de estado abiertas",
+)
+
+
+# ============================================================
+#                       AYUDANTES
+# ============================================================
+
+def outcome_of(exc: BaseException) -> str:
+    """Etiqueta `outcome` para una excepción (sin disparar la cardinalidad)."""
+    name = type(exc).__name__
+    if "Timeout" in name:
+        return "timeout"
+    if name in ("ConnectError", "ClientConnectorError", "ConnectionRefusedError", "OSError"):
+        return "connect_error"
+    return "error"
+
+
+class _Probe:
+    __slots__ = ("nbytes",)
+
+    def __init__(self):
+        self.nbytes = 0
+
+
+@contextmanager
+def probe_timer(scanner: str):
+    """
+    Mide una sonda HTTP y la suma (petición y bytes) a la traza del escaneo:
+        with probe_timer("sqli") as probe:
+            resp = await client.get(...)
+            probe.nbytes = len(resp.content)
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    probe = _Probe()
+    try:
+        yield probe
+    except BaseException as e:
+        outcome = outcome_of(e)
+        raise
+    finally:
+        HTTP_PROBE_LATENCY.labels(scanner, outcome).observe(time.perf_counter() - start)
+        record_io(1, probe.nbytes)
+
+
+@contextmanager
+def ai_timer(operation: str):
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = outcome_of(e)
+        raise
+    finally:
+        AI_CALL_LATENCY.labels(operation, outcome).observe(time.perf_counter() - start)
+
+
+async def observe_scanner(scanner: str, awaitable):
+    """Espera un escáner registrando su duración; un dict con "error" cuenta como fallo."""
+    start = time.perf_counter()
+    outcome = "error"
+    with span(scanner, "scanner") as current:
+        try:
+            result = await awaitable
+            outcome = "error" if isinstance(result, dict) and result.get("error") else "ok"
+            return result
+        except BaseException as e:
+            outcome = outcome_of(e)
+            raise
+        finally:
+            SCANNER_DURATION.labels(scanner, outcome).observe(time.perf_counter() - start)
+            if current is not None:
+                current.args["outcome"] = outcome
+
+
+def _sql_operation(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    verb = head[0].upper() if head else ""
+    return verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def instrument_engine(engine):
+    """Registra la latencia de cada sentencia del engine de SQLAlchemy."""
+    if not PROMETHEUS_AVAILABLE:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_metrics_start")
+        if stack:
+            DB_QUERY_LATENCY.labels(_sql_operation(statement), "ok").observe(
+                time.perf_counter() - stack.pop()
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        stack = ctx.connection.info.get("_metrics_start") if ctx.connection is not None else None
+        if stack:
+            DB_QUERY_LATENCY.labels(_sql_operation(ctx.statement or ""), "error").observe(
+                time.perf_counter() - stack.pop()
+            )
+
+
+# Profundidades de cola que se leen en el momento del scrape (hub, write-behind...)
+_queue_probes: List[Tuple[str, Callable[[], int]]] = []
+
+
+def register_queue(name: str, probe: Callable[[], int]):
+    if not PROMETHEUS_AVAILABLE:
+        return
+    if PROMETHEUS_MULTIPROC_DIR:
+        # En multiproceso set_function no se comparte: se refresca al servir /metrics
+        _queue_probes.append((name, probe))
+    else:
+        QUEUE_DEPTH.labels(name).set_function(probe)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Cuerpo y content-type de la exposición en formato texto de Prometheus."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client no instalado\n", CONTENT_TYPE_LATEST
+    for name, probe in _queue_probes:
+        try:
+            QUEUE_DEPTH.labels(name).set(probe())
+        except Exception:
+            pass
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    """Servidor HTTP propio para procesos sin API (p. ej. el scheduler en job/)."""
+    if not PROMETHEUS_AVAILABLE or not port:
+        return
+    from prometheus_client import start_http_server
+    start_http_server(port)
+    print(f"[Metrics] Exponiendo métricas en :{port}/metrics")
@@ -0,0 +1,149 @@
+# pymesec/core/passwords.py
+
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .metrics import PASSWORD_HASH_LATENCY
+
+# Coste de bcrypt para hashes nuevos; los guardados con menos se rehacen al hacer login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Procesos dedicados a hashear (0 = hilo del threadpool, sin procesos aparte).
+# Cada worker de la API tiene su pool: por defecto se reparten los núcleos
+# entre los WEB_CONCURRENCY workers en lugar de lanzar núcleos × workers procesos
+_API_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1") or 1))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // _API_WORKERS))))
+# Operaciones admitidas a la vez (en curso + en cola); el resto recibe 503
+AUTH_HASH_QUEUE = int(os.getenv("AUTH_HASH_QUEUE", str(max(4, AUTH_HASH_WORKERS * 8))))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+
+class HashPoolBusy(Exception):
+    """La cola de hashing está llena: mejor rechazar que acumular latencia."""
+
+
+# ============================================================
+#        FUNCIONES DEL PROCESO HIJO (picklables)
+# ============================================================
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    # (válida, hash nuevo si los parámetros guardados están desfasados)
+    try:
+        return pwd_context.verify_and_update(password, hashed)
+    except (ValueError, TypeError):
+        # Hash vacío o con formato desconocido
+        return False, None
+
+
+# ============================================================
+#                  POOL CON COLA ACOTADA
+# ============================================================
+
+class PasswordHasher:
+    """
+    bcrypt fuera del event loop y fuera del threadpool de FastAPI: un pool de
+    procesos propio (escala con los núcleos, sin GIL compartido) y un
+    semáforo que acota cuántas operaciones esperan. Una ráfaga de logins ya
+    no deja sin hilos al resto de rutas.
+    """
+
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_HASH_QUEUE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight = 0
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn: los hijos no heredan hilos ni conexiones del worker de la API
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def _run(self, operation: str, func, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            PASSWORD_HASH_LATENCY.labels(operation, "rejected").observe(0)
+            raise HashPoolBusy(operation)
+
+        start = time.perf_counter()
+        outcome = "error"
+        async with self._slots:
+            self._inflight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                pool = self._executor()
+                try:
+                    result = await loop.run_in_executor(pool, func, *args)
+                except BrokenProcessPool:
+                    # Un hijo murió (OOM, kill): rehacemos el pool y reintentamos una
+                    # vez. El roto se cierra (sus procesos restantes no quedan vivos);
+                    # si otra petición ya lo sustituyó, se usa el nuevo
+                    if self._pool is pool:
+                        self._pool = None
+                        pool.shutdown(wait=False, cancel_futures=True)
+                    result = await loop.run_in_executor(self._executor(), func, *args)
+                outcome = "ok"
+                return result
+            finally:
+                self._inflight -= 1
+                PASSWORD_HASH_LATENCY.labels(operation, outcome).observe(time.perf_counter() - start)
+
+    # ---------- API pública ----------
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Devuelve (válida, hash_nuevo). hash_nuevo no es None si hay que guardarlo (rehash)."""
+        if not hashed:
+            return False, None
+        return await self._run("verify", _verify_and_update, password, hashed)
+
+    def pending(self) -> int:
+        return self._inflight
+
+    def warm_up(self):
+        """Arranca los procesos ya (evita pagar el spawn en el primer login)."""
+        pool = self._executor()
+        if pool is not None:
+            for _ in range(self.workers):
+                pool.submit(int)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+_hasher: Optional[PasswordHasher] = None
+
+
+def get_hasher() -> PasswordHasher:
+    """Pool de hashing del proceso (se crea al primer uso)."""
+    global _hasher
+    if _hasher is None:
+        _hasher = PasswordHasher()
+    return _hasher
@@ -0,0 +1,268 @@
+# pymesec/core/pipeline.py
+
+import json
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from .metrics import SCANNER_DURATION
+from .trace import span
+from .deadline import clamp, remaining, set_deadline
+from .findings import Finding, dump_findings, load_findings, normalize_findings
+
+# Dentro de una etapa, el límite que ven sondas y herramientas (core/deadline.py)
+# es el de la etapa menos este margen: sus timeouts vencen antes que el de la
+# etapa y esta devuelve lo que ya tenga en lugar de cancelarse entera
+STAGE_GRACE_S = float(os.getenv("STAGE_GRACE_S", "5"))
+
+
+class AbortScan(Exception):
+    """Una etapa decide que no tiene sentido seguir (p. ej. host inaccesible)."""
+
+    def __init__(self, error: str, summary: str):
+        super().__init__(summary)
+        self.error = error
+        self.summary = summary
+
+
+class ScanContext:
+    """
+    Estado compartido de un escaneo mientras corre el DAG de etapas.
+    Cada etapa lee las salidas de sus dependencias en `outputs` y deja sus
+    hallazgos en `findings_by_stage` (se concatenan en orden de declaración).
+    Los hallazgos se normalizan a Finding al entrar: lo que cada escáner
+    devuelva (dicts con severidades libres) se convierte una sola vez aquí.
+    """
+
+    def __init__(self, user_id: Optional[int], scan_id: Optional[int], target: str, host: str, url: str):
+        self.user_id = user_id
+        self.scan_id = scan_id
+        self.target = target
+        self.host = host
+        self.url = url
+        self.outputs: Dict[str, Any] = {}
+        self.status: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+        self.findings_by_stage: Dict[str, List[Finding]] = {}
+
+    def add_findings(self, stage: str, findings: List[Any]):
+        self.findings_by_stage.setdefault(stage, []).extend(normalize_findings(findings))
+
+    def findings(self, order: Sequence[str]) -> List[Finding]:
+        result = []
+        for name in order:
+            result.extend(self.findings_by_stage.get(name, []))
+        return result
+
+    # ---------- checkpoints ----------
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Etapas terminadas (estado, salida, error y hallazgos) en forma JSON."""
+        stages = {
+            name: {
+                "status": status,
+                "output": self.outputs.get(name),
+                "error": self.errors.get(name),
+                "findings": dump_findings(self.findings_by_stage.get(name, [])),
+            }
+            for name, status in self.status.items()
+            if status != "aborted"
+        }
+        # Ida y vuelta por JSON: lo no serializable se guarda como texto
+        return json.loads(json.dumps({"v": 1, "stages": stages}, default=str))
+
+    def restore(self, checkpoint: Optional[Dict[str, Any]]) -> List[str]:
+        """Recupera las etapas de un snapshot; run_dag no las vuelve a ejecutar."""
+        restored = []
+        for name, saved in ((checkpoint or {}).get("stages") or {}).items():
+            self.status[name] = saved.get("status") or "ok"
+            self.outputs[name] = saved.get("output")
+            if saved.get("error"):
+                self.errors[name] = saved["error"]
+            if saved.get("findings"):
+                self.findings_by_stage[name] = load_findings(saved["findings"])
+            restored.append(name)
+        return restored
+
+
+StageFunc = Callable[[ScanContext], Awaitable[Any]]
+
+
+class Stage:
+    """
+    Etapa declarativa del escaneo.
+
+    - deps: etapas cuya salida necesita (arranca en cuanto todas terminan).
+    - when: predicado sobre el contexto; si devuelve False la etapa se omite.
+    - timeout: tiempo máximo propio; si vence, la etapa falla sola.
+
+    Las dependencias son "blandas": si una falla, las dependientes igualmente
+    se ejecutan y ven `None` en su salida (aislamiento de fallos).
+    """
+
+    __slots__ = ("name", "func", "deps", "timeout", "when", "label")
+
+    def __init__(
+        self,
+        name: str,
+        func: StageFunc,
+        deps: Sequence[str] = (),
+        timeout: Optional[float] = None,
+        when: Optional[Callable[[ScanContext], bool]] = None,
+        label: Optional[str] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.when = when
+        self.label = label
+
+
+def _validate(stages: Sequence[Stage]):
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in names]
+        if missing:
+            raise ValueError(f"La etapa '{s.name}' depende de etapas inexistentes: {missing}")
+    # Detección de ciclos (Kahn)
+    indegree = {s.name: len(s.deps) for s in stages}
+    children: Dict[str, List[str]] = {s.name: [] for s in stages}
+    for s in stages:
+        for d in s.deps:
+            children[d].append(s.name)
+    queue = [n for n, deg in indegree.items() if deg == 0]
+    seen = 0
+    while queue:
+        n = queue.pop()
+        seen += 1
+        for c in children[n]:
+            indegree[c] -= 1
+            if indegree[c] == 0:
+                queue.append(c)
+    if seen != len(stages):
+        raise ValueError("El DAG de etapas tiene un ciclo")
+
+
+def stage_budgets(stages: Sequence[Stage], budget: Optional[float]) -> Dict[str, Optional[float]]:
+    """
+    Reparte el presupuesto total entre las etapas: si el camino más largo del
+    grafo (sumando timeouts) no cabe en `budget`, todos los timeouts se
+    escalan en la misma proporción. Sin presupuesto se usan tal cual.
+    """
+    timeouts = {s.name: s.timeout for s in stages}
+    if not budget:
+        return timeouts
+    by_name = {s.name: s for s in stages}
+    longest: Dict[str, float] = {}
+
+    def path(name: str) -> float:
+        if name not in longest:
+            stage = by_name[name]
+            longest[name] = (stage.timeout or 0) + max((path(d) for d in stage.deps), default=0.0)
+        return longest[name]
+
+    critical = max((path(s.name) for s in stages), default=0.0)
+    if critical <= budget:
+        return timeouts
+    factor = budget / critical
+    return {name: (t * factor if t else budget) for name, t in timeouts.items()}
+
+
+async def _run_stage(stage: Stage, ctx: ScanContext, timeout: Optional[float] = None):
+    started = time.perf_counter()
+    # Nunca más de lo que queda del presupuesto del escaneo
+    timeout = clamp(timeout)
+    with span(stage.name, "stage") as current:
+        try:
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError
+            if timeout:
+                # Solo afecta a esta tarea (y a las que cree): cada etapa corre en la suya
+                set_deadline(timeout - min(STAGE_GRACE_S, timeout / 10))
+                ctx.outputs[stage.name] = await asyncio.wait_for(stage.func(ctx), timeout=timeout)
+            else:
+                ctx.outputs[stage.name] = await stage.func(ctx)
+            ctx.status[stage.name] = "ok"
+        except AbortScan:
+            ctx.status[stage.name] = "aborted"
+            raise
+        except asyncio.TimeoutError:
+            ctx.outputs[stage.name] = None
+            ctx.status[stage.name] = "timeout"
+            ctx.errors[stage.name] = f"Tiempo agotado ({timeout or 0:.0f}s)"
+        except Exception as e:
+            print(f"[Pipeline] Etapa '{stage.name}' falló: {e}")
+            ctx.outputs[stage.name] = None
+            ctx.status[stage.name] = "error"
+            ctx.errors[stage.name] = str(e)
+        finally:
+            SCANNER_DURATION.labels(stage.name, ctx.status.get(stage.name, "cancelled")).observe(
+                time.perf_counter() - started
+            )
+            if current is not None:
+                current.args["outcome"] = ctx.status.get(stage.name, "cancelled")
+
+
+async def run_dag(
+    stages: Sequence[Stage],
+    ctx: ScanContext,
+    on_start: Optional[Callable[[Stage], None]] = None,
+    budget: Optional[float] = None,
+    on_done: Optional[Callable[[Stage], None]] = None,
+) -> ScanContext:
+    """
+    Ejecuta las etapas con la máxima concurrencia que permiten sus dependencias:
+    cada etapa arranca en cuanto terminan las suyas, así el tiempo total tiende
+    al camino más largo del grafo y no a la suma de etapas.
+
+    `budget` (segundos) limita el DAG completo: se reparte entre las etapas
+    (stage_budgets) y cada una se recorta además a lo que quede del límite
+    del escaneo (core/deadline.py). Cancelar la tarea que llama a run_dag
+    cancela todas las etapas en curso.
+
+    Las etapas que ya tienen estado en `ctx` (restauradas de un checkpoint)
+    no se ejecutan; `on_done` se llama al terminar cada etapa.
+    """
+    _validate(stages)
+    if budget is None:
+        budget = remaining()
+    timeouts = stage_budgets(stages, budget)
+    pending: Dict[str, Stage] = {s.name: s for s in stages if s.name not in ctx.status}
+    running: Dict[asyncio.Task, Stage] = {}
+
+    def launch_ready():
+        progressed = True
+        while progressed:
+            progressed = False
+            for name, stage in list(pending.items()):
+                if not all(d in ctx.status for d in stage.deps):
+                    continue
+                del pending[name]
+                progressed = True
+                if stage.when is not None and not stage.when(ctx):
+                    ctx.outputs[name] = None
+                    ctx.status[name] = "skipped"
+                    continue
+                if on_start is not None:
+                    # Aviso síncrono: no debe retrasar el arranque de la etapa
+                    on_start(stage)
+                running[asyncio.create_task(_run_stage(stage, ctx, timeouts[name]))] = stage
+
+    try:
+        launch_ready()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stage = running.pop(task)
+                task.result()  # propaga AbortScan / CancelledError
+                if on_done is not None:
+                    on_done(stage)
+            launch_ready()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return ctx
@@ -0,0 +1,42 @@
+# pymesec/core/progress.py
+
+import os
+from typing import List, Dict, Any, Tuple
+
+from .db import SessionLocal, ScanEvent
+
+# Máximo de eventos que se reenvían a un WebSocket que reconecta
+WS_REPLAY_LIMIT = int(os.getenv("WS_REPLAY_LIMIT", "1000"))
+
+
+def event_to_message(ev: ScanEvent) -> Dict[str, Any]:
+    """Formato de mensaje que recibe el WebSocket (igual en vivo y en replay)."""
+    return {
+        "status": ev.status,
+        "message": ev.message,
+        "scanId": ev.scan_id,
+        "seq": ev.seq,
+    }
+
+
+def events_since(user_id: int, since: int, limit: int = WS_REPLAY_LIMIT) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Eventos del usuario con seq > since, en orden (solo los deltas perdidos),
+    y si se recortaron. `seq` es global (compartido por todos los usuarios):
+    los huecos son normales y no indican pérdida. Si faltan más de `limit`
+    se devuelven los más recientes con truncated=True, y el cliente debe
+    recargar los escaneos completos.
+    """
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ScanEvent)
+            .filter(ScanEvent.user_id == user_id, ScanEvent.seq > since)
+            .order_by(ScanEvent.seq.desc())
+            .limit(limit + 1)
+            .all()
+        )
+        truncated = len(rows) > limit
+        return [event_to_message(ev) for ev in reversed(rows[:limit])], truncated
+    finally:
+        db.close()
@@ -0,0 +1,171 @@
+# pymesec/core/recovery.py
+
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import update, or_
+
+from .db import SessionLocal, ScanResult
+
+# Cada cuánto renueva un worker el latido de sus escaneos (y busca huérfanos)
+SCAN_HEARTBEAT_S = float(os.getenv("SCAN_HEARTBEAT_S", "30"))
+# Sin latido durante este tiempo, el escaneo se considera interrumpido
+SCAN_STALE_S = float(os.getenv("SCAN_STALE_S", "120"))
+# Más antiguos que esto (o reanudados ya N veces) no se reanudan: se marcan Error
+SCAN_RECOVERY_MAX_AGE_S = float(os.getenv("SCAN_RECOVERY_MAX_AGE_S", "86400"))
+SCAN_RECOVERY_MAX_ATTEMPTS = int(os.getenv("SCAN_RECOVERY_MAX_ATTEMPTS", "3"))
+# Escaneos reclamados como máximo en cada barrido
+SCAN_RECOVERY_BATCH = int(os.getenv("SCAN_RECOVERY_BATCH", "20"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+UNFINISHED = ("Pending", "Running")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def heartbeat(scan_ids: Iterable[int]) -> int:
+    """Renueva el latido de los escaneos que corren en este worker."""
+    ids = list(scan_ids)
+    if not ids:
+        return 0
+    db = SessionLocal()
+    try:
+        res = db.execute(
+            update(ScanResult)
+            .where(ScanResult.id.in_(ids), ScanResult.status.in_(UNFINISHED))
+            .values(heartbeat_at=_now(), worker_id=WORKER_ID)
+        )
+        db.commit()
+        return res.rowcount
+    finally:
+        db.close()
+
+
+def release(scan_ids: Iterable[int]) -> None:
+    """
+    Apagado ordenado: borra el latido de nuestros escaneos para que el
+    siguiente worker los reanude en su primer barrido, sin esperar a SCAN_STALE_S.
+    """
+    ids = list(scan_ids)
+    if not ids:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(ScanResult)
+            .where(ScanResult.id.in_(ids), ScanResult.worker_id == WORKER_ID)
+            .values(heartbeat_at=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def cancel_orphaned(scan_id: int) -> bool:
+    """
+    Cancela en la base de datos un escaneo sin worker vivo (latido caducado o
+    liberado en un apagado). El mismo UPDATE condicionado que usa
+    claim_interrupted garantiza que, si compiten, solo gane uno: o queda
+    Cancelled y ya no se reanuda, o lo reclamó un worker y la cancelación le
+    llega por el bus. Devuelve True si lo canceló aquí.
+    """
+    now = _now()
+    is_stale = or_(
+        ScanResult.heartbeat_at.is_(None),
+        ScanResult.heartbeat_at < now - timedelta(seconds=SCAN_STALE_S),
+    )
+    db = SessionLocal()
+    try:
+        res = db.execute(
+            update(ScanResult)
+            .where(ScanResult.id == scan_id, ScanResult.status.in_(UNFINISHED), is_stale)
+            .values(
+                status="Cancelled",
+                results={"error": "Cancelled", "summary": "Escaneo cancelado por el usuario."},
+            )
+        )
+        db.commit()
+        return res.rowcount == 1
+    finally:
+        db.close()
+
+
+def claim_interrupted(limit: int = SCAN_RECOVERY_BATCH) -> List[Dict[str, Any]]:
+    """
+    Reclama escaneos sin terminar cuyo worker desapareció. El UPDATE
+    condicionado al latido caducado hace que, con varios workers barriendo a
+    la vez, cada escaneo lo reanude uno solo. Devuelve lo necesario para
+    relanzarlo: id, user_id, objetivo, scan_key y checkpoint.
+    """
+    now = _now()
+    stale = now - timedelta(seconds=SCAN_STALE_S)
+    oldest = now - timedelta(seconds=SCAN_RECOVERY_MAX_AGE_S)
+    is_stale = or_(ScanResult.heartbeat_at.is_(None), ScanResult.heartbeat_at < stale)
+
+    claimed: List[Dict[str, Any]] = []
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                ScanResult.id,
+                ScanResult.user_id,
+                ScanResult.host,
+                ScanResult.scan_key,
+                ScanResult.scan_time,
+                ScanResult.checkpoint,
+            )
+            .filter(ScanResult.status.in_(UNFINISHED), is_stale)
+            .order_by(ScanResult.id)
+            .limit(limit)
+            .all()
+        )
+        for row in rows:
+            checkpoint = dict(row.checkpoint or {})
+            attempts = int(checkpoint.get("attempts") or 0) + 1
+            scan_time = row.scan_time
+            if scan_time is not None and scan_time.tzinfo is None:
+                scan_time = scan_time.replace(tzinfo=timezone.utc)
+            give_up = (
+                not row.host
+                or attempts > SCAN_RECOVERY_MAX_ATTEMPTS
+                or (scan_time is not None and scan_time < oldest)
+            )
+
+            checkpoint["attempts"] = attempts
+            values: Dict[str, Any] = {"heartbeat_at": now, "worker_id": WORKER_ID, "checkpoint": checkpoint}
+            if give_up:
+                values.update(
+                    status="Error",
+                    results={
+                        "error": "Interrupted",
+                        "summary": "El escaneo se interrumpió y no pudo reanudarse.",
+                    },
+                )
+            res = db.execute(
+                update(ScanResult)
+                .where(ScanResult.id == row.id, ScanResult.status.in_(UNFINISHED), is_stale)
+                .values(**values)
+            )
+            db.commit()
+            if res.rowcount != 1 or give_up:
+                # Otro worker se adelantó, o lo damos por perdido
+                continue
+            claimed.append({
+                "id": row.id,
+                "user_id": row.user_id,
+                "target": row.host,
+                "scan_key": row.scan_key,
+                "checkpoint": checkpoint,
+            })
+    finally:
+        db.close()
+
+    # Primero los que tienen etapas guardadas: si otro idéntico se une a su
+    # ejecución, se aprovecha el trabajo ya hecho
+    claimed.sort(key=lambda c: not (c["checkpoint"].get("stages")))
+    return claimed
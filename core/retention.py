@@ -0,0 +1,620 @@
+# pymesec/core/retention.py
+
+import os
+import re
+import gzip
+import json
+import argparse
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Date, cast, delete, func, inspect, null, select, text, update
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.schema import CreateTable
+
+from .db import engine, SessionLocal, Base, User, ScanResult, ScanEvent, RiskRollup
+from .recovery import UNFINISHED
+from .rollups import update_rollups
+from .blobs import get_blob_store
+
+# "auto": en Postgres, scan_results se crea particionada por mes (scan_time);
+# "off": tabla normal. Las tablas ya desplegadas se migran con
+# `python -m core.retention --migrate-partitions`
+SCAN_PARTITIONING = os.getenv("SCAN_PARTITIONING", "auto").lower()
+# Particiones mensuales creadas por adelantado
+SCAN_PARTITIONS_AHEAD = int(os.getenv("SCAN_PARTITIONS_AHEAD", "2"))
+
+# Escaneos completos (traza incluida) durante este tiempo
+SCAN_RETENTION_RAW_DAYS = int(os.getenv("SCAN_RETENTION_RAW_DAYS", "30"))
+# Después, los del scheduler se reducen al último escaneo de cada host y día
+# y, pasado este plazo, se borran: la evolución queda en risk_rollups
+# (0 = no reducir)
+SCAN_RETENTION_DAILY_DAYS = int(os.getenv("SCAN_RETENTION_DAILY_DAYS", "180"))
+# Cualquier escaneo más antiguo se borra (0 = conservar siempre)
+SCAN_RETENTION_DAYS = int(os.getenv("SCAN_RETENTION_DAYS", "365"))
+# Log de progreso de los WebSockets (solo sirve para reconexiones recientes)
+SCAN_EVENTS_RETENTION_DAYS = int(os.getenv("SCAN_EVENTS_RETENTION_DAYS", "7"))
+
+# Si se define, las filas borradas se archivan antes en
+# <dir>/scan_results_AAAAMM.jsonl.gz (un JSON por línea)
+SCAN_ARCHIVE_DIR = os.getenv("SCAN_ARCHIVE_DIR", "")
+
+# Cada cuánto corre la compactación en la API (0 = desactivada)
+RETENTION_INTERVAL_S = float(os.getenv("RETENTION_INTERVAL_S", "3600"))
+# Filas por lote: transacciones cortas, sin bloquear a los escritores
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "500"))
+# Espera máxima por el lock de scan_results en el DDL de particiones
+RETENTION_LOCK_TIMEOUT_MS = int(os.getenv("RETENTION_LOCK_TIMEOUT_MS", "5000"))
+
+# Clave del advisory lock de Postgres: una sola compactación entre todos los workers
+_LOCK_KEY = 0x70796D65
+_local_lock = threading.Lock()
+
+_PARTITION_RE = re.compile(r"^scan_results_p(\d{4})(\d{2})$")
+DEFAULT_PARTITION = "scan_results_default"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _is_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def _utc(ts: Optional[datetime]) -> Optional[datetime]:
+    # SQLite devuelve fechas naive (en UTC)
+    if ts is not None and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def _utc_day(column):
+    """
+    Día UTC de una columna de fecha en SQL, el mismo que usan risk_rollups y
+    _ensure_rollup. En Postgres date() seguiría la zona horaria de la sesión.
+    """
+    if _is_postgres():
+        return cast(func.timezone("UTC", column), Date)
+    # SQLite guarda las fechas en UTC
+    return func.date(column)
+
+
+# ============================================================
+#                PARTICIONES MENSUALES (POSTGRES)
+# ============================================================
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, n: int) -> date:
+    month = d.month - 1 + n
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"scan_results_p{month.year:04d}{month.month:02d}"
+
+
+def is_partitioned(conn) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'scan_results' AND pg_table_is_visible(c.oid)"
+    )).first())
+
+
+def list_partitions(conn) -> Dict[str, date]:
+    """Particiones mensuales existentes: nombre -> primer día del mes."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'scan_results' AND pg_table_is_visible(p.oid)"
+    )).scalars()
+    parts = {}
+    for name in rows:
+        m = _PARTITION_RE.match(name)
+        if m:
+            parts[name] = date(int(m.group(1)), int(m.group(2)), 1)
+    return parts
+
+
+def _create_partitioned(conn) -> None:
+    """
+    scan_results particionada por RANGE(scan_time). Postgres exige que la
+    clave de partición forme parte de la PK: (id, scan_time). El ORM sigue
+    usando solo id (lo genera la secuencia, es único igualmente).
+    """
+    ddl = str(CreateTable(ScanResult.__table__).compile(dialect=engine.dialect)).strip()
+    ddl = ddl.replace("PRIMARY KEY (id)", "PRIMARY KEY (id, scan_time)")
+    conn.execute(text(f"{ddl} PARTITION BY RANGE (scan_time)"))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF scan_results DEFAULT"))
+    for idx in ScanResult.__table__.indexes:
+        idx.create(bind=conn)
+
+
+def ensure_partitions(conn, since: Optional[date] = None) -> int:
+    """Crea las particiones que falten desde `since` (o el mes actual) hasta SCAN_PARTITIONS_AHEAD meses."""
+    existing = set(list_partitions(conn))
+    month = _month_start(since or _now().date())
+    last = _add_months(_month_start(_now().date()), SCAN_PARTITIONS_AHEAD)
+    created = 0
+    while month <= last:
+        name = _partition_name(month)
+        if name not in existing:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF scan_results "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+                f"TO ('{_add_months(month, 1).isoformat()} 00:00:00+00')"
+            ))
+            created += 1
+        month = _add_months(month, 1)
+    return created
+
+
+def ensure_partitioned_table() -> bool:
+    """
+    init_db en Postgres: crea scan_results ya particionada si todavía no
+    existe. Una tabla existente no se toca (ver migrate_to_partitions).
+    """
+    if not _is_postgres() or SCAN_PARTITIONING != "auto":
+        return False
+    if inspect(engine).has_table(ScanResult.__tablename__):
+        return False
+    # La FK de user_id necesita users
+    Base.metadata.create_all(bind=engine, tables=[User.__table__])
+    try:
+        with engine.begin() as conn:
+            _create_partitioned(conn)
+            ensure_partitions(conn)
+    except DBAPIError as e:
+        # Otro worker la creó a la vez
+        print(f"[Retention] No se pudo crear scan_results particionada: {e}")
+        return False
+    print("[Retention] scan_results creada con particiones mensuales")
+    return True
+
+
+def migrate_to_partitions() -> None:
+    """
+    Convierte una scan_results existente en particionada: renombra la
+    antigua, crea la nueva, copia las filas y borra la antigua, todo en
+    una transacción. Bloquea la tabla mientras copia: hacerlo en una
+    ventana de mantenimiento.
+    """
+    if not _is_postgres():
+        print("[Retention] El particionado solo está disponible en Postgres")
+        return
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            print("[Retention] scan_results ya está particionada")
+            return
+        conn.execute(text("LOCK TABLE scan_results IN ACCESS EXCLUSIVE MODE"))
+        seq = conn.execute(text("SELECT pg_get_serial_sequence('scan_results', 'id')")).scalar()
+        conn.execute(text("ALTER TABLE scan_results RENAME TO scan_results_legacy"))
+        # Índices, PK y secuencia conservan su nombre: dejarles sitio a los de la nueva
+        for idx in inspect(conn).get_indexes("scan_results_legacy"):
+            conn.execute(text(f'DROP INDEX "{idx["name"]}"'))
+        pk = inspect(conn).get_pk_constraint("scan_results_legacy").get("name")
+        if pk:
+            conn.execute(text(f'ALTER INDEX "{pk}" RENAME TO scan_results_legacy_pkey'))
+        if seq:
+            conn.execute(text(f"ALTER SEQUENCE {seq} RENAME TO scan_results_legacy_id_seq"))
+
+        _create_partitioned(conn)
+        oldest = conn.execute(text("SELECT min(scan_time) FROM scan_results_legacy")).scalar()
+        ensure_partitions(conn, since=_utc(oldest).date() if oldest else None)
+
+        cols = [c.name for c in ScanResult.__table__.columns]
+        source = [
+            "COALESCE(scan_time, completed_at, now())" if c == "scan_time" else c
+            for c in cols
+        ]
+        moved = conn.execute(text(
+            f"INSERT INTO scan_results ({', '.join(cols)}) "
+            f"SELECT {', '.join(source)} FROM scan_results_legacy"
+        )).rowcount
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('scan_results', 'id'), "
+            "COALESCE((SELECT max(id) FROM scan_results), 0) + 1, false)"
+        ))
+        conn.execute(text("DROP TABLE scan_results_legacy"))
+    print(f"[Retention] scan_results particionada ({moved} filas migradas)")
+
+
+# ============================================================
+#                          ARCHIVO
+# ============================================================
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _archive(month: date, rows: Iterable[Dict[str, Any]]) -> int:
+    """
+    Añade filas a <SCAN_ARCHIVE_DIR>/scan_results_AAAAMM.jsonl.gz. Cada
+    llamada es un miembro gzip nuevo (zcat lee el fichero entero). Vuelve
+    tras fsync: solo entonces se puede borrar de la BD.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    os.makedirs(SCAN_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(SCAN_ARCHIVE_DIR, f"scan_results_{month.year:04d}{month.month:02d}.jsonl.gz")
+    n = 0
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+            for row in itertools.chain((first,), rows):
+                gz.write(json.dumps(dict(row), default=_json_default, ensure_ascii=False).encode("utf-8"))
+                gz.write(b"\n")
+                n += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    return n
+
+
+def _archive_by_month(rows: List[Dict[str, Any]]) -> None:
+    months: Dict[date, List[Dict[str, Any]]] = {}
+    for row in rows:
+        scan_time = _utc(row.get("scan_time")) or _now()
+        months.setdefault(_month_start(scan_time.date()), []).append(row)
+    for month, batch in sorted(months.items()):
+        _archive(month, batch)
+
+
+# ============================================================
+#                 BORRADO (PARTICIONES Y LOTES)
+# ============================================================
+
+def _detached_partitions(conn) -> Dict[str, date]:
+    """Particiones ya separadas de scan_results pero sin borrar (pasada interrumpida)."""
+    rows = conn.execute(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+        "AND relname LIKE 'scan_results_p%' AND pg_table_is_visible(oid)"
+    )).scalars()
+    return {
+        name: date(int(m.group(1)), int(m.group(2)), 1)
+        for name in rows if (m := _PARTITION_RE.match(name))
+    }
+
+
+def _drop_expired_partitions(cutoff: datetime) -> int:
+    """
+    Particiones cuyo mes entero es anterior a `cutoff`: DETACH, archivar y
+    DROP. El DETACH necesita un lock exclusivo sobre scan_results: con
+    lock_timeout, si hay transacciones largas se reintenta en la próxima
+    pasada en vez de dejar en cola (y bloqueadas) las consultas de la API.
+    """
+    with engine.connect() as conn:
+        expired = {
+            name: month for name, month in list_partitions(conn).items()
+            if _add_months(month, 1) <= cutoff.date()
+        }
+        pending = _detached_partitions(conn)
+
+    for name in sorted(expired):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = {RETENTION_LOCK_TIMEOUT_MS}"))
+                conn.execute(text(f"ALTER TABLE scan_results DETACH PARTITION {name}"))
+        except OperationalError as e:
+            print(f"[Retention] {name} ocupada, se reintentará: {e.orig}")
+            continue
+        pending[name] = expired[name]
+
+    # Ya fuera de scan_results: archivar y borrar no bloquea a nadie
+    for name, month in sorted(pending.items()):
+        if SCAN_ARCHIVE_DIR:
+            # Cursor de servidor: la partición no se carga entera en memoria
+            with engine.connect() as conn:
+                rows = conn.execution_options(stream_results=True, yield_per=RETENTION_BATCH).execute(
+                    text(f"SELECT * FROM {name} ORDER BY id")
+                ).mappings()
+                n = _archive(month, rows)
+            if n:
+                print(f"[Retention] {name}: {n} filas archivadas")
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {name}"))
+        print(f"[Retention] Partición {name} eliminada")
+    return len(pending)
+
+
+def _delete_rows(db, where) -> int:
+    """Borra por lotes las filas de scan_results que cumplan `where` (archivándolas antes)."""
+    deleted = 0
+    while True:
+        if SCAN_ARCHIVE_DIR:
+            rows = [
+                dict(r) for r in db.execute(
+                    select(*ScanResult.__table__.columns).where(*where)
+                    .order_by(ScanResult.id).limit(RETENTION_BATCH)
+                ).mappings()
+            ]
+            ids = [r["id"] for r in rows]
+            if rows:
+                _archive_by_month(rows)
+        else:
+            ids = list(db.execute(
+                select(ScanResult.id).where(*where).order_by(ScanResult.id).limit(RETENTION_BATCH)
+            ).scalars())
+        if not ids:
+            return deleted
+        db.execute(delete(ScanResult).where(ScanResult.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        if len(ids) < RETENTION_BATCH:
+            return deleted
+
+
+def maintain_partitions(now: datetime) -> Dict[str, int]:
+    """
+    Particiones de los próximos meses y DROP de las caducadas. Va antes que
+    el resto de la pasada: una transacción abierta de la propia compactación
+    bloquearía el DETACH.
+    """
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return {}
+    stats = {"partitions_created": 0, "partitions_dropped": 0}
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = {RETENTION_LOCK_TIMEOUT_MS}"))
+            stats["partitions_created"] = ensure_partitions(conn)
+    except OperationalError as e:
+        print(f"[Retention] No se pudieron crear particiones, se reintentará: {e.orig}")
+    if SCAN_RETENTION_DAYS > 0:
+        stats["partitions_dropped"] = _drop_expired_partitions(now - timedelta(days=SCAN_RETENTION_DAYS))
+    return stats
+
+
+def expire(db, now: datetime) -> int:
+    """
+    Escaneos más antiguos que SCAN_RETENTION_DAYS, por lotes. Con particiones
+    solo quedan los del mes parcialmente caducado y los de la DEFAULT.
+    """
+    if SCAN_RETENTION_DAYS <= 0:
+        return 0
+    return _delete_rows(db, [ScanResult.scan_time < now - timedelta(days=SCAN_RETENTION_DAYS)])
+
+
+# ============================================================
+#              REDUCCIÓN A UN ESCANEO POR HOST Y DÍA
+# ============================================================
+
+def _ensure_rollup(db, host: str, rows: List[Any]) -> None:
+    """
+    Los escaneos de un host y día que se van a borrar deben estar ya en
+    risk_rollups (el scheduler los añade al guardarlos). Si el día no tiene
+    fila (datos anteriores a los rollups), se reconstruye con los completados.
+    """
+    day = _utc(rows[-1].scan_time).date()
+    exists = db.execute(
+        select(RiskRollup.id).where(
+            RiskRollup.day == day, RiskRollup.user_id.is_(None), RiskRollup.host == host
+        )
+    ).first()
+    if exists:
+        return
+    for row in rows:
+        if (row.status or "").lower() != "completed":
+            continue
+        results = db.execute(select(ScanResult.results).where(ScanResult.id == row.id)).scalar()
+        update_rollups(db, None, host, results or {}, when=_utc(row.scan_time))
+
+
+def downsample(db, now: datetime) -> int:
+    """
+    Escaneos del scheduler (user_id NULL, uno por objetivo y hora) más
+    antiguos que SCAN_RETENTION_RAW_DAYS: se queda el último completado de
+    cada host y día. Los del usuario (API) no se tocan.
+    """
+    raw_cutoff = now - timedelta(days=SCAN_RETENTION_RAW_DAYS)
+    day_col = _utc_day(ScanResult.scan_time)
+    base = [
+        ScanResult.user_id.is_(None),
+        ScanResult.scan_time < raw_cutoff,
+        # Los anteriores los borra expire_scheduler
+        ScanResult.scan_time >= now - timedelta(days=SCAN_RETENTION_DAILY_DAYS),
+        ScanResult.status.notin_(UNFINISHED),
+    ]
+    removed = 0
+    while True:
+        groups = db.execute(
+            select(ScanResult.host, day_col)
+            .where(*base)
+            .group_by(ScanResult.host, day_col)
+            .having(func.count(ScanResult.id) > 1)
+            .limit(RETENTION_BATCH)
+        ).all()
+        if not groups:
+            return removed
+        before = removed
+        for host, day in groups:
+            host_filter = ScanResult.host.is_(None) if host is None else ScanResult.host == host
+            rows = db.execute(
+                select(ScanResult.id, ScanResult.status, ScanResult.scan_time)
+                .where(*base, host_filter, day_col == day)
+                .order_by(ScanResult.scan_time, ScanResult.id)
+            ).all()
+            if len(rows) < 2:
+                continue
+            completed = [r for r in rows if (r.status or "").lower() == "completed"]
+            keep = (completed or rows)[-1].id
+            if host:
+                _ensure_rollup(db, host, rows)
+            ids = [r.id for r in rows if r.id != keep]
+            if SCAN_ARCHIVE_DIR:
+                _archive_by_month([
+                    dict(r) for r in db.execute(
+                        select(*ScanResult.__table__.columns).where(ScanResult.id.in_(ids))
+                    ).mappings()
+                ])
+            db.execute(delete(ScanResult).where(ScanResult.id.in_(ids)))
+            db.commit()
+            removed += len(ids)
+        if removed == before:
+            return removed
+
+
+def expire_scheduler(db, now: datetime) -> int:
+    """Escaneos del scheduler más antiguos que SCAN_RETENTION_DAILY_DAYS (con su día ya en risk_rollups)."""
+    where = [
+        ScanResult.user_id.is_(None),
+        ScanResult.scan_time < now - timedelta(days=SCAN_RETENTION_DAILY_DAYS),
+    ]
+    removed = 0
+    while True:
+        rows = db.execute(
+            select(ScanResult.id, ScanResult.host, ScanResult.status, ScanResult.scan_time)
+            .where(*where)
+            .order_by(ScanResult.host, ScanResult.scan_time, ScanResult.id)
+            .limit(RETENTION_BATCH)
+        ).all()
+        if not rows:
+            return removed
+        days: Dict[tuple, List[Any]] = {}
+        for row in rows:
+            if row.host:
+                days.setdefault((row.host, _utc(row.scan_time).date()), []).append(row)
+        for (host, _day), group in days.items():
+            _ensure_rollup(db, host, group)
+        ids = [r.id for r in rows]
+        if SCAN_ARCHIVE_DIR:
+            _archive_by_month([
+                dict(r) for r in db.execute(
+                    select(*ScanResult.__table__.columns).where(ScanResult.id.in_(ids))
+                ).mappings()
+            ])
+        db.execute(delete(ScanResult).where(ScanResult.id.in_(ids)))
+        db.commit()
+        removed += len(ids)
+        if len(rows) < RETENTION_BATCH:
+            return removed
+
+
+# ============================================================
+#                       COMPACTACIÓN
+# ============================================================
+
+def _null_in_batches(db, column, where) -> int:
+    """column = NULL (SQL, no el JSON null) por lotes de ids."""
+    total = 0
+    while True:
+        ids = list(db.execute(
+            select(ScanResult.id).where(column.isnot(None), *where).limit(RETENTION_BATCH)
+        ).scalars())
+        if not ids:
+            return total
+        db.execute(
+            update(ScanResult).where(ScanResult.id.in_(ids)).values({column.key: null()})
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        total += len(ids)
+
+
+def compact(db, now: datetime) -> Dict[str, int]:
+    """
+    Vacía lo que ya no hace falta sin borrar el escaneo:
+      - checkpoint de los terminados (solo sirve para reanudar);
+      - traza de los más antiguos que SCAN_RETENTION_RAW_DAYS.
+    """
+    return {
+        "checkpoints": _null_in_batches(db, ScanResult.checkpoint, [ScanResult.status.notin_(UNFINISHED)]),
+        "traces": _null_in_batches(
+            db, ScanResult.trace, [ScanResult.scan_time < now - timedelta(days=SCAN_RETENTION_RAW_DAYS)]
+        ),
+    }
+
+
+def expire_events(db, now: datetime) -> int:
+    cutoff = now - timedelta(days=SCAN_EVENTS_RETENTION_DAYS)
+    total = 0
+    while True:
+        seqs = list(db.execute(
+            select(ScanEvent.seq).where(ScanEvent.created_at < cutoff).limit(RETENTION_BATCH)
+        ).scalars())
+        if not seqs:
+            return total
+        db.execute(delete(ScanEvent).where(ScanEvent.seq.in_(seqs)))
+        db.commit()
+        total += len(seqs)
+
+
+# ============================================================
+#                     EJECUCIÓN PERIÓDICA
+# ============================================================
+
+@contextmanager
+def _single_runner():
+    """True si este proceso es el único compactando ahora mismo."""
+    if not _is_postgres():
+        acquired = _local_lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _local_lock.release()
+        return
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_KEY}).scalar()
+        # El lock es de sesión: sobrevive al commit, sin transacción abierta mientras dura
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+                conn.commit()
+
+
+def run_retention() -> Dict[str, Any]:
+    """
+    Una pasada completa: particiones por delante, compactación, reducción
+    diaria, expiración (filas, eventos y evidencias). Devuelve lo hecho.
+    """
+    stats: Dict[str, Any] = {}
+    with _single_runner() as acquired:
+        if not acquired:
+            return {"skipped": True}
+        now = _now()
+        if _is_postgres():
+            stats.update(maintain_partitions(now))
+        db = SessionLocal()
+        try:
+            stats.update(compact(db, now))
+            if SCAN_RETENTION_DAILY_DAYS > 0:
+                stats["downsampled"] = downsample(db, now)
+                stats["scheduler_expired"] = expire_scheduler(db, now)
+            stats["expired"] = expire(db, now)
+            stats["events"] = expire_events(db, now)
+        finally:
+            db.close()
+        if SCAN_RETENTION_DAYS > 0:
+            stats["blobs"] = get_blob_store().prune(SCAN_RETENTION_DAYS * 86400)
+    if any(v for v in stats.values()):
+        print(f"[Retention] {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retención y compactación de scan_results")
+    parser.add_argument(
+        "--migrate-partitions", action="store_true",
+        help="convierte una scan_results existente en particionada (Postgres)",
+    )
+    args = parser.parse_args()
+    if args.migrate_partitions:
+        migrate_to_partitions()
+    else:
+        print(run_retention())
+
+
+if __name__ == "__main__":
+    main()
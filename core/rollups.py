@@ -0,0 +1,214 @@
+# pymesec/core/rollups.py
+
+from datetime import datetime, date, timedelta, timezone
+from typing import List, Dict, Any, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import RiskRollup
+from .ai import RiskEngine
+from .findings import Finding, Severity, load_findings
+
+# Fila agregada por tenant (usuario) dentro de risk_rollups
+TENANT_HOST = "*"
+
+SEVERITY_COLUMNS = ["critical", "high", "medium", "low", "info"]
+
+
+# ============================================================
+#               NORMALIZACIÓN DE HALLAZGOS
+# ============================================================
+
+# Hallazgos del scheduler (job/main.py): escáner web -> (severidad, nombre)
+WEB_FINDINGS = [
+    ("headers", Severity.MEDIA, "Cabecera de Seguridad Faltante"),
+    ("sqli", Severity.CRITICA, "Inyección SQL (SQLi)"),
+    ("xss", Severity.ALTA, "Cross-Site Scripting (XSS)"),
+    ("directories", Severity.MEDIA, "Recurso Oculto Expuesto"),
+]
+
+
+def extract_findings(results: Dict[str, Any]) -> List[Finding]:
+    """
+    Devuelve los hallazgos normalizados de un resultado de escaneo, venga de
+    la API ("vulnerabilities") o del scheduler de job/main.py ("network"/"web").
+    """
+    if not results:
+        return []
+    if "vulnerabilities" in results:
+        return load_findings(results.get("vulnerabilities"))
+
+    web = results.get("web") or {}
+    findings = []
+    for key, severity, name in WEB_FINDINGS:
+        for desc in (web.get(key) or {}).get("findings", []) or []:
+            findings.append(Finding(severity, name, desc))
+    return findings
+
+
+# ============================================================
+#                ACTUALIZACIÓN INCREMENTAL
+# ============================================================
+
+def _row_query(db: Session, day: date, user_id: Optional[int], host: str):
+    return db.query(RiskRollup).filter(
+        RiskRollup.day == day,
+        RiskRollup.user_id.is_(None) if user_id is None else RiskRollup.user_id == user_id,
+        RiskRollup.host == host,
+    )
+
+
+def _claim_row(db: Session, day: date, user_id: Optional[int], host: str) -> RiskRollup:
+    """
+    Fila (día, usuario, host), creándola si no existe, bloqueada hasta el
+    commit. Varios escritores (workers de la API, scheduler) pueden
+    actualizar el mismo día a la vez: el índice único evita filas
+    duplicadas y el bloqueo, que se pierdan incrementos.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(
+            pg_insert(RiskRollup)
+            .values(day=day, user_id=user_id, host=host, scans=0, new_findings=0, resolved_findings=0)
+            .on_conflict_do_nothing()
+        )
+        return _row_query(db, day, user_id, host).with_for_update().populate_existing().one()
+
+    # SQLite serializa las escrituras: basta con reintentar si otro la insertó antes
+    row = _row_query(db, day, user_id, host).first()
+    if row is not None:
+        return row
+    try:
+        with db.begin_nested():
+            row = RiskRollup(day=day, user_id=user_id, host=host, scans=0, new_findings=0, resolved_findings=0)
+            db.add(row)
+        return row
+    except IntegrityError:
+        return _row_query(db, day, user_id, host).one()
+
+
+def _previous_fingerprints(db: Session, day: date, user_id: Optional[int], host: str) -> set:
+    prev = (
+        db.query(RiskRollup.open_fingerprints)
+        .filter(
+            RiskRollup.day < day,
+            RiskRollup.user_id.is_(None) if user_id is None else RiskRollup.user_id == user_id,
+            RiskRollup.host == host,
+        )
+        .order_by(RiskRollup.day.desc())
+        .first()
+    )
+    return set(prev[0] or []) if prev else set()
+
+
+def update_rollups(
+    db: Session,
+    user_id: Optional[int],
+    host: str,
+    results: Dict[str, Any],
+    when: Optional[datetime] = None,
+) -> None:
+    """
+    Incorpora un escaneo completado a los rollups diarios del host y del tenant.
+    No hace commit: se ejecuta dentro de la transacción que guarda el ScanResult.
+    """
+    if not host:
+        return
+    day = (when or datetime.now(timezone.utc)).date()
+    findings = extract_findings(results)
+
+    counts = {col: 0 for col in SEVERITY_COLUMNS}
+    for f in findings:
+        counts[f.severity.bucket] += 1
+    isg, _ = RiskEngine().calculate_isg(findings)
+
+    current = {f.fingerprint for f in findings}
+
+    # 1. Fila del host: snapshot del último escaneo + acumulado de nuevos/resueltos
+    row = _claim_row(db, day, user_id, host)
+    # Lo abierto tras el escaneo anterior: el de hoy si ya lo hubo, si no el último día previo
+    if row.scans:
+        previous = set(row.open_fingerprints or [])
+    else:
+        previous = _previous_fingerprints(db, day, user_id, host)
+    # Acumulados como incremento en SQL (scans = scans + 1): no se pierden
+    # aunque otro escritor haya actualizado la fila después de leerla
+    row.scans = RiskRollup.scans + 1
+    row.isg = isg
+    for col, n in counts.items():
+        setattr(row, col, n)
+    row.new_findings = RiskRollup.new_findings + len(current - previous)
+    row.resolved_findings = RiskRollup.resolved_findings + len(previous - current)
+    row.open_fingerprints = sorted(current)
+    db.flush()
+
+    # 2. Fila del tenant: recalculada desde el último estado conocido de cada host
+    _refresh_tenant_row(db, day, user_id)
+
+
+def _refresh_tenant_row(db: Session, day: date, user_id: Optional[int]) -> None:
+    user_filter = RiskRollup.user_id.is_(None) if user_id is None else RiskRollup.user_id == user_id
+
+    latest = (
+        db.query(RiskRollup.host, func.max(RiskRollup.day).label("day"))
+        .filter(user_filter, RiskRollup.host != TENANT_HOST, RiskRollup.day <= day)
+        .group_by(RiskRollup.host)
+        .subquery()
+    )
+    host_rows = (
+        db.query(RiskRollup)
+        .join(latest, (RiskRollup.host == latest.c.host) & (RiskRollup.day == latest.c.day))
+        .filter(user_filter)
+        .all()
+    )
+    if not host_rows:
+        return
+
+    tenant = _claim_row(db, day, user_id, TENANT_HOST)
+
+    today_rows = [r for r in host_rows if r.day == day]
+    tenant.scans = sum(r.scans for r in today_rows)
+    tenant.new_findings = sum(r.new_findings for r in today_rows)
+    tenant.resolved_findings = sum(r.resolved_findings for r in today_rows)
+    for col in SEVERITY_COLUMNS:
+        setattr(tenant, col, sum(getattr(r, col) for r in host_rows))
+    tenant.isg = round(sum(r.isg for r in host_rows) / len(host_rows), 1)
+    tenant.open_fingerprints = []
+
+
+# ============================================================
+#                       CONSULTA
+# ============================================================
+
+def get_trends(
+    db: Session,
+    user_id: Optional[int],
+    host: Optional[str] = None,
+    days: int = 90,
+) -> List[Dict[str, Any]]:
+    """Serie diaria de riesgo para un host concreto o para el tenant completo."""
+    since = datetime.now(timezone.utc).date() - timedelta(days=days)
+    rows = (
+        db.query(RiskRollup)
+        .filter(
+            RiskRollup.user_id.is_(None) if user_id is None else RiskRollup.user_id == user_id,
+            RiskRollup.host == (host or TENANT_HOST),
+            RiskRollup.day >= since,
+        )
+        .order_by(RiskRollup.day.asc())
+        .all()
+    )
+    return [
+        {
+            "day": r.day,
+            "host": r.host,
+            "scans": r.scans,
+            "isg": r.isg,
+            **{col: getattr(r, col) for col in SEVERITY_COLUMNS},
+            "new_findings": r.new_findings,
+            "resolved_findings": r.resolved_findings,
+        }
+        for r in rows
+    ]
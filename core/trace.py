@@ -0,0 +1,266 @@
+# pymesec/core/trace.py
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Perfilado opcional de cada escaneo: "" (desactivado) | "cprofile" | "sample"
+SCAN_PROFILE = os.getenv("SCAN_PROFILE", "").lower()
+# Periodo del muestreador de pilas (ms) y cuántas entradas del perfil se guardan
+SCAN_PROFILE_INTERVAL_MS = float(os.getenv("SCAN_PROFILE_INTERVAL_MS", "10"))
+SCAN_PROFILE_TOP = int(os.getenv("SCAN_PROFILE_TOP", "30"))
+
+# Traza y span activos en la tarea actual (las tareas hijas heredan una copia)
+_trace: ContextVar[Optional["ScanTrace"]] = ContextVar("scan_trace", default=None)
+_span: ContextVar[Optional["Span"]] = ContextVar("scan_span", default=None)
+
+
+class Span:
+    __slots__ = ("index", "name", "cat", "start", "end", "parent", "requests", "bytes", "args")
+
+    def __init__(self, index: int, name: str, cat: str, start: float, parent: Optional["Span"], args: Dict[str, Any]):
+        self.index = index
+        self.name = name
+        self.cat = cat
+        self.start = start
+        self.end: Optional[float] = None
+        self.parent = parent
+        self.requests = 0
+        self.bytes = 0
+        self.args = args
+
+
+class ScanTrace:
+    """
+    Línea de tiempo de un escaneo: un span por etapa/escáner (y sus sondas y
+    subprocesos), con inicio, fin, peticiones y bytes. Se guarda compacta en
+    ScanResult.trace y se exporta en formato Chrome trace-event.
+    """
+
+    def __init__(self, scan_id: Optional[int] = None, profile: str = SCAN_PROFILE):
+        self.scan_id = scan_id
+        self.t0 = time.time()
+        self._perf0 = time.perf_counter()
+        self.spans: List[Span] = []
+        self.profile_mode = profile
+        self.profile: Optional[Dict[str, Any]] = None
+        self._profiler = None
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._perf0
+
+    def open(self, name: str, cat: str, parent: Optional[Span], args: Dict[str, Any]) -> Span:
+        span = Span(len(self.spans), name, cat, self._now(), parent, args)
+        self.spans.append(span)
+        return span
+
+    def close(self, span: Span):
+        span.end = self._now()
+
+    # ---------- perfilado ----------
+
+    def start_profile(self):
+        if self.profile_mode == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Solo puede haber un perfilador activo por hilo: otro escaneo lo tiene
+                return
+            self._profiler = profiler
+        elif self.profile_mode == "sample":
+            self._profiler = _StackSampler(threading.get_ident(), SCAN_PROFILE_INTERVAL_MS / 1000.0)
+            self._profiler.start()
+
+    def stop_profile(self):
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        if isinstance(profiler, _StackSampler):
+            self.profile = profiler.stop()
+            return
+        import pstats
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)
+        self.profile = {
+            "mode": "cprofile",
+            # [función, llamadas, tiempo propio (ms), tiempo acumulado (ms)]
+            "top": [
+                [f"{os.path.basename(fn)}:{line}({func})", nc, round(tt * 1000, 2), round(ct * 1000, 2)]
+                for (fn, line, func), (cc, nc, tt, ct, _callers) in rows[:SCAN_PROFILE_TOP]
+            ],
+        }
+
+    # ---------- serialización ----------
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Formato compacto: [nombre, categoría, inicio ms, duración ms, padre, peticiones, bytes, args]."""
+        now = self._now()
+        data = {
+            "v": 1,
+            "t0": round(self.t0, 3),
+            "spans": [
+                [
+                    s.name,
+                    s.cat,
+                    round(s.start * 1000, 1),
+                    round(((s.end if s.end is not None else now) - s.start) * 1000, 1),
+                    s.parent.index if s.parent is not None else -1,
+                    s.requests,
+                    s.bytes,
+                    s.args or None,
+                ]
+                for s in self.spans
+            ],
+        }
+        if self.profile:
+            data["profile"] = self.profile
+        return data
+
+
+class _StackSampler:
+    """Muestreador de pilas del hilo del event loop (perfil estadístico de bajo coste)."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="scan-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < 24:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+            self.total += 1
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join(timeout=1)
+        return {
+            "mode": "sample",
+            "interval_ms": self.interval * 1000,
+            "samples": self.total,
+            # [pila colapsada, muestras]
+            "top": [[stack, n] for stack, n in self.samples.most_common(SCAN_PROFILE_TOP)],
+        }
+
+
+# ============================================================
+#                  API PARA LOS ESCÁNERES
+# ============================================================
+
+def start_trace(scan_id: Optional[int] = None) -> ScanTrace:
+    """Activa una traza para la tarea actual (y las que lance) con un span raíz "scan"."""
+    trace = ScanTrace(scan_id)
+    _trace.set(trace)
+    _span.set(trace.open("scan", "scan", None, {}))
+    trace.start_profile()
+    return trace
+
+
+def finish_trace(trace: Optional[ScanTrace]) -> Optional[Dict[str, Any]]:
+    """Cierra el span raíz y el perfilador. Devuelve la traza compacta para guardar."""
+    if trace is None:
+        return None
+    trace.stop_profile()
+    if trace.spans and trace.spans[0].end is None:
+        trace.close(trace.spans[0])
+    return trace.to_dict()
+
+
+@contextmanager
+def span(name: str, cat: str = "stage", **args):
+    """Abre un span hijo del actual. Sin traza activa no hace nada."""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.open(name, cat, _span.get(), args)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.args["error"] = type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        trace.close(current)
+
+
+def record_io(requests: int = 0, nbytes: int = 0):
+    """Suma peticiones/bytes al span actual y a sus ancestros."""
+    current = _span.get()
+    while current is not None:
+        current.requests += requests
+        current.bytes += nbytes
+        current = current.parent
+
+
+# ============================================================
+#                 EXPORTACIÓN (CHROME TRACE)
+# ============================================================
+
+def to_chrome_trace(data: Dict[str, Any], scan_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Convierte la traza compacta al formato trace-event de Chrome
+    (chrome://tracing, Perfetto). Cada etapa de primer nivel va en su propio
+    carril; sondas y subprocesos se dibujan dentro del carril de su etapa.
+    """
+    pid = scan_id or 0
+    spans = data.get("spans") or []
+    lanes: Dict[int, int] = {}
+    next_lane = 1
+    events = [
+        {"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": f"scan {pid}"}},
+        {"ph": "M", "name": "thread_name", "pid": pid, "tid": 0, "args": {"name": "scan"}},
+    ]
+    for i, (name, cat, start, dur, parent, requests, nbytes, args) in enumerate(spans):
+        if parent < 0:
+            lanes[i] = 0
+        elif parent == 0:
+            lanes[i] = next_lane
+            next_lane += 1
+            events.append({
+                "ph": "M", "name": "thread_name", "pid": pid,
+                "tid": lanes[i], "args": {"name": name},
+            })
+        else:
+            lanes[i] = lanes.get(parent, 0)
+        event_args = dict(args or {})
+        if requests:
+            event_args["requests"] = requests
+        if nbytes:
+            event_args["bytes"] = nbytes
+        events.append({
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": int(start * 1000),
+            "dur": int(dur * 1000),
+            "pid": pid,
+            "tid": lanes[i],
+            "args": event_args,
+        })
+    result = {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"t0": data.get("t0")}}
+    if data.get("profile"):
+        result["otherData"]["profile"] = data["profile"]
+    return result
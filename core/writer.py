@@ -0,0 +1,232 @@
+# pymesec/core/writer.py
+
+import os
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DBAPIError
+
+from .db import SessionLocal, ScanResult, ScanEvent
+from .rollups import update_rollups
+
+# Disparadores del volcado: tamaño del lote o tiempo desde el primer pendiente
+FLUSH_MAX_ITEMS = int(os.getenv("FLUSH_MAX_ITEMS", "200"))
+FLUSH_INTERVAL_MS = int(os.getenv("FLUSH_INTERVAL_MS", "200"))
+
+
+class _Op:
+    __slots__ = ("kind", "data", "rollup", "future")
+
+    def __init__(self, kind: str, data: Dict[str, Any], rollup: Optional[Tuple], future: asyncio.Future):
+        self.kind = kind          # "result" | "update" | "event"
+        self.data = data
+        self.rollup = rollup      # (user_id, host) si hay que actualizar risk_rollups
+        self.future = future
+
+
+class WriteBehindBuffer:
+    """
+    Etapa de persistencia write-behind.
+
+    Acumula resultados completos, actualizaciones de estado y eventos de
+    progreso, y los vuelca en una sola transacción con inserts/updates
+    multi-fila cuando se llena el lote o vence el intervalo. Cada llamada
+    devuelve solo después del COMMIT que la incluye (durable antes de confirmar).
+
+    Si el lote falla, se reintenta por mitades hasta aislar las operaciones
+    culpables: solo esas reciben la excepción, el resto se guarda.
+    """
+
+    def __init__(self, max_items: int = FLUSH_MAX_ITEMS, interval_ms: int = FLUSH_INTERVAL_MS):
+        self.max_items = max_items
+        self.interval = interval_ms / 1000.0
+        self._pending: List[_Op] = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None  # volcado en curso
+
+    # ---------- API pública ----------
+
+    async def insert_result(
+        self,
+        host: str,
+        status: str,
+        results: Dict[str, Any],
+        user_id: Optional[int] = None,
+        rollup: bool = False,
+        trace: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        """Inserta un ScanResult nuevo. Devuelve su id."""
+        data = {"host": host, "status": status, "results": results, "user_id": user_id, "trace": trace}
+        return await self._submit("result", data, (user_id, host) if rollup else None)
+
+    async def update_scan(
+        self,
+        scan_id: int,
+        status: str,
+        results: Optional[Dict[str, Any]] = None,
+        rollup: Optional[Tuple[Optional[int], str]] = None,
+        trace: Optional[Dict[str, Any]] = None,
+        completed_at: Optional[datetime] = None,
+        checkpoint: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Actualiza estado (y opcionalmente resultados, traza, fin y checkpoint) de un ScanResult existente."""
+        data = {"id": scan_id, "status": status}
+        if results is not None:
+            data["results"] = results
+        if trace is not None:
+            data["trace"] = trace
+        if completed_at is not None:
+            data["completed_at"] = completed_at
+        if checkpoint is not None:
+            data["checkpoint"] = checkpoint
+        await self._submit("update", data, rollup)
+
+    async def save_checkpoint(self, scan_id: int, checkpoint: Dict[str, Any], heartbeat_at: datetime) -> None:
+        """Guarda las etapas terminadas sin tocar el estado (un Completed posterior siempre gana)."""
+        data = {"id": scan_id, "checkpoint": checkpoint, "heartbeat_at": heartbeat_at}
+        await self._submit("update", data, None)
+
+    async def append_event(self, user_id: int, scan_id: int, status: str, msg: str) -> int:
+        """Registra un evento de progreso. Devuelve su número de secuencia."""
+        data = {"user_id": user_id, "scan_id": scan_id, "status": status, "message": msg[:500]}
+        return await self._submit("event", data, None)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def close(self):
+        """Vuelca lo pendiente y detiene el volcador."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # El lote que se estaba volcando termina (y resuelve sus futures): el
+        # volcador se cancela, no su COMMIT
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._flush(batch)
+
+    # ---------- internos ----------
+
+    async def _submit(self, kind: str, data: Dict[str, Any], rollup: Optional[Tuple]):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Op(kind, data, rollup, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_items:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            batch, self._pending = self._pending, []
+            self._has_items.clear()
+            self._full.clear()
+            if batch:
+                self._flushing = asyncio.ensure_future(self._flush(batch))
+                await asyncio.shield(self._flushing)
+                self._flushing = None
+
+    async def _flush(self, batch: List[_Op]):
+        try:
+            outcome = await asyncio.to_thread(_flush_isolating, batch)
+        except Exception as e:
+            outcome = [(False, e)] * len(batch)
+        failed = sum(1 for ok, _ in outcome if not ok)
+        if failed:
+            print(f"[WriteBehind] Fallaron {failed} de {len(batch)} operaciones")
+        for op, (ok, value) in zip(batch, outcome):
+            if op.future.done():
+                continue
+            if ok:
+                op.future.set_result(value)
+            else:
+                op.future.set_exception(value)
+
+
+def _flush_isolating(batch: List[_Op]) -> List[Tuple[bool, Any]]:
+    """
+    _flush_sync del lote; si falla, bisección: cada mitad en su transacción
+    hasta dar con las operaciones que fallan solas. Devuelve (ok, valor o
+    excepción) por operación. Las mitades van en orden, así que entre
+    actualizaciones del mismo escaneo sigue ganando la última.
+    """
+    try:
+        return [(True, value) for value in _flush_sync(batch)]
+    except Exception as e:
+        # Sin conexión fallarían todas igual: no tiene sentido partir el lote
+        lost = isinstance(e, DBAPIError) and e.connection_invalidated
+        if len(batch) == 1 or lost:
+            print(f"[WriteBehind] Falló el volcado de {len(batch)} operaciones: {e}")
+            return [(False, e)] * len(batch)
+    mid = len(batch) // 2
+    return _flush_isolating(batch[:mid]) + _flush_isolating(batch[mid:])
+
+
+def _flush_sync(batch: List[_Op]) -> List[Any]:
+    """Una transacción por lote: inserts multi-fila, updates por PK y rollups."""
+    results = [op for op in batch if op.kind == "result"]
+    events = [op for op in batch if op.kind == "event"]
+    updates: Dict[int, Dict[str, Any]] = {}
+    for op in batch:
+        if op.kind == "update":
+            # Varias actualizaciones del mismo escaneo en un lote: gana la última
+            updates.setdefault(op.data["id"], {}).update(op.data)
+
+    values: Dict[int, Any] = {}
+    db = SessionLocal()
+    try:
+        if results:
+            ids = db.execute(
+                insert(ScanResult).returning(ScanResult.id, sort_by_parameter_order=True),
+                [op.data for op in results],
+            ).scalars().all()
+            for op, new_id in zip(results, ids):
+                values[id(op)] = new_id
+
+        if events:
+            seqs = db.execute(
+                insert(ScanEvent).returning(ScanEvent.seq, sort_by_parameter_order=True),
+                [op.data for op in events],
+            ).scalars().all()
+            for op, seq in zip(events, seqs):
+                values[id(op)] = seq
+
+        if updates:
+            db.execute(update(ScanResult), list(updates.values()))
+
+        for op in batch:
+            if op.rollup and op.data.get("status", "").lower() == "completed":
+                user_id, host = op.rollup
+                update_rollups(db, user_id, host, op.data.get("results") or {})
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return [values.get(id(op)) for op in batch]
+
+
+_writer: Optional[WriteBehindBuffer] = None
+
+
+def get_writer() -> WriteBehindBuffer:
+    """Buffer write-behind del proceso (se crea dentro del event loop que lo usa)."""
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindBuffer()
+    return _writer
@@ -0,0 +1,177 @@
+import os
+import time
+import socket
+from typing import List, Dict, Iterable
+
+from sqlalchemy import or_
+
+from core.db import SessionLocal, TargetLease
+
+# Duración de un lease sin heartbeat antes de que otro worker pueda tomar el objetivo
+LEASE_TTL_S = float(os.getenv("LEASE_TTL_S", "120"))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{os.urandom(3).hex()}"
+
+
+class LeaseCoordinator:
+    """
+    Protocolo de reclamación de objetivos respaldado por la BD.
+
+    - claim(): SELECT ... FOR UPDATE SKIP LOCKED de los objetivos vencidos y
+      sin lease vigente, y UPDATE condicional para tomarlos (en SQLite el
+      FOR UPDATE se ignora y la condición del UPDATE garantiza la exclusión).
+    - heartbeat(): renueva los leases de lo que se está escaneando.
+    - complete()/release(): suelta el objetivo con su próximo turno.
+    """
+
+    def __init__(self, worker_id: str = None, lease_ttl: float = LEASE_TTL_S):
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_ttl = lease_ttl
+
+    def sync_inventory(
+        self,
+        targets: Dict[str, dict],
+        first_runs: Dict[str, float],
+        removed: Iterable[str] = (),
+        prune: bool = True,
+    ):
+        """
+        Inserta los objetivos nuevos y actualiza la configuración de los existentes.
+        Con prune=True (sincronización completa) borra los que ya no están en
+        `targets`; con prune=False solo borra las claves de `removed`.
+        """
+        db = SessionLocal()
+        try:
+            keys = list(targets)
+            existing = {}
+            for i in range(0, len(keys), 500):
+                for row in db.query(TargetLease).filter(
+                    TargetLease.target_key.in_(keys[i:i + 500])
+                ):
+                    existing[row.target_key] = row
+            for key, target in targets.items():
+                row = existing.get(key)
+                if row is None:
+                    db.add(TargetLease(
+                        target_key=key,
+                        target=target,
+                        next_run_at=first_runs[key],
+                        slot_at=first_runs[key],
+                    ))
+                elif row.target != target:
+                    row.target = target
+
+            to_remove = set(removed)
+            if prune and targets:
+                all_keys = {k for (k,) in db.query(TargetLease.target_key)}
+                to_remove |= all_keys - set(targets)
+            to_remove = list(to_remove)
+            for i in range(0, len(to_remove), 500):
+                (
+                    db.query(TargetLease)
+                    .filter(TargetLease.target_key.in_(to_remove[i:i + 500]))
+                    .delete(synchronize_session=False)
+                )
+            db.commit()
+        except Exception as e:
+            # Otro worker pudo insertar a la vez: no es grave, se reintenta en la próxima recarga
+            print(f"[Leases] No se pudo sincronizar el inventario: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def claim(self, limit: int) -> List[TargetLease]:
+        """Reclama hasta `limit` objetivos vencidos. Devuelve las filas tomadas (desligadas)."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        db = SessionLocal()
+        try:
+            available = or_(TargetLease.owner.is_(None), TargetLease.lease_until < now)
+            candidates = (
+                db.query(TargetLease.target_key)
+                .filter(TargetLease.next_run_at <= now, available)
+                .order_by(TargetLease.next_run_at.asc())
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            claimed_keys = []
+            for (key,) in candidates:
+                updated = (
+                    db.query(TargetLease)
+                    .filter(TargetLease.target_key == key, available)
+                    .update(
+                        {"owner": self.worker_id, "lease_until": now + self.lease_ttl},
+                        synchronize_session=False,
+                    )
+                )
+                if updated:
+                    claimed_keys.append(key)
+            db.commit()
+            if not claimed_keys:
+                return []
+            rows = db.query(TargetLease).filter(TargetLease.target_key.in_(claimed_keys)).all()
+            for row in rows:
+                db.expunge(row)
+            return rows
+        except Exception as e:
+            print(f"[Leases] Error reclamando objetivos: {e}")
+            db.rollback()
+            return []
+        finally:
+            db.close()
+
+    def heartbeat(self, keys: Iterable[str]) -> List[str]:
+        """Renueva los leases propios. Devuelve las claves cuyo lease se perdió."""
+        keys = list(keys)
+        if not keys:
+            return []
+        now = time.time()
+        db = SessionLocal()
+        try:
+            (
+                db.query(TargetLease)
+                .filter(TargetLease.target_key.in_(keys), TargetLease.owner == self.worker_id)
+                .update({"lease_until": now + self.lease_ttl}, synchronize_session=False)
+            )
+            db.commit()
+            held = {
+                k for (k,) in db.query(TargetLease.target_key)
+                .filter(TargetLease.target_key.in_(keys), TargetLease.owner == self.worker_id)
+            }
+            return [k for k in keys if k not in held]
+        except Exception as e:
+            # Sin BD no podemos afirmar que se perdió: lo reintentamos en el próximo latido
+            print(f"[Leases] Error en heartbeat: {e}")
+            db.rollback()
+            return []
+        finally:
+            db.close()
+
+    def complete(self, key: str, next_run_at: float, slot_at: float, pending: int, ran: bool = True):
+        """Libera el objetivo y fija su próximo turno (solo si el lease sigue siendo nuestro)."""
+        db = SessionLocal()
+        try:
+            values = {
+                "owner": None,
+                "lease_until": None,
+                "next_run_at": next_run_at,
+                "slot_at": slot_at,
+                "catch_up_pending": pending,
+            }
+            if ran:
+                values["last_run_at"] = time.time()
+            (
+                db.query(TargetLease)
+                .filter(TargetLease.target_key == key, TargetLease.owner == self.worker_id)
+                .update(values, synchronize_session=False)
+            )
+            db.commit()
+        except Exception as e:
+            print(f"[Leases] Error liberando {key}: {e}")
+            db.rollback()
+        finally:
+            db.close()
@@ -1,10 +1,17 @@
 import os
 import time
 import asyncio
-import yaml
 import traceback
-from sqlalchemy.orm import Session
-from core.db import SessionLocal, init_db, ScanResult
+from core.db import init_db
+from core.inventory import TargetInventory
+from core.writer import get_writer
+from core.metrics import observe_scanner, start_metrics_server, register_queue, SCANS_TOTAL
+from core.trace import start_trace, finish_trace
+from core.deadline import SCAN_DEADLINE_S, set_deadline
+from core.findings import Severity, count_by_severity
+from core.rollups import extract_findings
+from job.scheduler import Scheduler
+from job.leases import LeaseCoordinator
 
 # Importar escáneres de RED
 from scanners.net.ports import scan_host
@@ -12,21 +19,28 @@ from scanners.net.tls import tls_info
 
 # Importar escáneres WEB
 from scanners.web.headers import check_headers
+from scanners.web.crawler import crawl_site
 from scanners.web.sqli import check_sqli         # <--- NUEVO
-from scanners.web.xss import check_xss           # <--- NUEVO
+from scanners.web.xxs import check_xss           # <--- NUEVO
 from scanners.web.enum import check_directories  # <--- NUEVO
 
-# Cargar configuración
+# Cargar configuración (la cadencia y los límites viven en job/scheduler.py)
 COMPANY_PROFILE_PATH = os.getenv("COMPANY_PROFILE", "config/company.yaml")
-SCAN_INTERVAL_MIN = int(os.getenv("SCAN_INTERVAL_MIN", "60"))
+# "lease": varios workers se reparten los objetivos vía BD; "local": un solo proceso
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "lease")
+# Puerto del endpoint /metrics de este proceso (0 = desactivado)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+async def scan_injection(url: str):
+    """Un solo rastreo del sitio; SQLi y XSS prueban todos los endpoints que encuentre."""
+    crawl = await observe_scanner("crawl", crawl_site(url))
+    endpoints = None if crawl.get("error") else crawl.get("endpoints")
+    sqli, xss = await asyncio.gather(
+        observe_scanner("sqli", check_sqli(url, endpoints)),
+        observe_scanner("xss", check_xss(url, endpoints)),
+    )
+    return crawl, sqli, xss
 
-def load_targets(path: str):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)["targets"]
-    except Exception as e:
-        print(f"[Error] No se pudo leer {path}: {e}")
-        return []
 
 async def scan_one(target: dict):
     host = target.get("host")
@@ -34,18 +48,21 @@ async def scan_one(target: dict):
     ports = target.get("ports", [80, 443])
 
     print(f"[+] Iniciando escaneo completo para: {host} ({url})")
+    trace = start_trace()
+    # Sondas HTTP y subprocesos recortan sus timeouts a este límite
+    set_deadline(SCAN_DEADLINE_S)
     
     try:
         # Ejecutar TODOS los escáneres en paralelo usando asyncio.gather
         # Esto es muy eficiente porque espera todas las respuestas de red a la vez
         results = await asyncio.gather(
-            scan_host(host, ports),        # 0. Puertos
-            asyncio.to_thread(tls_info, host), # 1. TLS (síncrono envuelto en hilo)
-            check_headers(url),            # 2. Headers HTTP
-            check_sqli(url),               # 3. SQL Injection
-            check_xss(url),                # 4. XSS
-            check_directories(url)         # 5. Directorios ocultos
+            observe_scanner("ports", scan_host(host, ports)),              # 0. Puertos
+            observe_scanner("tls", tls_info(host)),                        # 1. TLS
+            observe_scanner("headers", check_headers(url)),                # 2. Headers HTTP
+            observe_scanner("directories", check_directories(url)),        # 3. Directorios ocultos
+            scan_injection(url),                                           # 4. Crawler + SQLi + XSS
         )
+        crawl, sqli, xss = results[4]
 
         # Desempaquetar resultados para guardar en JSON estructurado
         results_json = {
@@ -55,56 +72,74 @@ async def scan_one(target: dict):
             },
             "web": {
                 "headers": results[2],
-                "sqli": results[3],
-                "xss": results[4],
-                "directories": results[5]
+                "crawl": {
+                    "pages": crawl.get("pages", 0),
+                    "endpoints": len(crawl.get("endpoints") or []),
+                },
+                "sqli": sqli,
+                "xss": xss,
+                "directories": results[3]
             }
         }
         
         status = "completed"
         
         # Log simple de hallazgos en consola
-        n_vulns = len(results[3].get("findings", [])) + len(results[4].get("findings", [])) + len(results[5].get("findings", []))
-        print(f"[OK] {host} finalizado. {n_vulns} posibles problemas web detectados.")
+        counts = count_by_severity(extract_findings(results_json))
+        n_vulns = sum(n for sev, n in counts.items() if sev > Severity.INFO)
+        detail = ", ".join(f"{sev.name}: {counts[sev]}" for sev in reversed(Severity) if counts[sev])
+        print(f"[OK] {host} finalizado. {n_vulns} posibles problemas web detectados ({detail or 'ninguno'}).")
 
     except Exception as e:
         print(f"[ERROR] Falló el escaneo de {host}: {e}")
         traceback.print_exc()
         results_json = {"error": str(e)}
         status = "error"
+
+    SCANS_TOTAL.labels("scheduler", status).inc()
     
-    # Guardar en la Base de Datos
-    db: Session = SessionLocal()
+    # Guardar en la Base de Datos (write-behind: se agrupa con otros objetivos
+    # que terminen a la vez y volvemos solo tras el COMMIT)
     try:
-        db_result = ScanResult(
-            host=host, 
+        await get_writer().insert_result(
+            host=host,
             results=results_json,
-            status=status 
+            status=status,
+            rollup=status == "completed",
+            trace=finish_trace(trace),
         )
-        db.add(db_result)
-        db.commit()
         print(f"[DB] Resultado guardado exitosamente.")
     except Exception as db_e:
         print(f"[DB ERROR] No se pudo guardar en BD: {db_e}")
-    finally:
-        db.close()
 
-async def run_scan_cycle():
-    targets = load_targets(COMPANY_PROFILE_PATH)
-    if not targets:
-        print("[Info] No hay objetivos definidos en company.yaml")
-        return
+async def main():
+    start_metrics_server(METRICS_PORT)
+    register_queue("write_behind", lambda: get_writer().pending())
+
+    # Inventario persistente: BD + importación de company.yaml con recarga en caliente
+    inventory = TargetInventory()
+    await asyncio.to_thread(inventory.load_from_db, False)
+    try:
+        changes = await asyncio.to_thread(inventory.import_yaml, COMPANY_PROFILE_PATH, False)
+        print(f"[Inventory] {len(inventory)} objetivos ({changes}).")
+    except Exception as e:
+        print(f"[Error] No se pudo leer {COMPANY_PROFILE_PATH}: {e}")
+
+    coordinator = LeaseCoordinator() if SCHEDULER_MODE == "lease" else None
+    scheduler = Scheduler(scan_one, inventory.targets, coordinator=coordinator)
+    inventory.subscribe(scheduler.apply_changes)
+
+    await asyncio.gather(
+        scheduler.run_forever(),
+        inventory.watch(COMPANY_PROFILE_PATH),
+    )
 
-    # Escanear todos los objetivos en paralelo (cuidado con el ancho de banda si son muchos)
-    await asyncio.gather(*(scan_one(t) for t in targets))
-    print(f"--- Ciclo de escaneo completo. Esperando {SCAN_INTERVAL_MIN} min ---")
 
 if __name__ == "__main__":
     print("--- INICIANDO SCHEDULER PYMESEC ---")
     print("Esperando inicialización de BD...")
     time.sleep(5)
     init_db()
-    
-    while True:
-        asyncio.run(run_scan_cycle())
-        time.sleep(SCAN_INTERVAL_MIN * 60)
\ No newline at end of file
+
+    # Un único event loop de larga duración: cada objetivo sigue su propia cadencia
+    asyncio.run(main())
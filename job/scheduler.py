@@ -0,0 +1,320 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.inventory import InventoryChanges, target_key, target_network
+
+# Cadencia por defecto (minutos) si el objetivo no define `interval_min`
+SCAN_INTERVAL_MIN = int(os.getenv("SCAN_INTERVAL_MIN", "60"))
+# Escaneos simultáneos en total y por red (para no saturar un mismo segmento/enlace)
+MAX_CONCURRENT_SCANS = int(os.getenv("MAX_CONCURRENT_SCANS", "8"))
+MAX_SCANS_PER_NETWORK = int(os.getenv("MAX_SCANS_PER_NETWORK", "2"))
+# Jitter como fracción del intervalo (0.1 = ±10%)
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+# Política ante ejecuciones perdidas: skip | once | all
+SCHEDULER_CATCH_UP = os.getenv("SCHEDULER_CATCH_UP", "once")
+# Tope de ejecuciones de recuperación seguidas con la política "all"
+CATCH_UP_MAX_RUNS = int(os.getenv("CATCH_UP_MAX_RUNS", "3"))
+# Máximo tiempo dormido entre revisiones del calendario (segundos)
+SCHEDULER_TICK_S = float(os.getenv("SCHEDULER_TICK_S", "30"))
+# Cada cuánto se vuelve a leer el inventario de objetivos (segundos)
+SCHEDULER_RELOAD_S = float(os.getenv("SCHEDULER_RELOAD_S", "300"))
+# En modo reparto, cada cuánto se consultan objetivos vencidos en la BD (segundos)
+SCHEDULER_POLL_S = float(os.getenv("SCHEDULER_POLL_S", "5"))
+
+CATCH_UP_POLICIES = ("skip", "once", "all")
+
+
+def _phase(key: str) -> float:
+    """Fracción [0, 1) estable por objetivo: reparte los arranques a lo largo del intervalo."""
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class ScheduledTarget:
+    __slots__ = ("key", "target", "interval", "network", "catch_up", "slot", "next_run",
+                 "pending_catch_up", "running", "removed")
+
+    def __init__(self, target: dict, now: float):
+        self.key = target_key(target)
+        self.target = target
+        self.removed = False
+        self.running = False
+        self.pending_catch_up = 0
+        self.configure(target)
+        # Primer turno desfasado según el hash: carga uniforme a lo largo del intervalo
+        self.slot = now + _phase(self.key) * self.interval
+        self.next_run = self.slot
+
+    def configure(self, target: dict):
+        self.target = target
+        self.interval = max(float(target.get("interval_min", SCAN_INTERVAL_MIN)), 1.0) * 60
+        self.network = target_network(target)
+        policy = target.get("catch_up", SCHEDULER_CATCH_UP)
+        self.catch_up = policy if policy in CATCH_UP_POLICIES else "once"
+
+    def jittered(self, slot: float) -> float:
+        return slot + random.uniform(-SCHEDULER_JITTER, SCHEDULER_JITTER) * self.interval
+
+    def advance(self, now: float):
+        """Calcula el siguiente turno tras una ejecución (anclado a la rejilla, sin deriva)."""
+        if self.pending_catch_up > 0:
+            self.pending_catch_up -= 1
+            self.next_run = now
+            return
+        self.slot += self.interval
+        self.next_run = self.jittered(self.slot)
+
+    def missed_runs(self, now: float) -> int:
+        return int((now - self.slot) // self.interval) if now > self.slot else 0
+
+
+class Scheduler:
+    """
+    Planificador asíncrono de larga duración para los escaneos programados.
+
+    - Cadencia por objetivo (`interval_min` en company.yaml).
+    - Arranques repartidos por hash + jitter para evitar estampidas.
+    - Límite global y por red de escaneos simultáneos.
+    - Política de recuperación de turnos perdidos (`catch_up`: skip | once | all).
+
+    Con un `coordinator` (job/leases.py) el calendario vive en la BD y varios
+    workers se reparten el inventario reclamando objetivos con leases.
+    """
+
+    def __init__(
+        self,
+        scan_fn: Callable[[dict], Awaitable[None]],
+        load_fn: Callable[[], List[dict]],
+        max_concurrent: int = MAX_CONCURRENT_SCANS,
+        max_per_network: int = MAX_SCANS_PER_NETWORK,
+        coordinator=None,
+    ):
+        self.scan_fn = scan_fn
+        self.load_fn = load_fn
+        self.coordinator = coordinator
+        self.max_concurrent = max_concurrent
+        self.max_per_network = max_per_network
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._networks: Dict[str, asyncio.Semaphore] = {}
+        self._targets: Dict[str, ScheduledTarget] = {}
+        self._heap: List[tuple] = []
+        self._wakeup = asyncio.Event()
+        # Escaneos en curso por clave de objetivo
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._background: set = set()
+        self._stopping = False
+
+    # ---------- inventario ----------
+
+    def sync_targets(self, targets: List[dict]):
+        """Aplica el inventario actual: altas, cambios de configuración y bajas."""
+        now = time.time()
+        seen = set()
+        for t in targets:
+            if not t.get("host"):
+                continue
+            key = target_key(t)
+            seen.add(key)
+            st = self._targets.get(key)
+            if st is None:
+                st = ScheduledTarget(t, now)
+                self._targets[key] = st
+                self._push(st)
+            else:
+                old_interval = st.interval
+                st.configure(t)
+                if st.interval != old_interval and not st.running:
+                    st.slot = now + _phase(key) * st.interval
+                    st.next_run = st.slot
+                    self._push(st)
+        for key in list(self._targets):
+            if key not in seen:
+                self._targets.pop(key).removed = True
+        self._wakeup.set()
+
+    def apply_changes(self, changes: InventoryChanges):
+        """
+        Suscriptor de eventos del inventario: aplica solo las altas, cambios y
+        bajas notificadas, sin recorrer el inventario completo.
+        """
+        now = time.time()
+        for t in changes.added + changes.modified:
+            key = target_key(t)
+            st = self._targets.get(key)
+            if st is None:
+                st = ScheduledTarget(t, now)
+                self._targets[key] = st
+                self._push(st)
+            else:
+                old_interval = st.interval
+                st.configure(t)
+                st.removed = False
+                if st.interval != old_interval and not st.running:
+                    st.slot = now + _phase(key) * st.interval
+                    st.next_run = st.slot
+                    self._push(st)
+        for key in changes.removed:
+            st = self._targets.pop(key, None)
+            if st is not None:
+                st.removed = True
+
+        if self.coordinator is not None:
+            changed = {target_key(t): t for t in changes.added + changes.modified}
+            first_runs = {k: self._targets[k].next_run for k in changed}
+            task = asyncio.create_task(asyncio.to_thread(
+                self.coordinator.sync_inventory, changed, first_runs, changes.removed, False
+            ))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        self._wakeup.set()
+
+    def _push(self, st: ScheduledTarget):
+        # Las entradas obsoletas del heap se descartan al sacarlas (next_run distinto)
+        heapq.heappush(self._heap, (st.next_run, st.key))
+
+    # ---------- despacho ----------
+
+    def _should_run(self, st: ScheduledTarget, now: float) -> bool:
+        """Aplica la política de turnos perdidos. False = no se ejecuta ahora (reprogramado)."""
+        missed = st.missed_runs(now)
+        if missed >= 1:
+            if st.catch_up == "skip":
+                # Saltamos los turnos perdidos y esperamos al siguiente de la rejilla
+                st.slot += (missed + 1) * st.interval
+                st.next_run = st.jittered(st.slot)
+                return False
+            if st.catch_up == "all":
+                st.pending_catch_up = min(missed, CATCH_UP_MAX_RUNS)
+            # "once" (y "all"): alineamos la rejilla y ejecutamos ya
+            st.slot += missed * st.interval
+        return True
+
+    def _start(self, st: ScheduledTarget):
+        st.running = True
+        task = asyncio.create_task(self._run_target(st))
+        self._tasks[st.key] = task
+        task.add_done_callback(lambda _t, key=st.key: self._tasks.pop(key, None))
+
+    def _dispatch_due(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            when, key = heapq.heappop(self._heap)
+            st = self._targets.get(key)
+            if st is None or st.removed or st.running or when != st.next_run:
+                continue
+            if not self._should_run(st, now):
+                self._push(st)
+                continue
+            self._start(st)
+
+    async def _dispatch_leased(self, now: float):
+        """Modo reparto: reclamamos en la BD solo lo que cabe en los huecos libres."""
+        rows = await asyncio.to_thread(
+            self.coordinator.claim, self.max_concurrent - len(self._tasks)
+        )
+        for row in rows:
+            st = self._targets.get(row.target_key)
+            if st is None:
+                # Objetivo del inventario de otro worker: usamos la config guardada
+                st = ScheduledTarget(row.target, now)
+                self._targets[row.target_key] = st
+            st.configure(row.target)
+            st.removed = False
+            st.slot = row.slot_at
+            st.next_run = row.next_run_at
+            st.pending_catch_up = row.catch_up_pending
+            if not self._should_run(st, now):
+                await asyncio.to_thread(
+                    self.coordinator.complete, st.key, st.next_run, st.slot,
+                    st.pending_catch_up, False,
+                )
+                continue
+            self._start(st)
+
+    async def _run_target(self, st: ScheduledTarget):
+        net_sem = self._networks.setdefault(
+            st.network, asyncio.Semaphore(self.max_per_network)
+        )
+        try:
+            # Primero la red: no ocupamos un hueco global mientras esperamos a la red
+            async with net_sem, self._global:
+                await self.scan_fn(st.target)
+        except asyncio.CancelledError:
+            print(f"[Scheduler] Escaneo de {st.key} cancelado (lease perdido).")
+            st.running = False
+            return
+        except Exception as e:
+            print(f"[Scheduler] Error escaneando {st.key}: {e}")
+
+        st.running = False
+        st.advance(time.time())
+        if self.coordinator is not None:
+            await asyncio.to_thread(
+                self.coordinator.complete, st.key, st.next_run, st.slot, st.pending_catch_up
+            )
+        elif not st.removed:
+            self._push(st)
+        self._wakeup.set()
+
+    async def _heartbeat_loop(self):
+        """Renueva los leases de los escaneos en curso; si se pierde uno, lo abandonamos."""
+        interval = max(self.coordinator.lease_ttl / 3, 1.0)
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            lost = await asyncio.to_thread(self.coordinator.heartbeat, list(self._tasks))
+            for key in lost:
+                task = self._tasks.get(key)
+                if task is not None:
+                    task.cancel()
+
+    async def _reload(self):
+        targets = self.load_fn()
+        self.sync_targets(targets)
+        if self.coordinator is not None:
+            now = time.time()
+            inventory = {}
+            first_runs = {}
+            for t in targets:
+                if t.get("host"):
+                    key = target_key(t)
+                    inventory[key] = t
+                    first_runs[key] = self._targets[key].next_run if key in self._targets else now
+            await asyncio.to_thread(self.coordinator.sync_inventory, inventory, first_runs)
+
+    async def run_forever(self):
+        await self._reload()
+        mode = f"reparto por leases ({self.coordinator.worker_id})" if self.coordinator else "local"
+        print(f"[Scheduler] {len(self._targets)} objetivos planificados. Modo: {mode}.")
+        heartbeat = asyncio.create_task(self._heartbeat_loop()) if self.coordinator else None
+        last_reload = time.time()
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                now = time.time()
+                if now - last_reload >= SCHEDULER_RELOAD_S:
+                    await self._reload()
+                    last_reload = now
+
+                delay = SCHEDULER_TICK_S
+                if self.coordinator is not None:
+                    await self._dispatch_leased(now)
+                    delay = min(delay, SCHEDULER_POLL_S)
+                else:
+                    self._dispatch_due(now)
+                    if self._heap:
+                        delay = min(delay, max(self._heap[0][0] - now, 0.0))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
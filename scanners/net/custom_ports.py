@@ -12,10 +12,12 @@ async def check_socket(ip, port, timeout=3.0): # <--- ¡CAMBIO AQUÍ! (Antes 0.5
     except:
         return None
 
-async def scan_ports_native(ip):
-    """Escanea puertos críticos de forma asíncrona."""
-    # Agregué algunos puertos extra por si acaso
-    target_ports = [21, 22, 23, 25, 53, 80, 110, 443, 3306, 3389, 5432, 8000, 8080, 8443, 3000, 5000]
+# Puertos críticos (agregué algunos extra por si acaso)
+TARGET_PORTS = [21, 22, 23, 25, 53, 80, 110, 443, 3306, 3389, 5432, 8000, 8080, 8443, 3000, 5000]
+
+async def scan_ports_native(ip, ports=None):
+    """Escanea puertos críticos de forma asíncrona (por defecto TARGET_PORTS)."""
+    target_ports = ports if ports is not None else TARGET_PORTS
     tasks = [check_socket(ip, p) for p in target_ports]
     results = await asyncio.gather(*tasks)
     return [p for p in results if p is not None]
@@ -0,0 +1,251 @@
+import os
+import re
+import ssl
+import struct
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.deadline import clamp
+
+# Tiempo máximo para conectar y para cada lectura corta
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 1.5
+# Puertos sondeados a la vez
+SERVICE_CONCURRENCY = int(os.getenv("SERVICE_CONCURRENCY", "64"))
+# Bytes leídos por respuesta (basta para banners y cabeceras de estado)
+READ_BYTES = 1024
+
+# Servicios mudos (esperan al cliente y no hablan HTTP): saludo según el puerto
+HINTS = {5432: "postgres", 6379: "redis"}
+
+WEB_SERVICES = ("http", "https")
+
+_ssl_ctx = ssl.create_default_context()
+_ssl_ctx.check_hostname = False
+_ssl_ctx.verify_mode = ssl.CERT_NONE
+
+
+# ============================================================
+#                  CONEXIÓN Y LECTURAS CORTAS
+# ============================================================
+
+async def _exchange(
+    host: str,
+    port: int,
+    hello: Optional[bytes] = None,
+    use_tls: bool = False,
+) -> Tuple[bool, bytes]:
+    """
+    Abre una conexión (TLS opcional), envía `hello` si lo hay y lee lo que
+    llegue en READ_TIMEOUT. Devuelve (conectó, bytes leídos).
+    """
+    writer = None
+    connected = False
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port,
+                ssl=_ssl_ctx if use_tls else None,
+                server_hostname=host if use_tls else None,
+            ),
+            timeout=clamp(CONNECT_TIMEOUT, 0.5),
+        )
+        connected = True
+        if hello:
+            writer.write(hello)
+            await writer.drain()
+        try:
+            data = await asyncio.wait_for(reader.read(READ_BYTES), timeout=clamp(READ_TIMEOUT, 0.2))
+        except asyncio.TimeoutError:
+            data = b""
+        return True, data
+    except (OSError, asyncio.TimeoutError, EOFError):
+        # Conectó pero cortó al recibir el saludo: cuenta como conectado y mudo
+        return connected, b""
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), timeout=0.5)
+            except Exception:
+                pass
+
+
+def _text(data: bytes, limit: int = 200) -> str:
+    """Banner legible: primera línea, sin caracteres de control."""
+    line = data.split(b"\n", 1)[0]
+    return re.sub(r"[^\x20-\x7e]+", " ", line.decode("latin-1")).strip()[:limit]
+
+
+# ============================================================
+#                 CLASIFICACIÓN DE RESPUESTAS
+# ============================================================
+
+def _classify_banner(port: int, data: bytes) -> Optional[Tuple[str, str]]:
+    """Servicios que hablan primero (SSH, FTP, SMTP, POP3, IMAP, MySQL, VNC)."""
+    if not data:
+        return None
+    if data.startswith(b"SSH-"):
+        return "ssh", _text(data)
+    if data.startswith(b"HTTP/"):
+        return "http", _text(data)
+    if data.startswith(b"+OK"):
+        return "pop3", _text(data)
+    if data.startswith(b"* OK"):
+        return "imap", _text(data)
+    if data.startswith(b"RFB "):
+        return "vnc", _text(data)
+    if data.startswith(b"220"):
+        text = _text(data)
+        if "FTP" in text.upper() or port == 21:
+            return "ftp", text
+        return "smtp", text
+    # MySQL/MariaDB: paquete de handshake (longitud de 3 bytes, secuencia 0, protocolo 10)
+    if len(data) > 5 and data[3] == 0 and data[4] == 10:
+        version = data[5:].split(b"\x00", 1)[0]
+        return "mysql", _text(version)
+    return "unknown", _text(data)
+
+
+def _is_http(data: bytes) -> bool:
+    return data.startswith(b"HTTP/")
+
+
+def _http_hello(host: str) -> bytes:
+    return f"HEAD / HTTP/1.0\r\nHost: {host}\r\nUser-Agent: PYMESec\r\n\r\n".encode("ascii")
+
+
+# SSLRequest de PostgreSQL: longitud 8 + código 80877103; responde 'S' o 'N'
+POSTGRES_SSL_REQUEST = struct.pack("!II", 8, 80877103)
+REDIS_PING = b"PING\r\n"
+
+
+# ============================================================
+#                    DETECCIÓN POR PUERTO
+# ============================================================
+
+def _decide(port: int, outcomes: Dict[str, Tuple[bool, bytes]]) -> Optional[Dict[str, Any]]:
+    """
+    Veredicto con las sondas terminadas hasta ahora; None si aún no es
+    concluyente (hay que esperar a las demás).
+    """
+    tls = outcomes.get("tls")
+    if tls is not None and tls[0]:
+        data = tls[1]
+        if _is_http(data):
+            return {"service": "https", "tls": True, "banner": _text(data)}
+        banner = _classify_banner(port, data)
+        if banner is not None and banner[0] != "unknown":
+            # IMAPS/POP3S/SMTPS: el banner llega ya dentro del túnel TLS
+            return {"service": banner[0], "tls": True, "banner": banner[1]}
+        return {"service": "tls", "tls": True, "banner": ""}
+
+    http = outcomes.get("http")
+    if http is not None and _is_http(http[1]):
+        # Un 400 en claro puede ser "HTTP plano en puerto HTTPS": decide el handshake
+        if not http[1][9:12] == b"400" or tls is not None:
+            return {"service": "http", "tls": False, "banner": _text(http[1])}
+
+    passive = outcomes.get("passive")
+    if passive is not None:
+        banner = _classify_banner(port, passive[1])
+        if banner is not None:
+            return {"service": banner[0], "tls": False, "banner": banner[1]}
+    return None
+
+
+async def probe_service(host: str, port: int) -> Dict[str, Any]:
+    """
+    Identifica el servicio de un puerto abierto con lecturas cortas y
+    saludos específicos de cada protocolo. Tres sondas a la vez, cada una
+    en su conexión, y gana la primera concluyente:
+
+      - lectura pasiva: SSH, FTP, SMTP, POP3, IMAP, MySQL y VNC hablan primero;
+      - HEAD / en claro: un servidor HTTP responde sin esperar a la pasiva;
+      - handshake TLS (y HEAD / dentro del túnel).
+
+    Si ninguna lo es (servicio mudo), saludos de BD según el puerto
+    (SSLRequest de PostgreSQL, PING de Redis).
+
+    Devuelve {"port", "service", "tls", "banner"}; service "unknown" si
+    nada encaja y "closed" si ya no acepta conexiones.
+    """
+    result = {"port": port, "service": "unknown", "tls": False, "banner": ""}
+
+    hello = _http_hello(host)
+    pending = {
+        asyncio.ensure_future(_exchange(host, port)): "passive",
+        asyncio.ensure_future(_exchange(host, port, hello)): "http",
+        asyncio.ensure_future(_exchange(host, port, hello, use_tls=True)): "tls",
+    }
+    outcomes: Dict[str, Tuple[bool, bytes]] = {}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcomes[pending.pop(task)] = task.result()
+            verdict = _decide(port, outcomes)
+            if verdict is not None:
+                result.update(verdict)
+                return result
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if not any(connected for connected, _data in outcomes.values()):
+        result["service"] = "closed"
+        return result
+
+    hint = HINTS.get(port)
+    if hint == "postgres":
+        _ok, data = await _exchange(host, port, POSTGRES_SSL_REQUEST)
+        if data[:1] in (b"S", b"N"):
+            result["service"] = "postgres"
+    elif hint == "redis":
+        _ok, data = await _exchange(host, port, REDIS_PING)
+        if data.startswith((b"+PONG", b"-NOAUTH", b"-ERR")):
+            result["service"], result["banner"] = "redis", _text(data)
+    return result
+
+
+def web_url(host: str, service: Dict[str, Any]) -> Optional[str]:
+    """URL de un servicio web del mapa (sin puerto si es el por defecto)."""
+    scheme = service.get("service")
+    if scheme not in WEB_SERVICES:
+        return None
+    port = service["port"]
+    default = 443 if scheme == "https" else 80
+    # IPv6: la dirección va entre corchetes para no confundirla con el puerto
+    netloc = f"[{host}]" if ":" in host else host
+    return f"{scheme}://{netloc}" if port == default else f"{scheme}://{netloc}:{port}"
+
+
+async def detect_services(host: str, ports: List[int]) -> Dict[str, Any]:
+    """
+    Sondea todos los puertos a la vez (hasta SERVICE_CONCURRENCY) y devuelve
+    el mapa de servicios:
+
+        {"services": [{"port", "service", "tls", "banner"}, ...],
+         "web": [url, ...], "tls_ports": [...]}
+
+    Las etapas web solo reciben las URLs de "web"; TLS solo "tls_ports".
+    """
+    semaphore = asyncio.Semaphore(SERVICE_CONCURRENCY)
+
+    async def bounded(port):
+        async with semaphore:
+            return await probe_service(host, port)
+
+    services = await asyncio.gather(*(bounded(p) for p in sorted(set(ports))))
+    services = [s for s in services if s["service"] != "closed"]
+
+    # HTTPS primero, y dentro de cada esquema los puertos por defecto
+    ranked = sorted(
+        (s for s in services if s["service"] in WEB_SERVICES),
+        key=lambda s: (s["service"] != "https", s["port"] not in (80, 443), s["port"]),
+    )
+    return {
+        "services": services,
+        "web": [web_url(host, s) for s in ranked],
+        "tls_ports": [s["port"] for s in services if s["tls"]],
+    }
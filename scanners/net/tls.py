@@ -2,26 +2,27 @@ import ssl
 import socket
 import asyncio
 
-async def tls_info(host):
+async def tls_info(host, port=443):
     """
     Obtiene información del certificado SSL/TLS de forma asíncrona.
     """
     # Ejecutamos la operación bloqueante de sockets en un hilo aparte
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _get_tls_sync, host)
+    return await loop.run_in_executor(None, _get_tls_sync, host, port)
 
-def _get_tls_sync(host):
+def _get_tls_sync(host, port=443):
     """Función interna síncrona para extraer el certificado"""
     try:
         ctx = ssl.create_default_context()
         ctx.check_hostname = False
         ctx.verify_mode = ssl.CERT_NONE
         
-        with socket.create_connection((host, 443), timeout=5) as sock:
+        with socket.create_connection((host, port), timeout=5) as sock:
             with ctx.wrap_socket(sock, server_hostname=host) as ssock:
                 cert = ssock.getpeercert()
                 if not cert:
-                    return None
+                    # Con CERT_NONE getpeercert() viene vacío: leemos el DER
+                    return _describe_der(ssock.getpeercert(binary_form=True), ssock.version())
                 
                 # Extraemos datos básicos
                 issuer = dict(x[0] for x in cert['issuer'])
@@ -32,3 +33,24 @@ def _get_tls_sync(host):
                 }
     except:
         return None
+
+def _describe_der(der, version):
+    """Datos básicos de un certificado en DER (con cryptography si está instalado)."""
+    if not der:
+        return None
+    info = {"issuer": "Desconocido", "expires": "N/A", "version": version}
+    try:
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+
+        cert = x509.load_der_x509_certificate(der)
+        orgs = cert.issuer.get_attributes_for_oid(NameOID.ORGANIZATION_NAME)
+        if orgs:
+            info["issuer"] = orgs[0].value
+        expires = getattr(cert, "not_valid_after_utc", None) or cert.not_valid_after
+        # Mismo formato que getpeercert(): 'Jan 01 00:00:00 2026 GMT'
+        info["expires"] = expires.strftime("%b %d %H:%M:%S %Y GMT")
+    except Exception:
+        # Sin cryptography (o DER raro) nos quedamos con la versión del protocolo
+        pass
+    return info
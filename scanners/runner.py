@@ -2,6 +2,15 @@ import asyncio
 import os
 import json
 import logging
+import math
+import signal
+import time
+
+from core.metrics import SUBPROCESS_WAIT, SUBPROCESS_RUN
+from core.trace import span, record_io
+from core.deadline import clamp, remaining
+from core.blobs import record_output
+from scanners.web.crawler import endpoint_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("PymeSecEngine") # Nombre más pro en los logs también
@@ -12,26 +21,115 @@ SQLMAP_PATH = os.path.join(TOOLS_PATH, "sqlmap", "sqlmap.py")
 XSSTRIKE_PATH = os.path.join(TOOLS_PATH, "xsstrike", "xsstrike.py")
 DIRSEARCH_PATH = os.path.join(TOOLS_PATH, "dirsearch", "dirsearch.py")
 
-async def run_cmd(cmd_list, timeout=180):
-    """Ejecutor genérico de comandos con timeout"""
+# XSStrike prueba una URL por ejecución: cuántos endpoints del crawler y cuántos a la vez
+XSSTRIKE_MAX_TARGETS = int(os.getenv("XSSTRIKE_MAX_TARGETS", "10"))
+XSSTRIKE_CONCURRENCY = int(os.getenv("XSSTRIKE_CONCURRENCY", "3"))
+# sqlmap -m: cuántas URLs del crawler como máximo y cuántas por ejecución (cada
+# lote tiene su propio timeout: uno que vence no se lleva por delante al resto)
+SQLMAP_MAX_TARGETS = int(os.getenv("SQLMAP_MAX_TARGETS", "30"))
+SQLMAP_BATCH_SIZE = int(os.getenv("SQLMAP_BATCH_SIZE", "10"))
+
+def _tool_name(cmd_list):
+    """Nombre corto de la herramienta para las métricas (sqlmap, dirsearch, nuclei...)."""
+    exe = os.path.basename(cmd_list[0]) if cmd_list else "unknown"
+    if exe.startswith("python") and len(cmd_list) > 1:
+        exe = os.path.basename(cmd_list[1])
+    return exe[:-3] if exe.endswith(".py") else exe
+
+def _kill_tree(process):
+    """Mata el proceso y todos sus hijos (sqlmap/dirsearch lanzan los suyos)."""
+    if process is None or process.returncode is not None:
+        return
     try:
-        process = await asyncio.create_subprocess_exec(
-            *cmd_list,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return stdout.decode(errors='ignore'), stderr.decode(errors='ignore')
-    except asyncio.TimeoutError:
-        try: process.kill() 
-        except: pass
-        return "", "Timeout"
-    except Exception as e:
-        return "", str(e)
+        if hasattr(os, "killpg"):
+            # Cada herramienta arranca en su propia sesión: su pid es el del grupo
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def _share(timeout, runs, concurrency=1):
+    """
+    Timeout de cada ejecución cuando una etapa lanza `runs` de `concurrency` en
+    `concurrency`: como mucho `timeout`, y nunca más de la parte que le toca
+    del tiempo que queda (el límite de la etapa, ver core/pipeline.py).
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    waves = max(1, math.ceil(runs / max(1, concurrency)))
+    return min(timeout, left / waves)
+
+async def run_cmd(cmd_list, timeout=180):
+    """
+    Ejecutor genérico de comandos con timeout. El timeout se recorta a lo
+    que quede del presupuesto del escaneo; si vence o la tarea se cancela,
+    se mata el árbol de procesos completo.
+
+    La salida cruda se guarda como evidencia (core/blobs.py) si la etapa
+    que llama la está recogiendo.
+    """
+    tool = _tool_name(cmd_list)
+    outcome = "error"
+    started = time.perf_counter()
+    running = None
+    process = None
+    timeout = clamp(timeout)
+    with span(tool, "subprocess") as current:
+        try:
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError
+            process = await asyncio.create_subprocess_exec(
+                *cmd_list,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=hasattr(os, "killpg"),
+            )
+            running = time.perf_counter()
+            SUBPROCESS_WAIT.labels(tool).observe(running - started)
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            record_io(0, len(stdout) + len(stderr))
+            outcome = "ok" if process.returncode == 0 else "exit_nonzero"
+            if outcome != "ok":
+                logger.warning(f"{tool} terminó con código {process.returncode}")
+            command = " ".join(cmd_list)[:1000]
+            for stream, data in (("stdout", stdout), ("stderr", stderr)):
+                await record_output(tool, stream, data, cmd=command, exit_code=process.returncode)
+            return stdout.decode(errors='ignore'), stderr.decode(errors='ignore')
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning(f"{tool} superó el timeout de {timeout}s")
+            _kill_tree(process)
+            return "", "Timeout"
+        except asyncio.CancelledError:
+            # Escaneo cancelado o fuera de plazo: no dejamos huérfanos gastando CPU
+            outcome = "cancelled"
+            _kill_tree(process)
+            raise
+        except FileNotFoundError as e:
+            outcome = "not_found"
+            logger.error(f"{tool} no está instalado: {e}")
+            return "", str(e)
+        except Exception as e:
+            logger.error(f"{tool} falló: {e}")
+            return "", str(e)
+        finally:
+            SUBPROCESS_RUN.labels(tool, outcome).observe(
+                time.perf_counter() - (running or started)
+            )
+            if current is not None:
+                current.args["outcome"] = outcome
+                if running is not None:
+                    current.args["spawn_ms"] = round((running - started) * 1000, 1)
 
 # --- 1. MOTOR DE VULNERABILIDADES (Antes Nuclei) ---
-async def scan_nuclei(target):
+# `tags` viene del fingerprinting (scanners/web/fingerprint.py): solo las
+# plantillas del stack detectado más las genéricas. None = todas.
+async def scan_nuclei(target, tags=None):
     cmd = ["nuclei", "-u", target, "-json", "-s", "critical,high"]
+    if tags:
+        cmd += ["-tags", ",".join(tags)]
     out, err = await run_cmd(cmd, timeout=200)
     
     findings = []
@@ -54,35 +152,75 @@ async def scan_dirsearch(target):
     temp_file = f"/tmp/dir_{os.urandom(4).hex()}.json"
     cmd = ["python3", DIRSEARCH_PATH, "-u", target, "--format=json", "-o", temp_file, "-x", "400-599", "--max-time", "60"]
     
-    await run_cmd(cmd, timeout=70)
+    try:
+        await run_cmd(cmd, timeout=70)
+    except asyncio.CancelledError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
     
     findings = []
     if os.path.exists(temp_file):
         try:
-            with open(temp_file) as f:
-                data = json.load(f)
-                results = data.get("results", [])
-                for res in results:
-                    findings.append({
-                        "severity": "MEDIA",
-                        "name": "Recurso Oculto Expuesto",
-                        "description": f"El módulo de estructura web detectó una ruta sensible accesible: {res.get('path')} (Código {res.get('status')})",
-                        "mitigation": "Restringir acceso o eliminar si no es necesario."
-                    })
-        except: pass
-        os.remove(temp_file)
+            with open(temp_file, "rb") as f:
+                report = f.read()
+            # El informe JSON es la evidencia de dirsearch (su stdout es solo progreso)
+            await record_output("dirsearch", "report", report, cmd=" ".join(cmd)[:1000])
+            data = json.loads(report)
+            results = data.get("results", [])
+            for res in results:
+                findings.append({
+                    "severity": "MEDIA",
+                    "name": "Recurso Oculto Expuesto",
+                    "description": f"El módulo de estructura web detectó una ruta sensible accesible: {res.get('path')} (Código {res.get('status')})",
+                    "mitigation": "Restringir acceso o eliminar si no es necesario."
+                })
+        except Exception:
+            pass  # informe ilegible (la cancelación sí se propaga)
+        finally:
+            os.remove(temp_file)
     return findings
 
 # --- 3. MOTOR DE INTEGRIDAD DE BASE DE DATOS (Antes SQLMap) ---
-async def scan_sqlmap(target):
-    # --crawl=2 y --level=2 para profundidad media
-    cmd = ["python3", SQLMAP_PATH, "-u", target, "--batch", "--crawl=2", "--level=2", "--risk=1"]
-    out, err = await run_cmd(cmd, timeout=600)
-    
+# `endpoints` es el inventario del crawler compartido (scanners/web/crawler.py).
+# Con él, sqlmap no rastrea por su cuenta; si es None (crawler no disponible
+# o fallido) vuelve a su propio --crawl.
+async def scan_sqlmap(target, endpoints=None):
+    base = ["python3", SQLMAP_PATH, "--batch", "--level=2", "--risk=1"]
+    batches = []
+    if endpoints is None:
+        # --crawl=2 y --level=2 para profundidad media
+        runs = [base + ["-u", target, "--crawl=2"]]
+    else:
+        # GET con parámetros tal cual; para los formularios POST, la página que
+        # los contiene con --forms (sqlmap los parsea y prueba)
+        urls = [endpoint_url(ep) for ep in endpoints if ep["method"] == "GET"]
+        form_pages = [ep["source"] for ep in endpoints if ep["method"] == "POST"]
+        targets = list(dict.fromkeys(urls + form_pages))[:SQLMAP_MAX_TARGETS]
+        batches = [targets[i:i + SQLMAP_BATCH_SIZE] for i in range(0, len(targets), SQLMAP_BATCH_SIZE)]
+        runs = [] if batches else [base + ["-u", target]]
+
+    outputs = []
+    for i, batch in enumerate(batches):
+        bulk_file = f"/tmp/sqlmap_{os.urandom(4).hex()}.txt"
+        with open(bulk_file, "w") as f:
+            f.write("\n".join(batch) + "\n")
+        cmd = base + ["-m", bulk_file]
+        if any(page in batch for page in form_pages):
+            cmd.append("--forms")
+        try:
+            # Se recalcula en cada lote: lo que no gastó uno queda para los siguientes
+            out, err = await run_cmd(cmd, timeout=_share(600, len(batches) - i))
+        finally:
+            if os.path.exists(bulk_file):
+                os.remove(bulk_file)
+        outputs.append(out + err)
+    for cmd in runs:
+        out, err = await run_cmd(cmd, timeout=_share(600, 1))
+        outputs.append(out + err)
+
     findings = []
-    full_text = out + err
-    
-    if "Parameter:" in full_text and "Type:" in full_text:
+    if any("Parameter:" in text and "Type:" in text for text in outputs):
         findings.append({
             "severity": "CRITICA",
             "name": "Inyección SQL (SQLi)",
@@ -93,17 +231,43 @@ async def scan_sqlmap(target):
     return findings
 
 # --- 4. MOTOR HEURÍSTICO DE SCRIPTS (Antes XSStrike) ---
-async def scan_xsstrike(target):
-    cmd = ["python3", XSSTRIKE_PATH, "-u", target, "--crawl", "-l", "1", "--skip"]
-    out, err = await run_cmd(cmd, timeout=180)
-    
+def _xsstrike_cmd(endpoint):
+    cmd = ["python3", XSSTRIKE_PATH, "-u"]
+    if endpoint["method"] == "POST":
+        query = endpoint_url(endpoint).partition("?")[2]
+        return cmd + [endpoint["url"], "--data", query, "--skip"]
+    return cmd + [endpoint_url(endpoint), "--skip"]
+
+async def scan_xsstrike(target, endpoints=None):
+    if endpoints is None:
+        # Sin inventario del crawler: XSStrike rastrea por su cuenta
+        runs = [(target, ["python3", XSSTRIKE_PATH, "-u", target, "--crawl", "-l", "1", "--skip"])]
+    elif not endpoints:
+        runs = [(target, ["python3", XSSTRIKE_PATH, "-u", target, "--skip"])]
+    else:
+        runs = [(ep["url"], _xsstrike_cmd(ep)) for ep in endpoints[:XSSTRIKE_MAX_TARGETS]]
+
+    semaphore = asyncio.Semaphore(XSSTRIKE_CONCURRENCY)
+    # Cada ejecución tiene su parte del tiempo de la etapa: las que vencen no
+    # aportan nada, pero los resultados de las demás se conservan
+    timeout = _share(180, len(runs), XSSTRIKE_CONCURRENCY)
+
+    async def run_one(cmd):
+        async with semaphore:
+            out, err = await run_cmd(cmd, timeout=timeout)
+            return out
+
+    outputs = await asyncio.gather(*(run_one(cmd) for _url, cmd in runs))
+    vulnerable = [url for (url, _cmd), out in zip(runs, outputs) if "Vulnerable" in out]
+
     findings = []
-    if "Vulnerable" in out:
+    if vulnerable:
         findings.append({
             "severity": "ALTA",
             "name": "Cross-Site Scripting (XSS)",
             # Ocultamos "XSStrike"
-            "description": "El análisis heurístico de comportamiento detectó que la aplicación refleja entradas de usuario sin filtrar, permitiendo la ejecución de JavaScript malicioso.",
+            "description": "El análisis heurístico de comportamiento detectó que la aplicación refleja entradas de usuario sin filtrar, permitiendo la ejecución de JavaScript malicioso."
+            + (f" Endpoints afectados: {', '.join(dict.fromkeys(vulnerable))}." if endpoints else ""),
             "mitigation": "Aplicar codificación de salida (Output Encoding) y configurar cabeceras CSP."
         })
     return findings
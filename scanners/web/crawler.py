@@ -0,0 +1,292 @@
+import os
+import asyncio
+import hashlib
+import posixpath
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+
+from core.metrics import probe_timer
+from core.deadline import clamp, expired
+
+# Profundidad del rastreo (0 = solo la URL inicial) y páginas máximas por escaneo
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "2"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "150"))
+# Peticiones simultáneas contra el objetivo
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+# Endpoints (con parámetros) que se entregan a los escáneres de inyección
+CRAWL_MAX_ENDPOINTS = int(os.getenv("CRAWL_MAX_ENDPOINTS", "200"))
+# Bytes de HTML que se leen por página
+CRAWL_MAX_BYTES = 1024 * 1024
+
+PROBE_TIMEOUT = 10.0
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Recursos que no contienen enlaces ni formularios
+SKIP_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp", ".bmp",
+    ".css", ".js", ".map", ".woff", ".woff2", ".ttf", ".eot",
+    ".pdf", ".zip", ".gz", ".tar", ".rar", ".7z", ".exe", ".dmg",
+    ".mp3", ".mp4", ".avi", ".mov", ".webm", ".doc", ".docx", ".xls", ".xlsx",
+)
+
+# Campos de formulario que no son entradas del usuario
+SKIP_INPUT_TYPES = {"submit", "button", "image", "reset", "file"}
+
+
+# ============================================================
+#                 NORMALIZACIÓN Y DEDUPLICACIÓN
+# ============================================================
+
+def normalize_url(href: str, base: Optional[str] = None) -> Optional[str]:
+    """
+    Forma canónica de un enlace: absoluta, esquema y host en minúsculas, sin
+    puerto por defecto ni fragmento y con la query ordenada. Devuelve None
+    para lo que no es http(s) (mailto:, javascript:, data:...).
+    """
+    raw = (href or "").strip()
+    if not raw:
+        return None
+    try:
+        parts = urlsplit(urljoin(base, raw) if base else raw)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        port = parts.port
+    except ValueError:
+        return None
+    if scheme not in DEFAULT_PORTS or not host:
+        return None
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+    path = parts.path or "/"
+    if "/." in path:
+        # /a/../b -> /b (urljoin solo lo resuelve en enlaces relativos)
+        trailing = path.endswith("/")
+        path = "/" + posixpath.normpath(path).lstrip("/")
+        if trailing and not path.endswith("/"):
+            path += "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def _shape(method: str, url: str, params) -> str:
+    # /item?id=1 y /item?id=2 son el mismo endpoint: cuentan los nombres, no los valores
+    return f"{method} {url} {','.join(sorted(params))}"
+
+
+class SeenSet:
+    """
+    Conjunto de "ya visto" compacto: guarda un hash de 64 bits por clave en
+    vez de la URL completa, así miles de URLs largas ocupan poca memoria.
+    """
+
+    __slots__ = ("_hashes",)
+
+    def __init__(self):
+        self._hashes = set()
+
+    def add(self, key: str) -> bool:
+        """Añade la clave; devuelve False si ya estaba."""
+        h = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+        if h in self._hashes:
+            return False
+        self._hashes.add(h)
+        return True
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+# ============================================================
+#                 EXTRACCIÓN DE ENLACES Y FORMULARIOS
+# ============================================================
+
+class _PageParser(HTMLParser):
+    """Enlaces (a, area, iframe, frame) y formularios con sus campos."""
+
+    LINK_ATTRS = {"a": "href", "area": "href", "iframe": "src", "frame": "src"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links: List[str] = []
+        self.forms: List[Dict[str, Any]] = []
+        self._form: Optional[Dict[str, Any]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self.LINK_ATTRS:
+            value = attrs.get(self.LINK_ATTRS[tag])
+            if value:
+                self.links.append(value)
+        elif tag == "form":
+            self._form = {
+                "action": attrs.get("action") or "",
+                "method": (attrs.get("method") or "GET").upper(),
+                "params": {},
+            }
+            self.forms.append(self._form)
+        elif self._form is not None and tag in ("input", "textarea", "select"):
+            name = attrs.get("name")
+            if name and (attrs.get("type") or "text").lower() not in SKIP_INPUT_TYPES:
+                self._form["params"][name] = attrs.get("value") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._form = None
+
+
+def _endpoint(method: str, url: str, source: str) -> Tuple[str, Dict[str, Any]]:
+    # Separa la query de la URL: los escáneres inyectan en `params`
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query, keep_blank_values=True))
+    base = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+    endpoint = {"method": method, "url": base, "params": params, "source": source}
+    return _shape(method, base, params), endpoint
+
+
+def endpoints_from_url(url: str) -> List[Dict[str, Any]]:
+    """Inventario mínimo sin rastreo: la propia URL si trae parámetros GET."""
+    normalized = normalize_url(url if "://" in url else f"http://{url}")
+    if normalized is None or not urlsplit(normalized).query:
+        return []
+    return [_endpoint("GET", normalized, normalized)[1]]
+
+
+def endpoint_url(endpoint: Dict[str, Any], params: Optional[Dict[str, str]] = None) -> str:
+    """URL del endpoint con sus parámetros en la query (solo GET)."""
+    query = urlencode(params if params is not None else endpoint["params"])
+    return f"{endpoint['url']}?{query}" if query else endpoint["url"]
+
+
+def build_request(endpoint: Dict[str, Any], name: str, value: str) -> Tuple[str, str, Optional[Dict[str, str]]]:
+    """(método, url, form-data) con el parámetro `name` sustituido por `value`."""
+    params = dict(endpoint["params"])
+    params[name] = value
+    if endpoint["method"] == "POST":
+        return "POST", endpoint["url"], params
+    return "GET", endpoint_url(endpoint, params), None
+
+
+# ============================================================
+#                         RASTREO
+# ============================================================
+
+async def _fetch(client: httpx.AsyncClient, url: str) -> Tuple[str, Optional[str]]:
+    """(url final, HTML) de la página; HTML None si no es HTML o falla."""
+    try:
+        with probe_timer("crawl") as probe:
+            async with client.stream("GET", url) as resp:
+                if "html" not in resp.headers.get("content-type", ""):
+                    return str(resp.url), None
+                chunks, size = [], 0
+                async for chunk in resp.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= CRAWL_MAX_BYTES:
+                        break
+                probe.nbytes = size
+                body = b"".join(chunks)
+                return str(resp.url), body.decode(resp.encoding or "utf-8", errors="ignore")
+    except Exception:
+        return url, None
+
+
+async def crawl_site(
+    url: str,
+    max_depth: int = CRAWL_MAX_DEPTH,
+    max_pages: int = CRAWL_MAX_PAGES,
+) -> Dict[str, Any]:
+    """
+    Rastrea el sitio en anchura (mismo host) y devuelve el inventario de
+    endpoints con parámetros (enlaces con query y formularios) para los
+    escáneres de inyección:
+
+        {"start": url, "pages": n, "endpoints": [
+            {"method": "GET"|"POST", "url": ..., "params": {nombre: valor}, "source": página},
+        ], "truncated": bool}
+
+    Cada página y cada endpoint se visita una sola vez (SeenSet por forma:
+    método + ruta + nombres de parámetros).
+    """
+    start = normalize_url(url if "://" in url else f"http://{url}")
+    if start is None:
+        return {"start": url, "pages": 0, "endpoints": [], "error": "URL no válida"}
+    scope = urlsplit(start).netloc
+
+    pages_seen = SeenSet()
+    endpoints_seen = SeenSet()
+    endpoints: List[Dict[str, Any]] = []
+    truncated = False
+
+    def add_endpoint(method: str, target: str, source: str):
+        nonlocal truncated
+        key, endpoint = _endpoint(method, target, source)
+        if not endpoint["params"] or not endpoints_seen.add(key):
+            return
+        if len(endpoints) >= CRAWL_MAX_ENDPOINTS:
+            truncated = True
+            return
+        endpoints.append(endpoint)
+
+    def in_scope(target: str) -> bool:
+        return urlsplit(target).netloc == scope
+
+    add_endpoint("GET", start, start)
+    pages_seen.add(_endpoint("GET", start, start)[0])
+    frontier = [start]
+    fetched = 0
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+
+    async def fetch(client, page):
+        async with semaphore:
+            return await _fetch(client, page)
+
+    async with httpx.AsyncClient(
+        verify=False, timeout=clamp(PROBE_TIMEOUT, 1.0), follow_redirects=True
+    ) as client:
+        for depth in range(max_depth + 1):
+            if not frontier or expired():
+                break
+            batch = frontier[: max(0, max_pages - fetched)]
+            truncated = truncated or len(batch) < len(frontier)
+            fetched += len(batch)
+            pages = await asyncio.gather(*(fetch(client, page) for page in batch))
+
+            frontier = []
+            for final_url, html in pages:
+                if html is None or not in_scope(final_url):
+                    continue
+                parser = _PageParser()
+                try:
+                    parser.feed(html)
+                except Exception:
+                    pass  # HTML roto: nos quedamos con lo extraído hasta el error
+
+                for href in parser.links:
+                    link = normalize_url(href, final_url)
+                    if link is None or not in_scope(link):
+                        continue
+                    add_endpoint("GET", link, final_url)
+                    path = urlsplit(link).path.lower()
+                    if depth < max_depth and not path.endswith(SKIP_EXTENSIONS):
+                        if pages_seen.add(_endpoint("GET", link, final_url)[0]):
+                            frontier.append(link)
+
+                for form in parser.forms:
+                    action = normalize_url(form["action"], final_url) or final_url
+                    if not in_scope(action):
+                        continue
+                    method = "POST" if form["method"] == "POST" else "GET"
+                    # La query de la acción y los campos se prueban juntos
+                    endpoint = _endpoint(method, action, final_url)[1]
+                    endpoint["params"].update(form["params"])
+                    add_endpoint(method, endpoint_url(endpoint), final_url)
+
+    return {
+        "start": start,
+        "pages": fetched,
+        "endpoints": endpoints,
+        "truncated": truncated,
+    }
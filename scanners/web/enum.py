@@ -2,6 +2,9 @@ import httpx
 import asyncio
 from typing import Dict, Any
 
+from core.metrics import probe_timer
+from core.deadline import clamp
+
 # Lista corta de rutas críticas para mantener el escaneo rápido
 PATHS_TO_CHECK = [
     "/.git/HEAD",
@@ -26,13 +29,15 @@ async def check_directories(base_url: str) -> Dict[str, Any]:
     if base_url.endswith("/"):
         base_url = base_url[:-1]
 
-    async with httpx.AsyncClient(verify=False, timeout=3.0) as client:
+    async with httpx.AsyncClient(verify=False, timeout=clamp(3.0, 0.5)) as client:
         
         # Función auxiliar para verificar una ruta
         async def check_path(path):
             url = f"{base_url}{path}"
             try:
-                resp = await client.get(url)
+                with probe_timer("directories") as probe:
+                    resp = await client.get(url)
+                    probe.nbytes = len(resp.content)
                 # Si devuelve 200 OK, es un hallazgo (potencialmente)
                 if resp.status_code == 200:
                     return f"Recurso expuesto encontrado: {path} (Status 200)"
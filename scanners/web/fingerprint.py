@@ -0,0 +1,228 @@
+import os
+import re
+import asyncio
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import httpx
+
+from core.metrics import probe_timer
+from core.deadline import clamp
+
+# Tags de nuclei que se ejecutan siempre que se filtra por tecnología:
+# plantillas genéricas que no dependen del stack. "cve" y las clases de
+# vulnerabilidad (rce, sqli, lfi...) mantienen los CVE críticos/altos sin tag
+# de fabricante; el filtro solo descarta plantillas propias de otros stacks
+NUCLEI_BASE_TAGS = [
+    t.strip()
+    for t in os.getenv(
+        "NUCLEI_BASE_TAGS",
+        "cve,exposure,misconfig,default-login,rce,sqli,lfi,ssrf,xss,unauth,takeover",
+    ).split(",")
+    if t.strip()
+]
+
+PROBE_TIMEOUT = 5.0
+# Bytes del cuerpo que se analizan por sonda
+PROBE_MAX_BYTES = 256 * 1024
+
+# ============================================================
+#                      FIRMAS DE TECNOLOGÍAS
+# ============================================================
+
+# tecnología -> tags de nuclei y evidencias que la delatan:
+#   headers: {cabecera: regex}      cookies: regex sobre los nombres
+#   body:    regex sobre el HTML de la portada
+#   probes:  {ruta: regex}          (cabeceras + cuerpo de esa ruta)
+#   ports:   puertos abiertos        tls: regex sobre el emisor del certificado
+SIGNATURES: Dict[str, Dict[str, Any]] = {
+    "apache": {"tags": ["apache"], "headers": {"server": r"apache(?!-coyote)"}},
+    "nginx": {"tags": ["nginx"], "headers": {"server": r"nginx"}},
+    "iis": {
+        "tags": ["iis", "microsoft"],
+        "headers": {"server": r"microsoft-iis", "x-aspnet-version": r".", "x-powered-by": r"asp\.net"},
+        "cookies": r"asp\.net_sessionid|aspxauth",
+    },
+    "litespeed": {"tags": ["litespeed"], "headers": {"server": r"litespeed"}},
+    "php": {
+        "tags": ["php"],
+        "headers": {"x-powered-by": r"php"},
+        "cookies": r"phpsessid",
+    },
+    "wordpress": {
+        "tags": ["wordpress", "wp-plugin", "wp-theme"],
+        "body": r"/wp-content/|/wp-includes/|<meta[^>]+generator[^>]+wordpress",
+        "headers": {"link": r"wp-json"},
+        "probes": {"/wp-login.php": r"wp-submit|user_login"},
+    },
+    "joomla": {
+        "tags": ["joomla"],
+        "body": r"<meta[^>]+generator[^>]+joomla|/media/jui/|com_content",
+        "probes": {"/administrator/": r"joomla"},
+    },
+    "drupal": {
+        "tags": ["drupal"],
+        "headers": {"x-generator": r"drupal", "x-drupal-cache": r"."},
+        "body": r"<meta[^>]+generator[^>]+drupal|drupal-settings-json|/sites/default/files/",
+    },
+    "magento": {"tags": ["magento"], "body": r"mage/cookies|/static/version\d+/frontend/", "cookies": r"^mage-"},
+    "prestashop": {"tags": ["prestashop"], "body": r"var prestashop\s*=", "cookies": r"^prestashop-"},
+    "tomcat": {
+        "tags": ["tomcat", "apache"],
+        "headers": {"server": r"apache-coyote|tomcat"},
+        "probes": {"/manager/html": r"tomcat manager|tomcat"},
+    },
+    "jenkins": {"tags": ["jenkins"], "headers": {"x-jenkins": r"."}},
+    "spring": {
+        "tags": ["springboot", "spring"],
+        "body": r"whitelabel error page",
+        "probes": {"/actuator": r"_links|actuator"},
+    },
+    "express": {"tags": ["nodejs", "express"], "headers": {"x-powered-by": r"express"}},
+    "django": {"tags": ["django", "python"], "cookies": r"csrftoken|django"},
+    "flask": {"tags": ["flask", "python"], "headers": {"server": r"werkzeug"}},
+    "laravel": {"tags": ["laravel", "php"], "cookies": r"laravel_session|xsrf-token"},
+    "rails": {"tags": ["rails", "ruby"], "headers": {"x-runtime": r"."}, "cookies": r"_session_id"},
+    "grafana": {"tags": ["grafana"], "body": r"grafana-app|window\.grafanabootdata"},
+    "gitlab": {"tags": ["gitlab"], "body": r"content=\"gitlab\"|gon\.gitlab_url", "cookies": r"_gitlab_session"},
+    "jira": {"tags": ["jira", "atlassian"], "headers": {"x-arequestid": r"."}, "body": r"ajs-jira|jira\.webresources"},
+    "confluence": {"tags": ["confluence", "atlassian"], "headers": {"x-confluence-request-time": r"."}},
+    # edge: CDN/proxy delante del origen; por sí sola no dice nada del stack
+    "cloudflare": {
+        "tags": ["cloudflare"],
+        "headers": {"server": r"cloudflare", "cf-ray": r"."},
+        "tls": r"cloudflare",
+        "edge": True,
+    },
+    "elasticsearch": {"tags": ["elasticsearch", "elastic"], "ports": [9200]},
+    "kibana": {"tags": ["kibana", "elastic"], "headers": {"kbn-name": r"."}, "ports": [5601]},
+    "redis": {"tags": ["redis"], "ports": [6379]},
+    "mongodb": {"tags": ["mongodb"], "ports": [27017]},
+    "mysql": {"tags": ["mysql"], "ports": [3306]},
+    "postgres": {"tags": ["postgres"], "ports": [5432]},
+    "ftp": {"tags": ["ftp"], "ports": [21]},
+}
+
+# Rutas que se sondean (además de la portada): las de las firmas
+PROBE_PATHS = sorted({path for sig in SIGNATURES.values() for path in sig.get("probes", {})})
+
+_COMPILED = {
+    name: {
+        "headers": {h: re.compile(rx, re.I) for h, rx in sig.get("headers", {}).items()},
+        "cookies": re.compile(sig["cookies"], re.I) if sig.get("cookies") else None,
+        "body": re.compile(sig["body"], re.I) if sig.get("body") else None,
+        "probes": {p: re.compile(rx, re.I) for p, rx in sig.get("probes", {}).items()},
+        "tls": re.compile(sig["tls"], re.I) if sig.get("tls") else None,
+    }
+    for name, sig in SIGNATURES.items()
+}
+
+
+# ============================================================
+#                           SONDAS
+# ============================================================
+
+async def _probe(client: httpx.AsyncClient, url: str) -> Optional[Dict[str, Any]]:
+    """Cabeceras, cookies y cuerpo (recortado) de una URL; None si falla."""
+    try:
+        with probe_timer("fingerprint") as probe:
+            async with client.stream("GET", url) as resp:
+                chunks, size = [], 0
+                async for chunk in resp.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= PROBE_MAX_BYTES:
+                        break
+                probe.nbytes = size
+                return {
+                    "status": resp.status_code,
+                    "headers": {k.lower(): v for k, v in resp.headers.items()},
+                    "cookies": [c.split("=", 1)[0].strip() for c in resp.headers.get_list("set-cookie")],
+                    "body": b"".join(chunks).decode(resp.encoding or "utf-8", errors="ignore"),
+                }
+    except Exception:
+        return None
+
+
+def _match(
+    headers: Dict[str, str],
+    cookies: List[str],
+    body: str,
+    probes: Dict[str, Dict[str, Any]],
+    ports: List[int],
+    tls: Optional[Dict[str, Any]],
+) -> Dict[str, List[str]]:
+    """tecnología -> evidencias encontradas."""
+    found: Dict[str, List[str]] = {}
+    issuer = str((tls or {}).get("issuer") or "")
+
+    for name, sig in _COMPILED.items():
+        evidence = []
+        for header, rx in sig["headers"].items():
+            value = headers.get(header)
+            if value and rx.search(value):
+                evidence.append(f"cabecera {header}: {value[:80]}")
+        if sig["cookies"] is not None:
+            evidence += [f"cookie {c}" for c in cookies if sig["cookies"].search(c)]
+        if sig["body"] is not None and body and sig["body"].search(body):
+            evidence.append("contenido de la portada")
+        for path, rx in sig["probes"].items():
+            res = probes.get(path)
+            # Solo respuestas "reales": un 404 personalizado no cuenta
+            if res and res["status"] in (200, 401, 403) and rx.search(res["body"] + str(res["headers"])):
+                evidence.append(f"ruta {path} ({res['status']})")
+        evidence += [f"puerto {p}" for p in SIGNATURES[name].get("ports", []) if p in ports]
+        if sig["tls"] is not None and sig["tls"].search(issuer):
+            evidence.append(f"emisor TLS: {issuer}")
+        if evidence:
+            found[name] = evidence
+    return found
+
+
+async def fingerprint(
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    tls: Optional[Dict[str, Any]] = None,
+    ports: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    Detecta servidor, lenguaje y CMS del objetivo reutilizando lo que ya
+    obtuvieron otras etapas (cabeceras de check_headers, datos TLS, puertos
+    abiertos) más la portada y unas pocas rutas delatoras. Devuelve los tags
+    de nuclei correspondientes:
+
+        {"technologies": {nombre: [evidencias]}, "tags": [...], "full_scan": bool}
+
+    full_scan=True (sin tecnologías del stack reconocidas) indica que conviene lanzar
+    todas las plantillas: filtrar a ciegas perdería cobertura.
+    """
+    ports = ports or []
+    base = url if url.endswith("/") else url + "/"
+
+    async with httpx.AsyncClient(verify=False, timeout=clamp(PROBE_TIMEOUT, 1.0), follow_redirects=True) as client:
+        results = await asyncio.gather(
+            _probe(client, url),
+            *(_probe(client, urljoin(base, path.lstrip("/"))) for path in PROBE_PATHS),
+        )
+    home = results[0] or {"headers": {}, "cookies": [], "body": ""}
+    probes = {path: res for path, res in zip(PROBE_PATHS, results[1:]) if res}
+
+    # Las cabeceras de check_headers completan las de la portada (p. ej. sin redirección)
+    merged = {k.lower(): v for k, v in (headers or {}).items()}
+    merged.update(home["headers"])
+
+    technologies = _match(merged, home["cookies"], home["body"], probes, ports, tls)
+
+    tags: List[str] = []
+    for name in technologies:
+        tags.extend(SIGNATURES[name]["tags"])
+    # Solo un CDN delante (o nada reconocido): no sabemos qué hay detrás
+    full_scan = all(SIGNATURES[name].get("edge") for name in technologies)
+    if not full_scan:
+        tags.extend(NUCLEI_BASE_TAGS)
+
+    return {
+        "technologies": technologies,
+        "tags": sorted(set(tags)),
+        "full_scan": full_scan,
+    }
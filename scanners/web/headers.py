@@ -1,5 +1,8 @@
 import aiohttp
 
+from core.metrics import probe_timer
+from core.deadline import clamp
+
 async def check_headers(url):
     """
     Analiza las cabeceras HTTP de seguridad.
@@ -10,7 +13,10 @@ async def check_headers(url):
     
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=5, ssl=False) as response:
+            with probe_timer("headers") as probe:
+                response = await session.get(url, timeout=clamp(5, 1), ssl=False)
+                probe.nbytes = response.content_length or 0
+            async with response:
                 headers = response.headers
                 # Convertimos a dict simple para el reporte
                 headers_analyzed = {k: v for k, v in headers.items()}
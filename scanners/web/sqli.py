@@ -1,67 +1,113 @@
 import httpx
 import asyncio
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+from core.metrics import probe_timer
+from core.deadline import clamp, expired
+from scanners.web.crawler import endpoints_from_url, build_request
 
 # Payloads básicos para detección
 ERROR_PAYLOADS = ["'", "\"", "' OR 1=1 --", "\" OR 1=1 --"]
 TIME_PAYLOADS = ["'; WAITFOR DELAY '0:0:5'--", "'; SLEEP(5)--", "' OR PG_SLEEP(5)--"]
 
+# Timeout de cada petición; las time-based necesitan el completo para no dar falsos positivos
+PROBE_TIMEOUT = 10.0
+
+# Parámetros probados a la vez, y cuántos reciben las pruebas time-based (lentas)
+SQLI_CONCURRENCY = 5
+SQLI_TIME_BASED_PARAMS = 5
+
 # Firmas de error comunes en el HTML
 SQL_ERRORS = [
     "SQL syntax", "MySQL Error", "Unclosed quotation mark", "ORA-", "PostgreSQL query failed"
 ]
 
-async def check_sqli(url: str) -> Dict[str, Any]:
+async def check_sqli(url: str, endpoints: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """
-    Intenta detectar vulnerabilidades SQL Injection (Error y Time-based) en parámetros URL.
+    Intenta detectar vulnerabilidades SQL Injection (Error y Time-based) en
+    cada parámetro de cada endpoint del inventario del crawler (enlaces y
+    formularios GET/POST). Sin inventario, prueba los parámetros GET de la URL.
     """
     findings = []
-    
-    # Si la URL no tiene parámetros, es difícil inyectar por GET (simplificación para MVP)
-    if "?" not in url:
+    if endpoints is None:
+        endpoints = endpoints_from_url(url)
+    targets = [(ep, name) for ep in endpoints for name in ep["params"]]
+
+    # Sin parámetros no hay dónde inyectar (simplificación para MVP)
+    if not targets:
         return {"url": url, "findings": [], "note": "No hay parámetros GET para probar SQLi"}
 
     try:
-        async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-            
+        semaphore = asyncio.Semaphore(SQLI_CONCURRENCY)
+
+        async with httpx.AsyncClient(verify=False, timeout=clamp(PROBE_TIMEOUT, 1.0)) as client:
+
             # 1. Detección basada en Errores (Error-Based)
-            for payload in ERROR_PAYLOADS:
-                # Inyectamos el payload al final de la URL (forma simple)
-                target = f"{url}{payload}"
-                try:
-                    resp = await client.get(target)
+            async def error_based(endpoint, name):
+                for payload in ERROR_PAYLOADS:
+                    if expired():
+                        return  # Sin presupuesto: devolvemos lo encontrado hasta ahora
+                    # Inyectamos el payload al final del valor del parámetro
+                    method, target, data = build_request(endpoint, name, endpoint["params"][name] + payload)
+                    try:
+                        async with semaphore:
+                            with probe_timer("sqli") as probe:
+                                resp = await client.request(method, target, data=data)
+                                probe.nbytes = len(resp.content)
+                    except Exception:
+                        continue # Seguir si falla una petición
                     text = resp.text.lower()
-                    for error in SQL_ERRORS:
-                        if error.lower() in text:
-                            findings.append(f"Posible SQLi (Error-Based) detectado con payload: {payload}")
-                            break
-                except Exception:
-                    continue # Seguir si falla una petición
+                    if any(error.lower() in text for error in SQL_ERRORS):
+                        findings.append(
+                            f"Posible SQLi (Error-Based) detectado en '{name}' "
+                            f"({method} {endpoint['url']}) con payload: {payload}"
+                        )
+                        return  # Un hallazgo por parámetro basta
+
+            await asyncio.gather(*(error_based(ep, name) for ep, name in targets))
 
             # 2. Detección basada en Tiempo (Time-Based)
             # Solo probamos si no hemos encontrado nada grave aún para ahorrar tiempo
-            if not findings:
+            # (y si queda presupuesto para esperar el sleep completo)
+            async def time_based(endpoint, name):
                 for payload in TIME_PAYLOADS:
-                    target = f"{url}{payload}"
-                    start_time = time.time()
+                    if clamp(PROBE_TIMEOUT) < PROBE_TIMEOUT:
+                        return
+                    method, target, data = build_request(endpoint, name, endpoint["params"][name] + payload)
                     try:
-                        await client.get(target)
-                        duration = time.time() - start_time
+                        async with semaphore:
+                            # El reloj arranca con la petición, no con la espera del semáforo
+                            start_time = time.time()
+                            with probe_timer("sqli") as probe:
+                                resp = await client.request(method, target, data=data, timeout=PROBE_TIMEOUT)
+                                probe.nbytes = len(resp.content)
+                            duration = time.time() - start_time
                         # Si tarda más de 4.5s (el sleep es 5s), es sospechoso
                         if duration > 4.5:
-                            findings.append(f"Posible Blind SQLi (Time-Based) detectado. Retraso de {duration:.2f}s con: {payload}")
-                            break 
+                            findings.append(
+                                f"Posible Blind SQLi (Time-Based) detectado en '{name}' "
+                                f"({method} {endpoint['url']}). Retraso de {duration:.2f}s con: {payload}"
+                            )
+                            return
                     except httpx.TimeoutException:
                         # Si da timeout, también puede ser indicador de que el sleep funcionó
-                        findings.append(f"Posible Blind SQLi (Timeout) con: {payload}")
-                        break
+                        findings.append(
+                            f"Posible Blind SQLi (Timeout) en '{name}' ({method} {endpoint['url']}) con: {payload}"
+                        )
+                        return
                     except Exception:
                         continue
 
+            if not findings:
+                await asyncio.gather(
+                    *(time_based(ep, name) for ep, name in targets[:SQLI_TIME_BASED_PARAMS])
+                )
+
             return {
                 "scan_type": "sqli",
                 "vulnerable": len(findings) > 0,
+                "tested": len(targets),
                 "findings": findings
             }
 
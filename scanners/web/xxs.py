@@ -1,34 +1,59 @@
 import httpx
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List, Optional
+
+from core.metrics import probe_timer
+from core.deadline import clamp
+from scanners.web.crawler import endpoints_from_url, build_request
 
 # Payload inofensivo pero detectable
 XSS_PAYLOAD = "<script>alert('PYMESEC')</script>"
 
-async def check_xss(url: str) -> Dict[str, Any]:
+# Parámetros probados a la vez
+XSS_CONCURRENCY = 5
+
+async def check_xss(url: str, endpoints: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """
-    Busca vulnerabilidades de XSS Reflejado en parámetros GET.
+    Busca vulnerabilidades de XSS Reflejado probando cada parámetro de cada
+    endpoint del inventario del crawler (enlaces y formularios GET/POST).
+    Sin inventario, prueba los parámetros GET de la propia URL.
     """
     findings = []
-    
-    if "?" not in url:
+    if endpoints is None:
+        endpoints = endpoints_from_url(url)
+    targets = [(ep, name) for ep in endpoints for name in ep["params"]]
+
+    if not targets:
         return {"url": url, "findings": [], "note": "No hay parámetros para probar XSS"}
 
     try:
-        # Construimos la URL inyectada. 
-        # En un caso real, deberíamos parsear cada parámetro. 
-        # Aquí concatenamos al final para probar el último parámetro o la query string.
-        target = f"{url}&test={XSS_PAYLOAD}" if "?" in url else f"{url}?test={XSS_PAYLOAD}"
-        
-        async with httpx.AsyncClient(verify=False, timeout=5.0) as client:
-            resp = await client.get(target)
-            
-            # Verificamos si el payload volvió en el cuerpo de la respuesta
-            if XSS_PAYLOAD in resp.text:
-                findings.append("XSS Reflejado detectado: El payload se reflejó en la respuesta sin sanitizar.")
-            
+        semaphore = asyncio.Semaphore(XSS_CONCURRENCY)
+
+        async with httpx.AsyncClient(verify=False, timeout=clamp(5.0, 1.0)) as client:
+
+            async def probe_param(endpoint, name):
+                # Sustituimos el valor del parámetro por el payload
+                method, target, data = build_request(endpoint, name, XSS_PAYLOAD)
+                async with semaphore:
+                    try:
+                        with probe_timer("xss") as probe:
+                            resp = await client.request(method, target, data=data)
+                            probe.nbytes = len(resp.content)
+                    except Exception:
+                        return
+                # Verificamos si el payload volvió en el cuerpo de la respuesta
+                if XSS_PAYLOAD in resp.text:
+                    findings.append(
+                        f"XSS Reflejado detectado en '{name}' ({method} {endpoint['url']}): "
+                        "el payload se reflejó en la respuesta sin sanitizar."
+                    )
+
+            await asyncio.gather(*(probe_param(ep, name) for ep, name in targets))
+
             return {
                 "scan_type": "xss",
                 "vulnerable": len(findings) > 0,
+                "tested": len(targets),
                 "findings": findings
             }
 
@@ -0,0 +1,26 @@
+# pymesec/tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# La BD se elige al importar core.db: SQLite temporal antes de cualquier import de core
+_tmp = tempfile.mkdtemp(prefix="pymesec-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("AUTH_SECRET", "test-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.db import Base, engine, init_db  # noqa: E402
+
+
+@pytest.fixture
+def db_tables():
+    """Esquema recién creado para cada test (las tablas se vacían al terminar)."""
+    init_db()
+    yield
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
@@ -0,0 +1,38 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from core import auth
+from core.auth import TokenError, _b64encode, _sign, decode_token, issue_token
+
+
+def _signed(claims) -> str:
+    header = _b64encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64encode(json.dumps(claims).encode())
+    return f"{header}.{payload}.{_sign(f'{header}.{payload}'.encode('ascii'))}"
+
+
+def test_round_trip():
+    token = issue_token(SimpleNamespace(id=7, email="a@b.c", company_name="Acme"))
+    claims = decode_token(token)
+    assert (claims["sub"], claims["company"]) == ("7", "Acme")
+
+
+@pytest.mark.parametrize("claims", [[1, 2], "x", 3, {"sub": "1", "exp": "nunca"}, {"sub": "1", "exp": [1]}])
+def test_malformed_signed_claims_are_token_errors(claims):
+    with pytest.raises(TokenError):
+        decode_token(_signed(claims))
+
+
+def test_tampered_signature():
+    token = issue_token(SimpleNamespace(id=7, email="a@b.c", company_name="Acme"))
+    with pytest.raises(TokenError):
+        decode_token(token[:-2] + ("AA" if not token.endswith("AA") else "BB"))
+
+
+def test_missing_secret_fails_fast(monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_SECRET", "")
+    monkeypatch.setattr(auth, "_secret", None)
+    with pytest.raises(RuntimeError):
+        auth.check_secret()
@@ -0,0 +1,14 @@
+import core.api as api
+
+
+def test_scheduler_enrollment_requires_allowlist(monkeypatch):
+    monkeypatch.setattr(api, "COMPANY_TARGET_ALLOWLIST", [])
+    assert not api._schedulable("203.0.113.10")
+
+    monkeypatch.setattr(api, "COMPANY_TARGET_ALLOWLIST", ["203.0.113.0/24", "pyme.example"])
+    assert api._schedulable("203.0.113.10")
+    assert api._schedulable("www.pyme.example")
+    assert api._schedulable("pyme.example")
+    assert not api._schedulable("169.254.169.254")
+    assert not api._schedulable("127.0.0.1")
+    assert not api._schedulable("evilpyme.example")
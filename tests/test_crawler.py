@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from scanners.web import crawler
+from scanners.web.crawler import SeenSet, build_request, crawl_site, endpoint_url, normalize_url
+
+
+@pytest.mark.parametrize("href, base, expected", [
+    ("HTTP://Example.COM:80/a?b=2&a=1#frag", None, "http://example.com/a?a=1&b=2"),
+    ("https://example.com:443", None, "https://example.com/"),
+    ("http://example.com:8080/x", None, "http://example.com:8080/x"),
+    ("../c?x=", "http://example.com/a/b/", "http://example.com/a/c?x="),
+    ("http://example.com/a/./b/../c/", None, "http://example.com/a/c/"),
+    ("mailto:a@b.c", None, None),
+    ("javascript:void(0)", "http://example.com/", None),
+    ("", "http://example.com/", None),
+    ("http://example.com:notaport/", None, None),
+])
+def test_normalize_url(href, base, expected):
+    assert normalize_url(href, base) == expected
+
+
+def test_seen_set():
+    seen = SeenSet()
+    assert seen.add("GET /a id") is True
+    assert seen.add("GET /a id") is False
+    assert len(seen) == 1
+
+
+def test_build_request_replaces_one_param():
+    get = {"method": "GET", "url": "http://h/item", "params": {"id": "1", "x": "y"}}
+    assert build_request(get, "id", "'") == ("GET", "http://h/item?id=%27&x=y", None)
+    post = {"method": "POST", "url": "http://h/login", "params": {"user": ""}}
+    assert build_request(post, "user", "a") == ("POST", "http://h/login", {"user": "a"})
+    assert endpoint_url({"url": "http://h/", "params": {}}) == "http://h/"
+
+
+SITE = {
+    "/": """
+        <a href="/item?id=1">1</a> <a href="/item?id=2">2</a> <a href="/item?b=2&a=1">ab</a>
+        <a href="/about#top">about</a> <a href="/about">again</a> <a href="/style.css?v=1">css</a>
+        <a href="http://other.test/x?q=1">fuera</a> <a href="mailto:x@y.z">mail</a>
+        <form action="/login" method="post">
+          <input name="user"><input type="password" name="password"><input type="submit" name="go">
+        </form>
+    """,
+    "/about": '<a href="/../item?id=3">otra</a> <a href="/search?q=x">buscar</a>',
+}
+
+
+def test_crawl_dedups_endpoints_by_shape(monkeypatch):
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        html = SITE.get(request.url.path, "<p>sin enlaces</p>")
+        return httpx.Response(200, text=html, headers={"content-type": "text/html"})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        crawler.httpx, "AsyncClient",
+        lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw),
+    )
+
+    inventory = asyncio.run(crawl_site("http://site.test"))
+    shapes = sorted((e["method"], e["url"], tuple(sorted(e["params"]))) for e in inventory["endpoints"])
+    assert shapes == [
+        ("GET", "http://site.test/item", ("a", "b")),
+        ("GET", "http://site.test/item", ("id",)),
+        ("GET", "http://site.test/search", ("q",)),
+        ("GET", "http://site.test/style.css", ("v",)),
+        ("POST", "http://site.test/login", ("password", "user")),
+    ]
+    assert inventory["truncated"] is False
+    # Una página por forma (/item?id=2 no se descarga tras /item?id=1); ni el
+    # CSS ni el host externo se descargan
+    assert sorted(requested) == [
+        "http://site.test/",
+        "http://site.test/about",
+        "http://site.test/item?a=1&b=2",
+        "http://site.test/item?id=1",
+        "http://site.test/search?q=x",
+    ]
@@ -0,0 +1,57 @@
+import pytest
+
+from core.findings import Finding, Severity, count_by_severity, dump_findings, load_findings, normalize_findings
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("CRITICAL", Severity.CRITICA),
+    ("Crítica", Severity.CRITICA),
+    ("high", Severity.ALTA),
+    ("ALTA", Severity.ALTA),
+    ("Medium", Severity.MEDIA),
+    ("media", Severity.MEDIA),
+    ("low", Severity.BAJA),
+    ("BAJA", Severity.BAJA),
+    ("informational", Severity.INFO),
+    ("", Severity.INFO),
+    (None, Severity.INFO),
+    (Severity.ALTA, Severity.ALTA),
+])
+def test_severity_parse(raw, expected):
+    assert Severity.parse(raw) is expected
+
+
+def test_severity_order_bucket_and_label():
+    assert Severity.CRITICA > Severity.ALTA > Severity.MEDIA > Severity.BAJA > Severity.INFO
+    assert (Severity.ALTA.bucket, Severity.ALTA.label) == ("high", "ALTO")
+
+
+def test_finding_round_trip_keeps_extra_keys():
+    raw = [
+        {"severity": "high", "name": "XSS", "description": "refleja q", "mitigation": "CSP",
+         "evidence": ["abc"], "url": "http://h/?q=1"},
+        {"severity": "CRITICA", "name": "SQLi", "description": "id", "mitigation": "Prepared"},
+    ]
+    findings = load_findings(raw)
+    dumped = dump_findings(findings)
+    assert dumped[0] == {**raw[0], "severity": "ALTA"}
+    assert dumped[1] == raw[1]
+    assert load_findings(dumped) == findings
+    assert [f.fingerprint for f in load_findings(dumped)] == [f.fingerprint for f in findings]
+
+
+def test_fingerprint_ignores_severity_and_mitigation():
+    a = Finding("high", "XSS", "refleja q", "CSP")
+    b = Finding("low", "XSS", "refleja q", "otra")
+    assert a.fingerprint == b.fingerprint
+    assert a != b
+
+
+def test_normalize_accepts_scanner_shapes():
+    assert normalize_findings(None) == []
+    assert normalize_findings({"error": "timeout"}) == []
+    assert len(normalize_findings({"severity": "LOW", "name": "x"})) == 1
+    [event] = normalize_findings(["texto libre"])
+    assert (event.severity, event.description) == (Severity.INFO, "texto libre")
+    counts = count_by_severity(normalize_findings([{"severity": "high", "name": "a"}, {"severity": "HIGH", "name": "b"}]))
+    assert counts[Severity.ALTA] == 2 and counts[Severity.INFO] == 0
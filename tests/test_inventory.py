@@ -0,0 +1,29 @@
+from core.db import SessionLocal, Target
+from core.inventory import TargetInventory, remove_api_target, upsert_api_target
+
+
+def _rows():
+    db = SessionLocal()
+    try:
+        return {t.target_key: (t.source, t.config) for t in db.query(Target)}
+    finally:
+        db.close()
+
+
+def test_api_target_never_overwrites_yaml_row(db_tables, tmp_path):
+    yaml_file = tmp_path / "company.yaml"
+    yaml_file.write_text("targets:\n  - host: 10.0.0.9\n    ports: [22, 80]\n")
+    TargetInventory().import_yaml(str(yaml_file), notify=False)
+
+    assert upsert_api_target({"host": "10.0.0.9", "tags": ["company-config", "user:1"]}) is False
+    assert _rows() == {"10.0.0.9|": ("yaml", {"host": "10.0.0.9", "ports": [22, 80]})}
+
+    assert remove_api_target("10.0.0.9") is False
+    assert "10.0.0.9|" in _rows()
+
+
+def test_api_target_upsert_and_remove(db_tables):
+    assert upsert_api_target({"host": "10.0.0.7", "tags": ["company-config"]}) is True
+    assert _rows()["10.0.0.7|"][0] == "api"
+    assert remove_api_target("10.0.0.7") is True
+    assert _rows() == {}
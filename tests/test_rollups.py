@@ -0,0 +1,78 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from core.db import RiskRollup, SessionLocal, User
+from core.rollups import TENANT_HOST, update_rollups
+
+WHEN = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def user(db_tables):
+    db = SessionLocal()
+    try:
+        db.add(User(id=1, name="Pyme", email="pyme@example.com", hashed_password="x"))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _results(*names):
+    return {"vulnerabilities": [{"severity": "HIGH", "name": n, "description": n} for n in names]}
+
+
+def _rows(user_id):
+    db = SessionLocal()
+    try:
+        return {
+            r.host: (r.scans, r.new_findings, r.resolved_findings, r.high)
+            for r in db.query(RiskRollup).filter(RiskRollup.user_id == user_id)
+        }
+    finally:
+        db.close()
+
+
+def _scan(user_id, host, results, when=WHEN):
+    db = SessionLocal()
+    try:
+        update_rollups(db, user_id, host, results, when=when)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_new_and_resolved_across_scans(user):
+    _scan(1, "h1", _results("a", "b"))
+    _scan(1, "h1", _results("b", "c"))
+    assert _rows(1)["h1"] == (2, 3, 1, 2)
+    assert _rows(1)[TENANT_HOST][0] == 2
+
+
+def test_concurrent_writers_share_one_row_per_day_and_scope(user):
+    writers, errors = 12, []
+    barrier = threading.Barrier(writers)
+
+    def run():
+        try:
+            barrier.wait()
+            _scan(1, "h1", _results("a"))
+        except Exception as e:  # pragma: no cover - se informa abajo
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    db = SessionLocal()
+    try:
+        days = db.query(RiskRollup.host, RiskRollup.day).filter(RiskRollup.user_id == 1).all()
+    finally:
+        db.close()
+    assert sorted(days) == sorted({(h, d) for h, d in days})  # sin filas duplicadas
+    assert _rows(1)["h1"][0] == writers
+    assert _rows(1)[TENANT_HOST][0] == writers
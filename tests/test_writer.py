@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+
+from core import writer as writer_mod
+from core.db import ScanEvent, SessionLocal
+from core.writer import WriteBehindBuffer
+
+
+def _events():
+    db = SessionLocal()
+    try:
+        return sorted(e.message for e in db.query(ScanEvent))
+    finally:
+        db.close()
+
+
+def test_failing_op_is_isolated_from_its_batch(db_tables):
+    async def scenario():
+        buf = WriteBehindBuffer(max_items=1000, interval_ms=50)
+        ok = [buf.append_event(1, 1, "Running", f"ok-{i}") for i in range(7)]
+        # user_id NOT NULL: solo esta operación debe fallar
+        bad = buf.append_event(None, 1, "Running", "bad")
+        results = await asyncio.gather(*ok, bad, return_exceptions=True)
+        await buf.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(seq, int) for seq in results[:7])
+    assert isinstance(results[7], Exception)
+    assert _events() == sorted(f"ok-{i}" for i in range(7))
+
+
+def test_lost_connection_fails_the_whole_batch_without_bisecting(monkeypatch):
+    calls = []
+
+    def broken(batch):
+        calls.append(len(batch))
+        raise writer_mod.DBAPIError("SELECT 1", None, Exception("conexión perdida"), connection_invalidated=True)
+
+    monkeypatch.setattr(writer_mod, "_flush_sync", broken)
+    outcome = writer_mod._flush_isolating([object()] * 8)
+    assert calls == [8]
+    assert [ok for ok, _ in outcome] == [False] * 8
+
+
+def test_close_waits_for_the_batch_being_flushed(db_tables, monkeypatch):
+    started = threading.Event()
+    real = writer_mod._flush_sync
+
+    def slow(batch):
+        started.set()
+        threading.Event().wait(0.3)
+        return real(batch)
+
+    monkeypatch.setattr(writer_mod, "_flush_sync", slow)
+
+    async def scenario():
+        buf = WriteBehindBuffer(max_items=1, interval_ms=10)
+        pending = asyncio.ensure_future(buf.append_event(1, 1, "Running", "en vuelo"))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        await buf.close()
+        return await asyncio.wait_for(pending, timeout=2)
+
+    assert isinstance(asyncio.run(scenario()), int)
+    assert _events() == ["en vuelo"]
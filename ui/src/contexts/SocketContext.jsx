@@ -1,32 +1,80 @@
-import React, { createContext, useContext, useEffect, useState } from 'react';
+import React, { createContext, useContext, useEffect, useRef, useState } from 'react';
 import { useAuth } from './AuthContext';
 
 const SocketContext = createContext();
 
 export const useSocket = () => useContext(SocketContext);
 
+// Espera entre reconexiones (se duplica en cada fallo hasta el máximo)
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+
 export const SocketProvider = ({ children }) => {
   const [socket, setSocket] = useState(null);
-  const { user, isLoggedIn } = useAuth();
+  const { user, isLoggedIn, token } = useAuth();
+  // Último seq recibido: al reconectar, el servidor reenvía lo que nos perdimos
+  const lastSeq = useRef(null);
+  const seqUser = useRef(null);
 
   useEffect(() => {
-    if (isLoggedIn && user) {
+    if (!(isLoggedIn && user && token)) return undefined;
+    if (seqUser.current !== user.id) {
+      // Otro usuario: sus seq no continúan los del anterior
+      lastSeq.current = null;
+      seqUser.current = user.id;
+    }
+
+    let ws = null;
+    let retryTimer = null;
+    let delay = RECONNECT_MIN_MS;
+    let stopped = false;
+
+    const connect = () => {
       // Detectar automáticamente la URL del WebSocket (ws://IP:50000/ws/status/ID)
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
       const host = window.location.host; // Obtiene '190.97...:50000'
-      const wsUrl = `${protocol}//${host}/ws/status/${user.id}`;
+      const since = lastSeq.current != null ? `?since=${lastSeq.current}` : '';
+      const wsUrl = `${protocol}//${host}/ws/status/${user.id}${since}`;
 
       console.log("Conectando WS a:", wsUrl);
-      const ws = new WebSocket(wsUrl);
+      ws = new WebSocket(wsUrl);
 
-      ws.onopen = () => console.log("WebSocket Conectado ✅");
-      ws.onclose = () => console.log("WebSocket Desconectado ❌");
+      // El servidor exige el token como primer mensaje (no va en la URL ni en los logs)
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ token }));
+        delay = RECONNECT_MIN_MS;
+        console.log("WebSocket Conectado ✅");
+      };
+      // addEventListener: las páginas usan onmessage para sus propios mensajes
+      ws.addEventListener('message', (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          if (typeof data.seq === 'number' && (lastSeq.current == null || data.seq > lastSeq.current)) {
+            lastSeq.current = data.seq;
+          }
+        } catch (e) {
+          // Mensaje no JSON: no lleva seq
+        }
+      });
+      ws.onclose = (event) => {
+        console.log("WebSocket Desconectado ❌");
+        // 1008 = token rechazado: reintentar no sirve hasta un nuevo login
+        if (stopped || event.code === 1008) return;
+        retryTimer = setTimeout(connect, delay);
+        delay = Math.min(delay * 2, RECONNECT_MAX_MS);
+      };
 
       setSocket(ws);
+    };
 
-      return () => ws.close();
-    }
-  }, [isLoggedIn, user]);
+    connect();
+
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (ws) ws.close();
+    };
+  }, [isLoggedIn, user, token]);
 
   return (
     <SocketContext.Provider value={socket}>
@@ -74,6 +74,16 @@ function Dashboard() {
       try {
         const data = JSON.parse(event.data);
 
+        // Reconexión tras perder demasiados eventos: el estado local ya no es
+        // fiable, se recarga el historial completo
+        if (data.status === 'Reset') {
+          evaluationService
+            .getHistory()
+            .then((h) => setHistory(Array.isArray(h) ? h : []))
+            .catch((error) => console.error('Error recargando historial:', error));
+          return;
+        }
+
         // Actualizar estado global
         setCurrentStatus({ status: data.status, message: data.message });
 